@@ -1,22 +1,19 @@
 import subprocess
 import shlex
 from src.neuroworkflow.base import Component, Work, Workflow, RunMetaData, CommandWork
+from src.neuroworkflow.staging import stage_file, COPY_STRATEGIES
+from src.neuroworkflow.sidecars import get_sidecar
 import os
-import shutil
 
 
 
 
 def copy_file(input_file, output_file):
-    shutil.copyfile(input_file[0], output_file[0])
+    stage_file(input_file[0], output_file[0], COPY_STRATEGIES) #reflink or kernel copy when possible, never a hardlink
 
 def get_slice_time(input_file, output_file):
-    import json
-    with open(input_file[0], 'r') as f:
-        data = json.load(f)
-        
-    slice_time = data['SliceTiming']
+    #looked up in SidecarIndex.shared(rootdir) if it is created before running, otherwise the sidecar is parsed once
+    slice_time = get_sidecar(input_file[0])['SliceTiming']
     
     with open(output_file[0], 'w') as f:
-        for timing in slice_time:
-            f.write(f'{timing}\n')
\ No newline at end of file
+        f.write(''.join(f'{timing}\n' for timing in slice_time))
\ No newline at end of file
@@ -0,0 +1,52 @@
+'''
+benchmark of digests of large inputs, sha256 of chunks read into python bytes compared with file_digest, and the second run answered by a DigestMemo
+
+files are written to a temporary directory, their mtime is set to the past so the memo keeps them
+
+python benchmarks/digest.py [number of files] [size of each file in MB]
+'''
+import os
+import sys
+import time
+import hashlib
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from neuroworkflow.digest import DigestMemo, digest_files, HASH_NAME
+
+
+def sha256_file(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 256
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for index in range(count):
+            path = os.path.join(directory, f"sub-{index:02d}_bold.nii.gz")
+            with open(path, 'wb') as f:
+                for _ in range(size):
+                    f.write(os.urandom(1 << 20))
+            os.utime(path, (time.time() - 60, time.time() - 60))
+            paths.append(path)
+
+        print(f"{count} files of {size} MB, hash {HASH_NAME}")
+        print(f"sha256, serial: {timed(lambda: [sha256_file(path) for path in paths]):.2f} s")
+        memo = DigestMemo(os.path.join(directory, 'digests.sqlite'))
+        print(f"digest_files, cold: {timed(digest_files, paths, memo):.2f} s")
+        print(f"digest_files, memo in memory: {timed(digest_files, paths, memo):.4f} s")
+        print(f"digest_files, memo in SQLite: {timed(digest_files, paths, DigestMemo(memo.path)):.4f} s")
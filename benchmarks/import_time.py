@@ -0,0 +1,43 @@
+'''
+benchmark of the cold start of importing neuroworkflow
+
+each import is run in a new python process, so nothing is cached in sys.modules. networkx and matplotlib are only imported when a graph is built or drawn, so importing the package and running flat works doesn't pay for them
+
+python benchmarks/import_time.py [repeat]
+'''
+import os
+import sys
+import subprocess
+import time
+
+src = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+statements = {
+    'import neuroworkflow': 'import neuroworkflow',
+    'from neuroworkflow import Work': 'from neuroworkflow import Work',
+    'import neuroworkflow.plan': 'import neuroworkflow.plan',
+    'import networkx': 'import networkx',
+    'Work + work_directed_graph': 'from neuroworkflow import Workflow; Workflow("w").work_directed_graph',
+}
+
+
+def cold_start(statement, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', statement], check = True, env = {**os.environ, 'PYTHONPATH': src})
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+if __name__ == '__main__':
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    baseline = cold_start('pass', repeat)
+    print(f"python startup: {baseline * 1000:.1f} ms")
+
+    for name, statement in statements.items():
+        print(f"{name}: {(cold_start(statement, repeat) - baseline) * 1000:.1f} ms")
+
+    modules = subprocess.run([sys.executable, '-c', 'import sys, neuroworkflow; neuroworkflow.Work; print("networkx" in sys.modules, "matplotlib" in sys.modules)'], capture_output = True, text = True, env = {**os.environ, 'PYTHONPATH': src}).stdout.split()
+    print(f"networkx imported by neuroworkflow: {modules[0]}, matplotlib imported: {modules[1]}")
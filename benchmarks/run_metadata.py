@@ -0,0 +1,45 @@
+'''
+benchmark of passing RunMetaData from workflow to works
+
+build a workflow of 1000 works in a chain and run it in preview mode, then compare RunMetaData.child with the deep copy used before for every work and every output component
+
+python benchmarks/run_metadata.py [n_works]
+'''
+import os
+import sys
+import tempfile
+import timeit
+from copy import deepcopy as dc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from neuroworkflow import Component, Work, Workflow, RunMetaData
+
+
+def copy_file(input_file, output_file):
+    pass
+
+
+def build_workflow(n_works):
+    components = [Component(desc = f'step{index}', suffix = 'bold', datatype = 'func', extension = 'nii', use_extension = True) for index in range(n_works + 1)]
+    works = [Work(f'work{index}', [components[index]], [components[index + 1]], action = copy_file) for index in range(n_works)]
+    return Workflow('benchmark', works), components[0]
+
+
+if __name__ == '__main__':
+    n_works = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    rootdir = tempfile.mkdtemp()
+
+    run_metadata = RunMetaData(rootdir, '001', preview = True)
+    workflow, first_component = build_workflow(n_works)
+    first_component.run_metadata = run_metadata
+    os.makedirs(first_component.run_dir())
+    first_component.make_test_file()
+
+    run_time = timeit.timeit(lambda: workflow.run(run_metadata), number = 1)
+    print(f"preview run of {n_works} works: {run_time:.3f} s")
+
+    nested = run_metadata.child('benchmark').child('work', ['derivatives'], ['data'])
+    child_time = timeit.timeit(lambda: nested.child('work'), number = 2 * n_works)
+    deepcopy_time = timeit.timeit(lambda: dc(nested), number = 2 * n_works)
+    print(f"{2 * n_works} RunMetaData.child: {child_time * 1000:.2f} ms")
+    print(f"{2 * n_works} deepcopy of RunMetaData: {deepcopy_time * 1000:.2f} ms ({deepcopy_time / child_time:.1f}x)")
@@ -1,32 +1,97 @@
 import argparse
 import os
 import inspect
+import importlib
 from config import *
 import logging
+from src.neuroworkflow import run_batch
+
+
+def load_workflow(path):
+    '''
+    load a workflow from 'module:attribute'
+    '''
+    module_name, _, attribute = path.partition(':')
+    if not attribute:
+        raise ValueError(f"workflow {path} should be given as 'module:attribute'")
+    return getattr(importlib.import_module(module_name), attribute)
+
+
+def override_config(config, args):
+    '''
+    get_config only fills keys missing from config.json, batch arguments given in the command line overwrite it
+    a value given as 0(e.g. --jobs 0) is still given, a store_true flag is only given if it is set
+    '''
+    for key in ('workflow', 'subjectslist', 'sessionslist', 'jobs', 'logdir', 'journal'):
+        if getattr(args, key) is not None:
+            config[key] = getattr(args, key)
+    for key in ('log_per_work', 'resume'):
+        if getattr(args, key):
+            config[key] = True
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='add arguments to overwirte the configuration')
-    parser.add_argument('--config', '-c', type=str, default=os.path.join(os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe()))), 'config.json') help='the path to the configuration file') #should change when this file or this code is moved
+    parser.add_argument('--config', '-c', type=str, default=os.path.join(os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe()))), 'config.json'), help='the path to the configuration file') #should change when this file or this code is moved
 
-    metadata = parser.add_argument_group(description='metadata', help='arguments about metadata such as niftirootdir, subject, session')
+    metadata = parser.add_argument_group(description='metadata', title='arguments about metadata such as niftirootdir, subject, session')
     metadata.add_argument('--niftirootdir', '-n', type=str, help='the root directory of nifti files')
     metadata.add_argument('--subject', '-s', type=str, help='the subject name')
     metadata.add_argument('--session', '-e', type=str, help='the session name')
     metadata.add_argument('--task', '-t', type=str, help='the task name')
-    
-    workflow = parser.add_argument_group(description='workflow', help='arguments for control workflow')
+
+    workflow = parser.add_argument_group(description='workflow', title='arguments for control workflow')
     workflow.add_argument('--despike', action='store_true', help='whether to despike the functional image')
     workflow.add_argument('--slicetiming', action='store_true', help='whether to do slicetiming correction')
 
+    batch = parser.add_argument_group(description='batch', title='arguments for running a workflow on multiple subjects and sessions')
+    batch.add_argument('--workflow', '-w', type=str, help="the workflow to run, given as 'module:attribute'")
+    batch.add_argument('--subjectslist', nargs='+', type=str, help='subject names, overwrite --subject')
+    batch.add_argument('--sessionslist', nargs='+', type=str, help='session names, overwrite --session')
+    batch.add_argument('--jobs', '-j', type=int, help='max number of subjects running at the same time')
+    batch.add_argument('--logdir', '-l', type=str, help='the directory of main.log and per-subject log files, main.log and the console only get warnings and errors of subjects')
+    batch.add_argument('--log-per-work', action='store_true', help='also write a log file of each work in a directory of each subject under logdir')
+    batch.add_argument('--journal', type=str, help='the append-only file recording start and finish of each work of each subject')
+    batch.add_argument('--resume', action='store_true', help='skip works which finished in the journal, and rerun the unfinished ones')
+
     args = parser.parse_args()
 
     config = get_config(args)
 
-    #unfinished
-    handler = logging.FileHandler(os.path.join(config['logdir'], 'main.log'))
-    main_logger = logging.getLogger("main",
-                                    level=logging.DEBUG,
-                                    handlers=[logging.StreamHandler()])
-    
+    override_config(config, args)
+
+    config.test_required_args(['niftirootdir', 'workflow'])
+
+    subjects = config.get('subjectslist') or [config['subject']]
+    if isinstance(subjects, str): #subjectslist in config.json may be a file with one subject per line
+        if not os.path.isfile(subjects):
+            raise ValueError(f"subjectslist {subjects} in config.json should be a file with one subject per line, but it does not exist, give subjects with --subjectslist instead")
+        with open(subjects, 'r') as f:
+            subjects = [line.strip() for line in f if line.strip()]
+    if subjects == [None]:
+        raise ValueError("no subject is given, give --subjectslist or --subject")
+
+    sessions = config.get('sessionslist') or ([config['session']] if config.get('session') else None)
+
+    main_logger = logging.getLogger("main")
+    main_logger.setLevel(logging.DEBUG)
+    main_logger.addHandler(logging.StreamHandler())
+    if config.get('logdir'):
+        os.makedirs(config['logdir'], exist_ok = True)
+        main_logger.addHandler(logging.FileHandler(os.path.join(config['logdir'], 'main.log')))
+
+    summary = run_batch(load_workflow(config['workflow']),
+                        config['niftirootdir'],
+                        subjects,
+                        sessions,
+                        max_workers = config.get('jobs'),
+                        logdir = config.get('logdir'),
+                        log_per_work = bool(config.get('log_per_work')),
+                        journal = config.get('journal'),
+                        resume = bool(config.get('resume')),
+                        logger = "main")
+
+    for (subject, session), result in sorted(summary.items(), key = lambda item: str(item[0])):
+        main_logger.info(f"sub-{subject} ses-{session}: {result['status']}")
 
+    exit(1 if any(result['status'] == 'failure' for result in summary.values()) else 0)
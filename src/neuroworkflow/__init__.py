@@ -1,3 +1,41 @@
-from .base import *
+#names are imported when they are first used, so python -m neuroworkflow.plan doesn't import base.py and networkx
+import importlib
 
-__all__ = ['Component', 'Work', 'Workflow', 'RunMetaData', 'CommandWork']
+__all__ = ['Component', 'ComponentIdentity', 'Work', 'Workflow', 'RunMetaData', 'CommandWork', 'run_batch', 'arun_batch', 'write_plans', 'Plan', 'save_plan', 'load_plan', 'run_plan', 'plan_cohort', 'preview_paths', 'preview_tree', 'write_preview', 'stage', 'stage_copy', 'stage_file', 'SidecarIndex', 'get_sidecar', 'ResultCache', 'DigestMemo', 'digest_files', 'start_logging', 'stop_logging', 'OutputLimiter', 'RunJournal']
+
+_modules = {
+    'run_batch': 'batch',
+    'arun_batch': 'batch',
+    'write_plans': 'batch',
+    'Plan': 'plan',
+    'save_plan': 'plan',
+    'load_plan': 'plan',
+    'run_plan': 'plan',
+    'plan_cohort': 'preview',
+    'preview_paths': 'preview',
+    'preview_tree': 'preview',
+    'write_preview': 'preview',
+    'stage': 'staging',
+    'stage_copy': 'staging',
+    'stage_file': 'staging',
+    'SidecarIndex': 'sidecars',
+    'get_sidecar': 'sidecars',
+    'ResultCache': 'cache',
+    'DigestMemo': 'digest',
+    'digest_files': 'digest',
+    'start_logging': 'logs',
+    'stop_logging': 'logs',
+    'OutputLimiter': 'logs',
+    'RunJournal': 'journal',
+}
+
+
+def __getattr__(name):
+    if name.startswith('__'):
+        raise AttributeError(f"module {__name__} has no attribute {name}")
+    #other names, including those of base.py not in __all__ such as AutoInput, are from base.py
+    module = importlib.import_module(f".{_modules.get(name, 'base')}", __name__)
+    try:
+        return getattr(module, name)
+    except AttributeError:
+        raise AttributeError(f"module {__name__} has no attribute {name}") from None
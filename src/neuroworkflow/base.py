@@ -14,14 +14,34 @@ AutoInput: a class to indicate a auto input, if first element of work.input_comp
 '''
 import os 
 import os.path as op
-import networkx as nx
 from itertools import product
 from copy import deepcopy as dc
 import inspect
 import logging
 import shlex
 import subprocess
+import asyncio
+from contextlib import nullcontext, contextmanager
+import hashlib
+import json
+import weakref
+import sys
+import time
+import threading
+import contextvars
 
+from .snapshot import FileSnapshot
+from .plan import Plan
+from .profiling import WorkProfiler, wait_process
+from .cache import ResultCache
+from .digest import DigestMemo, digest_files
+from .logs import OutputLimiter
+from .journal import RunJournal
+from .retry import retry_or_raise, remove_output, kill_process_group
+
+ 
+_unset = object()
+_logger = logging.getLogger(__name__) #for messages outside a run, which has no logger of RunMetaData
  
 class RunMetaData(object):
     '''
@@ -51,6 +71,49 @@ class RunMetaData(object):
         'simplified_bids_name' : use BIDS naming convention without subject and session
     broadcast_metadata : bool
         broadcast metadata to all works, this is useful when debug and using juputer notebook to process data 
+    scheduler : str
+        how a workflow dispatches its works
+        'serial' : run works one by one in the order of work_list
+        'thread' : run every work whose dependencies are finished in a thread pool
+        'process' : run every work whose dependencies are finished in a process pool, actions should be picklable
+    max_workers : int
+        max number of works running at the same time when scheduler is 'thread' or 'process', None means the default of concurrent.futures
+    max_cpus : int
+        cpus of the machine given to works when scheduler is 'thread' or 'process', a ready work waits until its cpus are free, see cpus of Work. None means cpu count
+    max_memory : int
+        memory(MB) of the machine given to works when scheduler is 'thread' or 'process', a ready work waits until its memory is free, see memory of Work. None means physical memory
+    incremental : bool
+        skip running a work if its manifest written by the last run matches, that is inputs, action(or rendered command) and outputs are not changed since then
+        a work that is rerun changes its outputs, so works using them are rerun too
+        overwrite, skip_exist and incremental are exclusive
+    hash_inputs : bool
+        when incremental, record digests of input files in manifest, an input whose size or mtime changed but content not is treated as unchanged, see digest.py
+    fs_snapshot : str
+        how works test whether files exist, see FileSnapshot
+        None : ask the file system for every file
+        'trust' : read each directory once per Workflow.run and answer from memory, files created or removed by works of the run are updated in the snapshot. this is much faster on a network file system, but files changed by other programs during the run are not seen
+        'validate' : as 'trust', but stat a directory before using its listing and read it again if it changed
+    trace_file : str
+        append a json line of timing and resource usage of each work and workflow to this file, see WorkProfiler. None means no trace
+    chrome_trace : str
+        when the outermost workflow finishes, write records of this run in trace_file to this file in Chrome Trace Event Format, see write_chrome_trace. trace_file should be given
+    result_cache : str
+        directory of a ResultCache shared by subjects and reruns, works with cache setted restore their outputs from it when their inputs and action were seen before, see cache of Work. None means no cache
+    result_cache_size : int
+        max size(MB) of result_cache, entries least recently used are removed when it is exceeded. None means no limit
+    digest_memo : str
+        SQLite file remembering digests of files by path, size, mtime and inode for hash_inputs and result_cache, shared by runs and processes, so an unchanged file is not read again, see DigestMemo. None means digests are remembered in memory of each process
+    log_output_rate : int
+        max lines per second of stdout and stderr of a command written to the log, lines over it are counted and their number is logged when the command exits, see OutputLimiter. None means no limit
+    on_failure : str
+        what a workflow does when one of its works raises
+        'stop' : no more work is started, running works are waited(scheduler 'thread' or 'process') or cancelled(Workflow.arun), then the exception is raised again
+        'continue' : works reading outputs of the failed work, directly or not, are skipped at once, other works keep running, the first exception is raised again when they finish
+    journal : str
+        append-only file recording start and finish of each work and workflow of each subject and session, it can be shared by runs of run_batch, see RunJournal. None means no journal
+    resume : bool
+        resume a run recorded in journal, works which finished and read only from finished works are skipped without testing their files, a whole finished workflow costs one lookup
+        outputs of a work which started but didn't finish(killed, crashed) or failed are removed before it is run again, files changed by other programs since the journal was written are not seen
     
 
     Attributes
@@ -65,20 +128,27 @@ class RunMetaData(object):
     session_place -> str  @property
         join sub-{subject} and ses-{session}    
         
-    _work_heap -> list
-        list of a work and all its ancestor e.g. if a work work1 is in a workflow workflow1, and workflow1 is in a workflow workflow2, then work_heap of work1 is ['workflow2', 'workflow1', 'work1']
+    _work_heap -> tuple
+        tuple of a work and all its ancestor e.g. if a work work1 is in a workflow workflow1, and workflow1 is in a workflow workflow2, then work_heap of work1 is ['workflow2', 'workflow1', 'work1']
         
-    _current_derivatives_place -> list
-        joined list of derivatives_place of _work_heap e.g. if a work's _work_heap is ['workflow2', 'workflow1', 'work1'], derivatives_place of workflow1 is ['derivatives1'], derivatives_place of workflow2 is ['derivatives2'], then _current_derivatives_place of work1 is ['derivatives2', 'derivatives1'].
+    _current_derivatives_place -> tuple
+        joined tuple of derivatives_place of _work_heap e.g. if a work's _work_heap is ['workflow2', 'workflow1', 'work1'], derivatives_place of workflow1 is ['derivatives1'], derivatives_place of workflow2 is ['derivatives2'], then _current_derivatives_place of work1 is ['derivatives2', 'derivatives1'].
         this is used to indicate the place of a Component in the directory tree before the session_place.
         
-    _current_data_place -> list
-        joined list of data_place of _work_heap e.g. if a work's _work_heap is ['workflow2', 'workflow1', 'work1'], data_place of workflow1 is ['data1'], data_place of workflow2 is ['data2'], then _current_data_place of work1 is ['data2', 'data1'].
+    _current_data_place -> tuple
+        joined tuple of data_place of _work_heap e.g. if a work's _work_heap is ['workflow2', 'workflow1', 'work1'], data_place of workflow1 is ['data1'], data_place of workflow2 is ['data2'], then _current_data_place of work1 is ['data2', 'data1'].
         this is used to indicate the place of a Component in the directory tree after the session_place.
+    
+    Methods
+    -------
+    child -> RunMetaData
+        create the RunMetaData of a nested work, see the method's __doc__
         
     '''
     
-    def __init__(self, rootdir: str, subject: str, session: str = None, logger: logging.Logger = None, overwrite: bool = False, skip_exist: bool = False, preview: bool = False, name_type: str = 'run_bids_name', broadcast_metadata: bool = False):
+    __slots__ = ('rootdir', 'subject', 'session', 'logger', 'overwrite', 'preview', 'broadcast_metadata', 'skip_exist', 'name_type', 'scheduler', 'max_workers', 'max_cpus', 'max_memory', 'incremental', 'hash_inputs', 'fs_snapshot', '_snapshot', 'trace_file', 'chrome_trace', 'result_cache', 'result_cache_size', 'digest_memo', 'log_output_rate', 'on_failure', 'journal', 'resume', '_resume', '_skip', '_work_heap', '_current_derivatives_place', '_current_data_place')
+    
+    def __init__(self, rootdir: str, subject: str, session: str = None, logger: logging.Logger = None, overwrite: bool = False, skip_exist: bool = False, preview: bool = False, name_type: str = 'run_bids_name', broadcast_metadata: bool = False, scheduler: str = 'serial', max_workers: int = None, max_cpus: int = None, max_memory: int = None, incremental: bool = False, hash_inputs: bool = False, fs_snapshot: str = None, trace_file: str = None, chrome_trace: str = None, result_cache: str = None, result_cache_size: int = None, digest_memo: str = None, log_output_rate: int = None, on_failure: str = 'stop', journal: str = None, resume: bool = False):
         
         if not op.exists(rootdir):
             raise ValueError(f"rootdir {rootdir} in RunMetaData does not exist")
@@ -86,25 +156,80 @@ class RunMetaData(object):
             self.rootdir = rootdir
         self.subject = subject
         self.session = session
-        self._current_derivatives_place = []
-        self._current_data_place = []
+        self._current_derivatives_place = ()
+        self._current_data_place = ()
         self.logger = logger
         self.overwrite = overwrite
         self.preview = preview
         self.broadcast_metadata = broadcast_metadata
         self.skip_exist = skip_exist
         self._skip = False #do not use this explicitly
-        self._work_heap = []
+        self._work_heap = ()
         self.name_type = name_type
-        self._current_format = None #do not use this explicitly, will change when commponent using as different work's input
-        self.intial = True
+        self.scheduler = scheduler
+        self.max_workers = max_workers
+        self.max_cpus = max_cpus
+        self.max_memory = max_memory
+        self.incremental = incremental
+        self.hash_inputs = hash_inputs
+        self.fs_snapshot = fs_snapshot
+        self._snapshot = FileSnapshot(fs_snapshot)
+        self.trace_file = trace_file
+        self.chrome_trace = chrome_trace
+        self.result_cache = result_cache
+        self.result_cache_size = result_cache_size
+        self.digest_memo = digest_memo
+        self.log_output_rate = log_output_rate
+        self.on_failure = on_failure
+        self.journal = journal
+        self.resume = resume
+        self._resume = {} #do not use this explicitly, work_heap -> state in the journal, see Workflow._resume_states
         
         if skip_exist and overwrite:
             raise ValueError("skip_exist and overwrite can't both be True")
         
+        if incremental and (skip_exist or overwrite):
+            raise ValueError("incremental can't be True with skip_exist or overwrite")
+        
+        if chrome_trace is not None and trace_file is None:
+            raise ValueError("chrome_trace is written from records in trace_file, trace_file should be given")
+        
+        if scheduler not in ('serial', 'thread', 'process'):
+            raise ValueError(f"unknown scheduler {scheduler}, should be one of 'serial', 'thread' and 'process'")
+        
+        if on_failure not in ('stop', 'continue'):
+            raise ValueError(f"unknown on_failure {on_failure}, should be one of 'stop' and 'continue'")
+        
+        if resume and journal is None:
+            raise ValueError("resume reads which works finished from journal, journal should be given")
+        
         _logger = logging.getLogger(logger)
         _logger.info(f"create RunMetaData with\n rootdir {rootdir}\n subject {subject}\n session {session}\n logger {logger}\n overwrite {overwrite}\n preview {preview}")
-                    
+    
+    def child(self, name: str = None, derivatives_place: list = (), data_place: list = (), **kwargs):
+        '''
+        create the RunMetaData of a work nested in the work of this RunMetaData
+        this is a shallow copy sharing all attributes, name and places of the work are appended to new tuples of _work_heap, _current_derivatives_place and _current_data_place
+        so a RunMetaData is not changed after creation except _skip of its own work, and no deep copy is needed when passing it from workflow to work
+        
+        kwargs
+            replace attributes of the child e.g. scheduler = 'serial'
+        '''
+        child = object.__new__(RunMetaData)
+        for attribute in RunMetaData.__slots__:
+            setattr(child, attribute, getattr(self, attribute))
+        
+        if name is not None:
+            child._work_heap = self._work_heap + (name,)
+        child._current_derivatives_place = self._current_derivatives_place + tuple(derivatives_place)
+        child._current_data_place = self._current_data_place + tuple(data_place)
+        child._skip = False
+        
+        for key, value in kwargs.items():
+            setattr(child, key, value)
+        
+        return child
+    
     @property
     def subjectdir(self):
         return op.join(self.rootdir, f'sub-{self.subject}')
@@ -121,6 +246,30 @@ class RunMetaData(object):
         else:
             return op.join(f'sub-{self.subject}', f'ses{self.session}')
         
+class ComponentIdentity(object):
+    '''
+    ComponentIdentity is the value of a component which decides the file it names, that is its class and BIDS entities (desc, suffix, datatype, task, space, echo, extension, data_place)
+    it is hashable and its hash is computed once, it is used as the key of interned components, see Component.intern
+    '''
+    __slots__ = ('entities', '_hash')
+    
+    def __init__(self, cls, desc = None, suffix = None, datatype = None, task = None, space = None, echo = None, extension = None, data_place = None):
+        
+        self.entities = (cls, desc, suffix, datatype, task, space, None if echo is None else str(echo), extension, None if data_place is None else tuple(data_place))
+        self._hash = hash(self.entities)
+    
+    def __hash__(self):
+        return self._hash
+    
+    def __eq__(self, other):
+        if not isinstance(other, ComponentIdentity):
+            return NotImplemented
+        return self._hash == other._hash and self.entities == other.entities
+    
+    def __repr__(self):
+        return f"ComponentIdentity{self.entities[1:]}"
+
+
 class Component(object):
     '''
     Component is a class to represent the input and output of a work, it is characterized by part of parameters such as desc, suffix, datatype, run_metadata.
@@ -154,6 +303,8 @@ class Component(object):
     Control
         run_metadata : RunMetaData
             metadata of the run, this is usually not directly setted when initial a component, but passed from work.        
+        _current_format : dict
+            parameters of name_for_run used by use_name, do not use this explicitly, will change when commponent using as different work's input or output
         use_extension : bool
             whether to use extension when generate file name
         extension : str
@@ -161,8 +312,15 @@ class Component(object):
         data_place : list
             output place of the comoonent in the directory tree. this attribute accept a list of string, each string is a folder's name. this is used to generate the full path of the file when running a work. this will be combined with run_metadata._current_data_place(place at tail). e.g. ['place1','place2'] will be combined with run_metadata._current_data_place = ['place0'] to generate a full path of the file.
     
+    Interning
+        set Component.intern = True(or on a subclass) before building a workflow, then creating a component whose identity(see ComponentIdentity) is equal to an existing one returns the existing one, so init_from of the same entities gives the same object, and equal components are deduplicated in sets and graphs for free
+        an interned component can't change its entities, and run_metadata, use_extension of a later creation are ignored(use_extension should be the same)
+        copies and pickles of an interned component(e.g. deep copy of a workflow in arun_batch) are not interned, they belong to the copied workflow
+    
     Attributes
     ----------
+    identity -> ComponentIdentity
+        hashable value of the component
     run_dir -> str  
         path of the component when running
     name_for_run -> str
@@ -180,8 +338,34 @@ class Component(object):
         delete corresponding file of the component when running
         
     '''
+    intern = False
+    _interned = weakref.WeakValueDictionary() #ComponentIdentity -> component, shared by subclasses because the class is a part of the identity
+    _identity_attributes = frozenset(('desc', 'suffix', 'datatype', 'task', 'space', 'echo', 'extension', 'data_place'))
+    
+    def __new__(cls, desc = None, suffix = None, datatype = None, run_metadata = None, use_extension = False, extension = None, task = None, space = None, echo = None, data_place = None):
+        
+        if not cls.intern:
+            return super().__new__(cls)
+        
+        identity = ComponentIdentity(cls, desc, suffix, datatype, task, space, echo, extension, data_place)
+        component = Component._interned.get(identity)
+        if component is None:
+            component = super().__new__(cls)
+            component.__dict__['_identity'] = identity
+            Component._interned[identity] = component
+        return component
+    
+    def __reduce_ex__(self, protocol):
+        #copies and pickles bypass __new__, so they are not interned
+        return (object.__new__, (type(self),), self.__dict__)
+    
     def __init__(self, desc = None, suffix = None, datatype = None, run_metadata = None, use_extension = False, extension = None, task = None, space = None, echo = None, data_place = None):
         
+        if '_name_cache' in self.__dict__: #an interned component which is already created
+            if use_extension != self.use_extension:
+                raise ValueError(f"interned component {self.simplified_bids_name(False)} is created with use_extension {use_extension}, but it already exists with use_extension {self.use_extension}")
+            return
+        
         self.desc = desc
         self.datatype = datatype
         self.suffix = suffix
@@ -195,11 +379,13 @@ class Component(object):
         else:    
             self.echo = str(echo)
         self.data_place = data_place               
+        self._current_format = None
+        self._name_cache = {} #see name_for_run
             
     @classmethod
     def init_from(cls, component, **kwargs):
         
-        dic = dc(component.__dict__)   
+        dic = {key: dc(value) for key, value in component.__dict__.items() if not key.startswith('_')}
             
         for key, value in kwargs.items():
             dic[key] = value
@@ -245,8 +431,12 @@ class Component(object):
     def name_for_run(self, full_path:bool = True, extension:bool = True, name_type:str = None, name_prefix:str = None, name_surfix:str = None,  final_prefix:str = None, final_surfix:str = None, datatype = True):
         '''
         get file name for run
-        
+        the name is cached with the parameters as key until an attribute of the component(including run_metadata) is setted
         '''
+        _key = ('name_for_run', full_path, extension, name_type, name_prefix, name_surfix, final_prefix, final_surfix, datatype)
+        if _key in self._name_cache:
+            return self._name_cache[_key]
+        
         if name_type is None:
             name_type = self.run_metadata.name_type
             
@@ -264,7 +454,7 @@ class Component(object):
                 else:
                     _temp_name = self.desc
             case _:
-                raise ValueError(f"unknown type {self.name_type} from {self.bids_name}")
+                raise ValueError(f"unknown type {name_type} of {self.simplified_bids_name()}")
         
         
         if name_prefix is not None:
@@ -282,14 +472,15 @@ class Component(object):
         if final_surfix is not None:
             _temp_name = f"{_temp_name}{final_surfix}"
         
+        self._name_cache[_key] = _temp_name
         return _temp_name
     
 
     def use_name(self,**kwargs):
-        if self.run_metadata._current_format is None:
+        if self._current_format is None:
             return self.name_for_run(**kwargs)
         else:
-            return self.name_for_run(**self.run_metadata._current_format, **kwargs)
+            return self.name_for_run(**self._current_format, **kwargs)
 
     bids_order = {
         'bold': ['sub', 'ses', 'task', 'acq', 'ce', 'rec', 'dir', 'run', 'echo', 'part', 'chunk', 'space', 'desc'],
@@ -298,11 +489,49 @@ class Component(object):
         'fmap': ['sub', 'ses', 'acq', 'run', 'gre', 'chunk', 'space', 'desc']
     }#TODO add more            
 
+    _metadata_entities = {'sub': 'subject', 'ses': 'session'}
+    
+    def __setattr__(self, name, value):
+        #names depend on every public attribute, so cached names are dropped when one of them is changed
+        if not name.startswith('_') and self.__dict__.get(name, _unset) is not value:
+            if '_identity' in self.__dict__ and name in Component._identity_attributes and name in self.__dict__ and self.__dict__[name] != value:
+                raise ValueError(f"can't set {name} of interned component {self.simplified_bids_name(False)}, create another component instead")
+            self.__dict__['_name_cache'] = {}
+        object.__setattr__(self, name, value)
+    
+    @property
+    def identity(self) -> ComponentIdentity:
+        if '_identity' in self.__dict__:
+            return self.__dict__['_identity']
+        return ComponentIdentity(type(self), self.desc, self.suffix, self.datatype, self.task, self.space, self.echo, self.extension, self.data_place)
+    
+    def _bids_template(self, with_metadata):
+        '''
+        compile entities of the component to a tuple in order of bids_order
+        an entity is a string 'key-value', or a tuple (key, attribute of run_metadata) when with_metadata and the component has no such attribute
+        '''
+        _key = ('bids_template', with_metadata)
+        if _key not in self._name_cache:
+            template = []
+            for key in Component.bids_order[self.suffix]:
+                if key in self.__dict__:
+                    if self.__dict__[key] is not None:
+                        template.append(f"{key}-{self.__dict__[key]}")
+                elif with_metadata and key in Component._metadata_entities:
+                    template.append((key, Component._metadata_entities[key]))
+            self._name_cache[_key] = tuple(template)
+        return self._name_cache[_key]
  
-    def _bids_name_generator(self, dic, extension):
+    def _bids_name_generator(self, template, extension):
         
-        
-        ordered_dic = {key: dic[key] for key in Component.bids_order[self.suffix] if key in dic}
+        entities = []
+        for entity in template:
+            if isinstance(entity, str):
+                entities.append(entity)
+            else:
+                value = getattr(self.run_metadata, entity[1])
+                if value is not None:
+                    entities.append(f"{entity[0]}-{value}")
         
         #this true/false judgement can be nested
         if extension or self.use_extension:
@@ -312,10 +541,10 @@ class Component(object):
             
         if __extension:
             if extension is None:
-                raise ValueError(f"extension of {self.simplified_bids_name()} is not defined, but needed")
-            return f'{"_".join([f"{key}-{value}" for key, value in ordered_dic.items() if value is not None])}_{dic['suffix']}.{dic["extension"]}'
+                raise ValueError(f"extension of {self._bids_name_generator(template, False)} is not defined, but needed")
+            return f'{"_".join(entities)}_{self.suffix}.{self.extension}'
         else:
-            return f'{"_".join([f"{key}-{value}" for key, value in ordered_dic.items() if value is not None])}_{dic['suffix']}'
+            return f'{"_".join(entities)}_{self.suffix}'
         
            
     def run_bids_name(self, extension = True):
@@ -323,26 +552,17 @@ class Component(object):
         '''
         generage file name for run
         '''
-        dic = dc(self.__dict__)
-        dic.setdefault('sub', self.run_metadata.subject)
-        dic.setdefault('ses', self.run_metadata.session)
-                                       
-        return self._bids_name_generator(dic, extension)   
+        return self._bids_name_generator(self._bids_template(with_metadata = True), extension)   
     
        
     def simplified_bids_name(self, extension = True):
         '''
         generage file identity (run_bids_name without metadata)
         '''
-        # #this true/false judgement can be nested
-        # if extension or self.use_extension:
-        #     __extension = True
-        # else:
-        #     __extension = False
-            
-        dic = dc(self.__dict__)          
-        
-        return self._bids_name_generator(dic, extension)     
+        _key = ('simplified_bids_name', extension)
+        if _key not in self._name_cache:
+            self._name_cache[_key] = self._bids_name_generator(self._bids_template(with_metadata = False), extension)
+        return self._name_cache[_key]
     
     
     def make_test_file(self):
@@ -351,13 +571,15 @@ class Component(object):
         '''
         with open(self.use_name(), 'w') as f:
             f.write('test')            
+        self.run_metadata._snapshot.invalidate(self.use_name())
             
     
     def remove_file(self):
         '''
-        delete file
+        delete file, or directory if the component is an output directory of a tool
         '''
-        os.remove(self.use_name())
+        remove_output(self.use_name())
+        self.run_metadata._snapshot.discard(self.use_name())
 
 
 class Work(object):
@@ -388,6 +610,13 @@ class Work(object):
         append first element of output_components_list of work to _auto_input_set for other work's auto 
     preserve_auto_input : bool
         preserve the components in _auto_input_set even though it is used by this work
+    cpus : int
+        number of cpus used by the action, None means not declared, which is scheduled as 1 cpu
+    memory : int
+        peak memory(MB) used by the action, None means not declared, which is scheduled as 0
+    cache : bool
+        when RunMetaData.result_cache is given, restore outputs from the cache if digests of inputs and the action(rendered command, or name and source hash of the function) were seen before, otherwise store outputs after running
+        only set it for a work whose outputs depend on nothing but its inputs and action, paths of inputs and outputs are not in the key, so an entry is shared by subjects
     
     Attributes
     ----------
@@ -408,7 +637,7 @@ class Work(object):
         run this work by executing action, most of other parameters are served for this method. more details see the method's __doc__
                 
     '''
-    def __init__(self, name, input_components:list[Component] = None, output_components:list[Component] = None, action = None, derivatives_place = None, data_place = None, input_format:list[dict] = None, output_format:list[dict] = None, append_auto_input = True, preserve_auto_input = False, exception_tolerance = False):
+    def __init__(self, name, input_components:list[Component] = None, output_components:list[Component] = None, action = None, derivatives_place = None, data_place = None, input_format:list[dict] = None, output_format:list[dict] = None, append_auto_input = True, preserve_auto_input = False, exception_tolerance = False, cpus: int = None, memory: int = None, cache: bool = False):
         
         self.name = name
         if input_components is not None:
@@ -432,6 +661,9 @@ class Work(object):
         self.append_auto_input = append_auto_input
         self.preserve_auto_input = preserve_auto_input
         self.exception_tolerance = exception_tolerance
+        self.cpus = cpus
+        self.memory = memory
+        self.cache = cache
         
         if data_place is None:
             self.data_place = []
@@ -466,11 +698,18 @@ class Work(object):
     def all_components(self) -> set:
         return self.input_components_set | self.output_components_set
     
+    @property
+    def resources(self) -> tuple:
+        '''
+        (cpus, memory) of the work used by Workflow._run_parallel
+        '''
+        return (self.cpus or 1, self.memory or 0)
+    
     def _pre_run(self, run_metadata):
         ''' 
         some preprocessing before running a work
-        add derivatives_place and data_place of work to _current_derivatives_place and _current_data_place of run_metadata
-        then distribute run_metadata's deep copy to output_components
+        create a child of run_metadata with derivatives_place and data_place of work added to _current_derivatives_place and _current_data_place
+        then distribute the child to output_components
         
         Controls: control flags is in run_metadata
         --------
@@ -480,9 +719,7 @@ class Work(object):
             set _skip flag to True if all output components are exist, this will skip run action in run 
             remove pre-exist file in output_components if part of them are exist        
         '''
-        run_metadata._work_heap.append(self.name)
-        run_metadata._current_derivatives_place = run_metadata._current_derivatives_place + self.derivatives_place
-        run_metadata._current_data_place = run_metadata._current_data_place + self.data_place
+        run_metadata = self._bind_components(run_metadata)
         
         logger = logging.getLogger(run_metadata.logger)
         logger.info(f"run {self.name}, work_heap is {run_metadata._work_heap}")
@@ -490,49 +727,33 @@ class Work(object):
         if not self.input_components_set:
             logger.error(f"list of input_components {self.name} is empty.")
         
-        for index, component in enumerate(self.input_components_list):
-            
-            if self.input_format is None:
-                pass
-            elif len(self.input_format) != len(self.input_components_list):
-                raise ValueError(f"input format {self.input_format} of {self.name} don't match the input components {self.input_components_list}")     
-            else:
-                logger.debug(f"set input component {component.simplified_bids_name()} 's format as {self.input_format[index]}")          
-                component.run_metadata._current_format = self.input_format[index]
-                
-            if not op.exists(component.use_name()):
+        for component in self.input_components_list:
+            if not run_metadata._snapshot.exists(component.use_name()):
                 raise ValueError(f"input component {component.use_name()} of work {self.name} does not exist")    
             
         if not self.output_components_set:
             logger.error(f"list of output_components {self.name} is empty, eventhough this work update component in input_components and don't generate new file, it should be added to output_components")    
-                        
-        for index, component in enumerate(self.output_components_set):
-            transform_run_metadata = dc(run_metadata)
-            component.run_metadata = transform_run_metadata
-            
-            if self.output_format is None:
-                pass
-            elif len(self.output_format) != len(self.output_components_list):
-                raise ValueError(f"output format {self.output_format} of {self.name} don't match the output components {self.output_components_list}")
-            else:
-                logger.debug(f"set output component {component.simplified_bids_name()} 's format as {self.output_format[index]}")
-                component.run_metadata._current_format = self.output_format[index]
-            
-            if not op.exists(component.run_dir()):
-                os.makedirs(component.run_dir())
-                logger.warning(f"create directory {component.run_dir()}")
+        
+        for directory in run_metadata._snapshot.makedirs(component.run_dir() for component in self.output_components_set):
+            logger.warning(f"create directory {directory}")
+        
+        if run_metadata._resume.get(run_metadata._work_heap) in ('start', 'fail'):
+            logger.warning(f"{self.name} didn't finish in the last run recorded in journal {run_metadata.journal}, remove its partial outputs")
+            self._remove_failed_outputs(run_metadata)
         
         _all_output_component_exist = True     
         _existed_component_set = set()   
         
         for component in self.output_components_set:
             
-            if op.exists(component.use_name()): 
+            if run_metadata._snapshot.exists(component.use_name()): 
                 _existed_component_set.add(component)              
             
             else:
                 _all_output_component_exist = False        
 
+        _up_to_date = run_metadata.incremental and _all_output_component_exist and self.action is not None and self._manifest_up_to_date(run_metadata)
+        
         for component in _existed_component_set - self.input_components_set:
             
             logger.warning(f"file {component.use_name()} exist before running, and it not in input components.")
@@ -544,16 +765,87 @@ class Work(object):
                 
                 logger.warning(f"file {component.use_name()} exist before running, and not all output of this work exist. will remove this file and run this work")
                 component.remove_file()
+            elif run_metadata.incremental and not _up_to_date:
+                
+                logger.warning(f"file {component.use_name()} exist before running, but inputs, action or outputs of this work changed since last run. will remove this file and run this work")
+                component.remove_file()
                                             
         if  run_metadata.skip_exist and _all_output_component_exist and not self.output_components_set.issubset(self.input_components_set):
             run_metadata._skip = True
             logger.warning(f"skip running {self.name} because all output components are exist, if a output is also a exist input, this may redo a work") 
+        
+        if _up_to_date:
+            run_metadata._skip = True
+            logger.info(f"skip running {self.name} because its manifest {self._manifest_path(run_metadata)} is up to date")
 
         if self.action is None:            
             raise ValueError(f"action of {self.simplified_bids_name()} is not defined")               
         
         return run_metadata
     
+    def _bind_components(self, run_metadata):
+        '''
+        create a child of run_metadata with derivatives_place and data_place of work, give it to output_components and set formats of input and output components
+        return the child, this doesn't touch the disk
+        '''
+        run_metadata = run_metadata.child(self.name, self.derivatives_place, self.data_place)
+        logger = logging.getLogger(run_metadata.logger)
+        
+        for index, component in enumerate(self.input_components_list):
+            
+            if self.input_format is None:
+                pass
+            elif len(self.input_format) != len(self.input_components_list):
+                raise ValueError(f"input format {self.input_format} of {self.name} don't match the input components {self.input_components_list}")     
+            else:
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("set input component %s 's format as %s", component.simplified_bids_name(), self.input_format[index])          
+                component._current_format = self.input_format[index]
+                        
+        for index, component in enumerate(self.output_components_set):
+            component.run_metadata = run_metadata
+            
+            if self.output_format is None:
+                pass
+            elif len(self.output_format) != len(self.output_components_list):
+                raise ValueError(f"output format {self.output_format} of {self.name} don't match the output components {self.output_components_list}")
+            else:
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("set output component %s 's format as %s", component.simplified_bids_name(), self.output_format[index])
+                component._current_format = self.output_format[index]
+        
+        return run_metadata
+    
+    def _plan(self, run_metadata, plan):
+        '''
+        add the step of this work to plan, see Workflow.plan
+        '''
+        run_metadata = self._bind_components(run_metadata)
+        
+        if self.action is None:            
+            raise ValueError(f"action of {self.name} is not defined")
+        
+        plan.add_step(self._plan_step(run_metadata))
+    
+    def _plan_step(self, run_metadata) -> dict:
+        return {
+            'name': self.name,
+            'work_heap': list(run_metadata._work_heap),
+            'action': f"{self.action.__module__}:{self.action.__qualname__}",
+            'argv': None,
+            'env': None,
+            'stdout': None,
+            'timeout': None,
+            'retries': None,
+            'retry_backoff': None,
+            'inputs': [component.use_name() for component in self.input_components_list],
+            'outputs': [component.use_name() for component in self.output_components_list],
+            'pass_run_metadata': 'run_metadata' in inspect.signature(self.action).parameters,
+            'exception_tolerance': self.exception_tolerance,
+            'cpus': self.cpus,
+            'memory': self.memory,
+        }
+    
     def _run_action(self, run_metadata):
         '''
         execute action of a work
@@ -587,66 +879,7 @@ class Work(object):
 
         elif self.action.__name__  == '_run_shell_command':
                     
-            def _process_item(self, item):
-                if isinstance(item, Component):
-                    if item in self.input_components_set:
-                        return item.use_name()
-                    elif item in self.output_components_set:
-                        return item.use_name()
-                    else:
-                        raise ValueError(f"component {item.simplified_bids_name()} of {self.name} is not in either input_components or output_components")
-                    
-                elif isinstance(item, AutoInput):
-                    
-                    if item.dict:
-                        raise ValueError(f"when running {self.name}, a non-empty AutoInput is given. auto_input need a empty AutoInput in command_list, the match part should put in input_components")
-                    else:
-                        return self.input_components_list[0].use_name()
-                    
-                elif isinstance(item, str):                    
-                    return item
-                
-                elif isinstance(item, list):
-                                        
-                    component_position_list = [index for index, item in enumerate(item) if isinstance(item, (Component, dict))]# unfinished
-                                        
-                    len_component_list = len(component_position_list) - 1
-                    
-                    if len(component_position_list) == 0:
-                        self.run_metadata.logger.error(f"no component is given in a list of command arguments when running {self.name} with command list {self.command_list}")
-                    if len(component_position_list) > 1:
-                        self.run_metadata.logger.error(f"multiple components are given in a list of command arguments when running {self.name} with command list {self.command_list}")
-                        raise ValueError(f"multiple components are given in a list of command arguments when running {self.name} with command list {self.command_list}")
-                    component_position = component_position_list[0]
-                    
-                    if isinstance(item[component_position], AutoInput):
-                        if item[component_position]:
-                            raise ValueError(f"when running {self.name}, a non-empty AutoInput is given in {item}. auto_input need a empty AutoInput in command_list, the match part should put in input_components")
-                        
-                        item[component_position] = self.input_components_list[0]
-                    
-                    name_prefix, name_surfix, final_prefix, final_surfix = None, None, None, None
-                                            
-                    if component_position == 1:
-                        final_prefix = item[0]
-                    elif component_position == 2:
-                        final_prefix, name_prefix = item[0], item[1]
-                    
-                    if len_component_list - component_position == 1:
-                        final_surfix = item[-1]
-                    elif len_component_list - component_position == 2:
-                        name_surfix, final_surfix = item[-2], item[-1]
-                        
-                    return item[component_position].use_name(name_prefix = name_prefix, name_surfix = name_surfix, final_prefix = final_prefix, final_surfix = final_surfix)
-                
-                elif isinstance(item, (int, float, complex)):
-                    
-                    return str(item)
-                                                                                
-                else:
-                    raise ValueError(f"item {item} of {self.name} is not a Component, string, list or number")
-                            
-            _run_command_list = [_process_item(self, item) for item in self.command_list]
+            _run_command_list = self._render_command_list()
             
             logger.info(f"start running action {self.action.__name__} {_run_command_list} of work {self.name} with command list")
             
@@ -671,7 +904,233 @@ class Work(object):
             
             self.action(_run_input_components, _run_output_components)
 
+
+    def _process_command_item(self, item):
+        '''
+        render an item of command_list to a string, see command_list of CommandWork
+        '''
+        if isinstance(item, Component):
+            if item in self.input_components_set:
+                return item.use_name()
+            elif item in self.output_components_set:
+                return item.use_name()
+            else:
+                raise ValueError(f"component {item.simplified_bids_name()} of {self.name} is not in either input_components or output_components")
+            
+        elif isinstance(item, AutoInput):
+            
+            if item.dict:
+                raise ValueError(f"when running {self.name}, a non-empty AutoInput is given. auto_input need a empty AutoInput in command_list, the match part should put in input_components")
+            else:
+                return self.input_components_list[0].use_name()
+            
+        elif isinstance(item, str):                    
+            return item
+        
+        elif isinstance(item, list):
+                                
+            component_position_list = [index for index, item in enumerate(item) if isinstance(item, (Component, dict))]# unfinished
                                 
+            len_component_list = len(component_position_list) - 1
+            
+            if len(component_position_list) == 0:
+                self.run_metadata.logger.error(f"no component is given in a list of command arguments when running {self.name} with command list {self.command_list}")
+            if len(component_position_list) > 1:
+                self.run_metadata.logger.error(f"multiple components are given in a list of command arguments when running {self.name} with command list {self.command_list}")
+                raise ValueError(f"multiple components are given in a list of command arguments when running {self.name} with command list {self.command_list}")
+            component_position = component_position_list[0]
+            
+            if isinstance(item[component_position], AutoInput):
+                if item[component_position]:
+                    raise ValueError(f"when running {self.name}, a non-empty AutoInput is given in {item}. auto_input need a empty AutoInput in command_list, the match part should put in input_components")
+                
+                item[component_position] = self.input_components_list[0]
+            
+            name_prefix, name_surfix, final_prefix, final_surfix = None, None, None, None
+                                    
+            if component_position == 1:
+                final_prefix = item[0]
+            elif component_position == 2:
+                final_prefix, name_prefix = item[0], item[1]
+            
+            if len_component_list - component_position == 1:
+                final_surfix = item[-1]
+            elif len_component_list - component_position == 2:
+                name_surfix, final_surfix = item[-2], item[-1]
+                
+            return item[component_position].use_name(name_prefix = name_prefix, name_surfix = name_surfix, final_prefix = final_prefix, final_surfix = final_surfix)
+        
+        elif isinstance(item, (int, float, complex)):
+            
+            return str(item)
+                                                                        
+        else:
+            raise ValueError(f"item {item} of {self.name} is not a Component, string, list or number")
+
+    def _render_command_list(self) -> list:
+        return [self._process_command_item(item) for item in self.command_list]
+
+    def _manifest_path(self, run_metadata):
+        '''
+        path of the manifest of this work used when incremental, it is in .neuroworkflow under the derivatives tree of the session
+        '''
+        return op.join(run_metadata.rootdir, *run_metadata._current_derivatives_place, run_metadata.session_place, '.neuroworkflow', f"{'.'.join(run_metadata._work_heap)}.json")
+    
+    def _action_identity(self) -> str:
+        '''
+        rendered command of a CommandWork, or name and source hash of the action
+        '''
+        if self.action.__name__  == '_run_shell_command':
+            return shlex.join(self._render_command_list())
+        
+        try:
+            source = inspect.getsource(self.action)
+        except (OSError, TypeError):
+            source = ''
+        return f"{self.action.__module__}.{self.action.__qualname__} {hashlib.sha256(source.encode()).hexdigest()}"
+    
+    def _read_manifest(self, run_metadata) -> dict:
+        try:
+            with open(self._manifest_path(run_metadata), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    def _manifest_up_to_date(self, run_metadata) -> bool:
+        '''
+        test whether manifest of the last run matches current inputs, action and outputs
+        size and mtime of a file are compared first, the hash is only computed when they changed and a hash is recorded
+        '''
+        logger = logging.getLogger(run_metadata.logger)
+        manifest = self._read_manifest(run_metadata)
+        
+        if manifest is None:
+            logger.debug("no manifest of %s", self.name)
+            return False
+        
+        if manifest['action'] != self._action_identity():
+            logger.info(f"action of {self.name} changed since last run")
+            return False
+        
+        if set(manifest['inputs']) != {component.use_name() for component in self.input_components_set} or set(manifest['outputs']) != {component.use_name() for component in self.output_components_set}:
+            logger.info(f"input or output files of {self.name} changed since last run")
+            return False
+        
+        _rehashed = False
+        for path, recorded in manifest['inputs'].items():
+            current = _file_signature(path, snapshot = run_metadata._snapshot)
+            if current[:2] == recorded[:2]:
+                continue
+            if recorded[2] is None:
+                logger.info(f"input {path} of {self.name} changed since last run")
+                return False
+            current = _file_signature(path, hash_file = True, memo = DigestMemo.shared(run_metadata.digest_memo))
+            if current[2] != recorded[2]:
+                logger.info(f"content of input {path} of {self.name} changed since last run")
+                return False
+            manifest['inputs'][path] = current
+            _rehashed = True
+        
+        for path, recorded in manifest['outputs'].items():
+            if _file_signature(path, snapshot = run_metadata._snapshot)[:2] != recorded[:2]:
+                logger.info(f"output {path} of {self.name} changed since last run")
+                return False
+        
+        if _rehashed: #record new mtime, so the content is not hashed again next time
+            _write_json(self._manifest_path(run_metadata), manifest)
+        
+        return True
+    
+    def _write_manifest(self, run_metadata):
+        '''
+        record inputs, action and outputs of this work after running it
+        '''
+        logger = logging.getLogger(run_metadata.logger)
+        
+        _missing = [component.use_name() for component in self.output_components_set if not run_metadata._snapshot.exists(component.use_name())]
+        if _missing:
+            logger.warning(f"output {_missing} of {self.name} does not exist after running, manifest is not written")
+            return
+        
+        previous = self._read_manifest(run_metadata) or {'inputs': {}}
+        
+        manifest = {
+            'action': self._action_identity(),
+            'inputs': {
+                component.use_name(): _file_signature(component.use_name(), run_metadata.hash_inputs, previous['inputs'].get(component.use_name()), run_metadata._snapshot, DigestMemo.shared(run_metadata.digest_memo))
+                for component in self.input_components_set
+            },
+            'outputs': {component.use_name(): _file_signature(component.use_name(), snapshot = run_metadata._snapshot) for component in self.output_components_set},
+        }
+        
+        _write_json(self._manifest_path(run_metadata), manifest)
+        logger.debug("write manifest of %s to %s", self.name, self._manifest_path(run_metadata))
+
+    def _cache_key(self, run_metadata) -> str:
+        '''
+        key of this work in RunMetaData.result_cache, sha256 of the action, digests of inputs in order and extensions of outputs
+        paths(and their directories) of inputs and outputs in a rendered command are replaced by their positions, so the same command of different subjects has the same key
+        '''
+        inputs = [component.use_name() for component in self.input_components_list]
+        outputs = [component.use_name() for component in self.output_components_list]
+        
+        if self.action.__name__ == '_run_shell_command':
+            _positions = [(path, f"input:{index}") for index, path in enumerate(inputs)] + [(path, f"output:{index}") for index, path in enumerate(outputs)]
+            _tokens = [(path, f"<{position}>") for path, position in _positions] + [(op.dirname(path), f"<dir of {position}>") for path, position in _positions]
+            _tokens.sort(key = lambda token: len(token[0]), reverse = True) #a path is replaced before its directory
+            argv = []
+            for item in self._render_command_list():
+                for path, token in _tokens:
+                    item = item.replace(path, token)
+                argv.append(item)
+            #threads change how fast a command runs, not what it outputs
+            env = {} if self.env is None else {key: value for key, value in self.env.items() if os.environ.get(key) != value and key not in THREAD_ENV_VARIABLES}
+            action = {'argv': argv, 'env': env}
+        else:
+            version = getattr(self.action, '__version__', None) or getattr(sys.modules.get(self.action.__module__), '__version__', None)
+            action = {'action': self._action_identity(), 'version': version}
+        
+        key = {
+            **action,
+            'inputs': digest_files(inputs, DigestMemo.shared(run_metadata.digest_memo), snapshot = run_metadata._snapshot),
+            'outputs': [op.basename(path).partition('.')[2] for path in outputs],
+        }
+        return hashlib.sha256(json.dumps(key, sort_keys = True).encode()).hexdigest()
+    
+    def _use_cache(self, run_metadata) -> bool:
+        return self.cache and run_metadata.result_cache is not None and not (run_metadata.preview or run_metadata.broadcast_metadata)
+    
+    def _cache_lookup(self, run_metadata) -> tuple:
+        '''
+        (key, hit) of this work in RunMetaData.result_cache, outputs are restored if hit
+        '''
+        key = self._cache_key(run_metadata)
+        hit = ResultCache(run_metadata.result_cache, run_metadata.result_cache_size).get(key, [component.use_name() for component in self.output_components_list])
+        self._invalidate_outputs(run_metadata)
+        
+        if hit:
+            logging.getLogger(run_metadata.logger).info(f"restore outputs of {self.name} from result cache {run_metadata.result_cache}, key is {key}")
+        return key, hit
+    
+    def _cache_store(self, run_metadata, key):
+        '''
+        store outputs of this work in RunMetaData.result_cache after running, a failure to store is only logged
+        '''
+        logger = logging.getLogger(run_metadata.logger)
+        outputs = [component.use_name() for component in self.output_components_list]
+        
+        _missing = [path for path in outputs if not op.exists(path)]
+        if _missing:
+            logger.warning(f"output {_missing} of {self.name} does not exist after running, it is not stored in result cache")
+            return
+        
+        try:
+            if ResultCache(run_metadata.result_cache, run_metadata.result_cache_size).put(key, outputs, {'work': self.name, 'work_heap': list(run_metadata._work_heap)}):
+                logger.debug("store outputs of %s in result cache %s, key is %s", self.name, run_metadata.result_cache, key)
+        except OSError as e:
+            logger.warning(f"failed to store outputs of {self.name} in result cache {run_metadata.result_cache} with error {e}")
+
+                               
     def run(self, run_metadata):
         '''
         run the action
@@ -685,31 +1144,180 @@ class Work(object):
         
         '''
         
-        run_metadata = self._pre_run(run_metadata)
+        if self._resumed(run_metadata):
+            return
         
-        logger = logging.getLogger(run_metadata.logger)
+        with WorkProfiler(self, run_metadata) as profiler, self._journaled(run_metadata, profiler):
+            
+            with profiler.phase('pre_run'):
+                run_metadata = self._pre_run(run_metadata)
+            
+            logger = logging.getLogger(run_metadata.logger)
+            
+            if run_metadata._skip:
+                logger.debug("_skip flag is %s, skip running %s", run_metadata._skip, self.name)
+                profiler.status = 'skip'
+                return
+            
+            _cache_key, _hit = self._cache_lookup(run_metadata) if self._use_cache(run_metadata) else (None, False)
+            if _hit:
+                profiler.status = 'cache'
+                self._finish_run(run_metadata)
+                return
+            
+            with profiler.phase('action'):
+                
+                if self.exception_tolerance:                
+                    try:
+                        self._run_action(run_metadata)
+                    except Exception as e:
+                        import traceback
+                        logger.error(f"error when running {self.name}'s _run_action with error {e}, but exception_tolerance is True, so continue running \n {traceback.format_exc()}")
+                        profiler.status = 'failure'
+                        return
+                else:
+                    self._run_action(run_metadata)
+
+            #outputs of a failed action are not invalidated, so the snapshot doesn't tell works after it that they exist
+            self._invalidate_outputs(run_metadata)
+            
+            if _cache_key is not None:
+                self._cache_store(run_metadata, _cache_key)
+            
+            self._finish_run(run_metadata)
+    
+    async def arun(self, run_metadata, semaphore: asyncio.Semaphore = None):
+        '''
+        run the action in an event loop, this is the same as run except
         
-        if run_metadata._skip:
-            logger.debug(f"_skip flag is {run_metadata._skip}, skip running {self.name}")
+        the action is run in the default executor of the loop, CommandWork awaits its command in a subprocess instead
+        semaphore
+            at most semaphore's value actions of all works sharing the semaphore run at the same time, None means no limit
+        '''
+        
+        if self._resumed(run_metadata):
             return
         
-        if self.exception_tolerance:                
-            try:
-                self._run_action(run_metadata)
-            except Exception as e:
-                import traceback
-                logger.error(f"error when running {self.name}'s _run_action with error {e}, but exception_tolerance is True, so continue running \n {traceback.format_exc()}")
-        else:
-            self._run_action(run_metadata)
-                 
+        with WorkProfiler(self, run_metadata) as profiler, self._journaled(run_metadata, profiler):
+            
+            with profiler.phase('pre_run'):
+                run_metadata = self._pre_run(run_metadata)
+            
+            logger = logging.getLogger(run_metadata.logger)
+            
+            if run_metadata._skip:
+                logger.debug("_skip flag is %s, skip running %s", run_metadata._skip, self.name)
+                profiler.status = 'skip'
+                return
+            
+            #inputs are hashed and outputs are restored in the default executor, so the loop is not blocked
+            _cache_key, _hit = (await asyncio.get_running_loop().run_in_executor(None, contextvars.copy_context().run, self._cache_lookup, run_metadata)) if self._use_cache(run_metadata) else (None, False)
+            if _hit:
+                profiler.status = 'cache'
+                self._finish_run(run_metadata)
+                return
+            
+            async with (nullcontext() if semaphore is None else semaphore):
+                
+                with profiler.phase('action'):
+                    
+                    if self.exception_tolerance:                
+                        try:
+                            await self._arun_action(run_metadata)
+                        except Exception as e:
+                            import traceback
+                            logger.error(f"error when running {self.name}'s _arun_action with error {e}, but exception_tolerance is True, so continue running \n {traceback.format_exc()}")
+                            profiler.status = 'failure'
+                            return
+                    else:
+                        await self._arun_action(run_metadata)
                 
+                #outputs of a failed action are not invalidated, so the snapshot doesn't tell works after it that they exist
+                self._invalidate_outputs(run_metadata)
+            
+            if _cache_key is not None:
+                await asyncio.get_running_loop().run_in_executor(None, contextvars.copy_context().run, self._cache_store, run_metadata, _cache_key)
+            
+            self._finish_run(run_metadata)
+    
+    async def _arun_action(self, run_metadata):
+        #the context is copied, so records logged by the action know its work, see logs.py
+        await asyncio.get_running_loop().run_in_executor(None, contextvars.copy_context().run, self._run_action, run_metadata)
+    
+    def _finish_run(self, run_metadata):
+        
+        if run_metadata.incremental and not (run_metadata.preview or run_metadata.broadcast_metadata):
+            self._write_manifest(run_metadata)
+        
+        logger = logging.getLogger(run_metadata.logger)
         logger.info(f"finish running action {self.action.__name__} of work {self.name}")
             
     
+    def _remove_failed_outputs(self, run_metadata):
+        '''
+        remove outputs written by a failed attempt of a command or an interrupted run, tools like afni refuse to overwrite them, and a partial output would be taken as done by skip_exist
+        '''
+        for component in self.output_components_set - self.input_components_set:
+            if op.lexists(component.use_name()):
+                component.remove_file()
+    
+    def _resumed(self, run_metadata) -> bool:
+        '''
+        test whether this work is skipped by a resumed run because it finished in the journal, see resume of RunMetaData
+        if so, output components are given run_metadata and formats as if it ran, nothing is read on the disk
+        '''
+        if run_metadata._resume.get(run_metadata._work_heap + (self.name,)) != 'finish':
+            return False
+        
+        _bind_outputs(self, run_metadata)
+        logging.getLogger(run_metadata.logger).info(f"skip running {self.name}, it finished in journal {run_metadata.journal}")
+        return True
+    
+    @contextmanager
+    def _journaled(self, run_metadata, profiler):
+        '''
+        record start of this work in the journal of run_metadata, and finish or fail when it exits, status of profiler tells a failure tolerated by exception_tolerance
+        '''
+        if run_metadata.journal is None or run_metadata.preview or run_metadata.broadcast_metadata:
+            yield
+            return
+        
+        journal = RunJournal.shared(run_metadata.journal)
+        key = (run_metadata.rootdir, run_metadata.subject, run_metadata.session, run_metadata._work_heap + (self.name,))
+        journal.record(*key, 'start')
+        try:
+            yield
+        except BaseException:
+            journal.record(*key, 'fail')
+            raise
+        if profiler.status == 'failure':
+            journal.record(*key, 'fail')
+        else: #works of a workflow may have run in other processes, so components are bound again here
+            journal.record(*key, 'finish', _bound_journal_identity(self, run_metadata, {}))
+    
+    def _journal_identity(self) -> str:
+        '''
+        identity of this work recorded in the journal when it finishes, a resumed run only skips the work if it is the same, see resume of RunMetaData
+        '''
+        return self._action_identity()
+    
+    def _invalidate_outputs(self, run_metadata):
+        '''
+        tell the snapshot of the run that output files may be created or changed by the action
+        '''
+        for component in self.output_components_set:
+            run_metadata._snapshot.invalidate(component.use_name())
         
     def add_action(self, action):
         self.action = action
     
+THREAD_ENV_VARIABLES = (
+    'OMP_NUM_THREADS', # afni and most openmp programs
+    'ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS', # ants
+    'MKL_NUM_THREADS',
+    'OPENBLAS_NUM_THREADS',
+)
+
 class CommandWork(Work):
     '''
     class to wrap command line as a work, it is a work whose action is _run_shell_command
@@ -732,6 +1340,19 @@ class CommandWork(Work):
         print stdout to log
     env : dict
         environment variables for the command, will use system's environment variables as a base and add or replace variables of it using env
+    stream_output : bool
+        read stdout and stderr line by line while the command is running, stdout is written to save_stdout_to and log at once, so memory used doesn't grow with the output and the progress can be seen in log
+        if False, output is read when the command exits
+    stderr_tail : int
+        number of last lines of stderr kept for the error message when the command fails and stream_output is True
+    timeout : float
+        seconds an attempt of the command can run, then the command and processes started by it are killed and the attempt fails with TimeoutError. None means no limit
+    retries : int
+        number of times the command is run again after it fails or times out, e.g. for transient errors of a network file system. outputs of the failed attempt are removed before the next one
+    retry_backoff : float
+        seconds to wait before the first retry, doubled for each next retry
+    cpus : int
+        (inherited from Work) if it is given, THREAD_ENV_VARIABLES such as OMP_NUM_THREADS are setted to cpus in env of the command, unless they are given in env
         
     (inherited from Work)
     name : str
@@ -778,7 +1399,7 @@ class CommandWork(Work):
         run this work by executing action, most of other parameters are served for this method. more details see the method's __doc__
     '''
     
-    def __init__(self, name, input_components=None, output_components=None, command_list = None, save_stdout_to = None, stdout_to_log = True, env = None, **kwargs):
+    def __init__(self, name, input_components=None, output_components=None, command_list = None, save_stdout_to = None, stdout_to_log = True, env = None, stream_output = True, stderr_tail = 100, timeout: float = None, retries: int = 0, retry_backoff: float = 10, **kwargs):
         
         super().__init__(name, input_components, output_components, self._run_shell_command, **kwargs)
         if command_list is None:
@@ -787,18 +1408,38 @@ class CommandWork(Work):
             self.command_list = command_list
         self.save_stdout_to = save_stdout_to
         self.stdout_to_log = stdout_to_log
+        self.stream_output = stream_output
+        self.stderr_tail = stderr_tail
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_backoff = retry_backoff
         
-        if env is None:
+        if env is None and self.cpus is None:
             self.env = None
         else:
             self.env = os.environ.copy()
-            self.env.update(env)
+            if self.cpus is not None:
+                self.env.update({variable: str(self.cpus) for variable in THREAD_ENV_VARIABLES})
+            self.env.update(env or {})
         
     def _run_shell_command(self, command_list: list, run_metadata: RunMetaData):
+        '''
+        run the command, it is run again at most retries times if it fails or times out
+        '''
+        logger = logging.getLogger(run_metadata.logger)
+        
+        for attempt in range(self.retries + 1):
+            try:
+                self._run_command_attempt(command_list, run_metadata)
+                return
+            except Exception as e:
+                retry_or_raise(e, attempt, self.retries, self.retry_backoff, lambda: self._remove_failed_outputs(run_metadata), time.sleep, self.name, logger)
+    
+    def _run_command_attempt(self, command_list: list, run_metadata: RunMetaData):
     
         command = shlex.join(command_list)
         logger = logging.getLogger(run_metadata.logger)
-        logger.debug(f"start running command {command} inside _run_shell_command")
+        logger.debug("start running command %s inside _run_shell_command", command)
         
         
         try:
@@ -807,22 +1448,41 @@ class CommandWork(Work):
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,  # Capture stderr separately
                 text=True,  # Return strings instead of bytes
-                env=self.env
+                bufsize=1, # line buffered, so stream_output get lines once they are printed
+                env=self.env,
+                start_new_session=True # so that processes started by the command can be killed together
             )
             
-            # Wait for the process to complete and capture output
-            stdout, stderr = process.communicate()
+            #the timer kills the process group, then pipes are closed and reading them below stops
+            timed_out = threading.Event()
+            def _kill_on_timeout():
+                timed_out.set()
+                kill_process_group(process)
+            timer = None if self.timeout is None else threading.Timer(self.timeout, _kill_on_timeout)
             
-            if self.save_stdout_to is not None:
-                with open(self.save_stdout_to.use_name(), 'w') as f:
-                    f.write(stdout)
-            
-            if self.stdout_to_log:
-                for line in stdout.splitlines():
-                    logger.debug(line)
+            try:
+                if timer is not None:
+                    timer.daemon = True
+                    timer.start()
+                
+                if self.stream_output:
+                    stdout, stderr = self._stream_process(process, OutputLimiter(logger, run_metadata.log_output_rate))
                 
-            for line in stderr.splitlines():
-                logger.debug(line) #tools like afni use stderr print normal information
+                else:
+                    # Wait for the process to complete and capture output
+                    stdout, stderr = process.communicate()
+                    self._handle_output(stdout, stderr, OutputLimiter(logger, run_metadata.log_output_rate))
+            except BaseException:
+                if process.poll() is None:
+                    kill_process_group(process)
+                    process.wait()
+                raise
+            finally:
+                if timer is not None:
+                    timer.cancel()
+            
+            if timed_out.is_set():
+                raise TimeoutError(f"command {command} of {self.name} is killed after running {self.timeout} s")
             
             # Check the return code
             if process.returncode != 0:
@@ -830,6 +1490,9 @@ class CommandWork(Work):
                     process.returncode, command, stdout, stderr)
 
 
+        except TimeoutError as e:
+            logger.error(str(e))
+            raise
         except subprocess.CalledProcessError as e:
             # Handle command execution errors
             import traceback
@@ -854,9 +1517,215 @@ class CommandWork(Work):
             raise Exception(f"unexpected error executing command: {command}: {e}")
         
         
-        logger.debug(f"finish running command {command} inside _run_shell_command")
-   
-
+        logger.debug("finish running command %s inside _run_shell_command", command)
+    
+    def _plan_step(self, run_metadata) -> dict:
+        
+        step = super()._plan_step(run_metadata)
+        step.update({
+            'action': None,
+            'argv': self._render_command_list(),
+            'env': None if self.env is None else {key: value for key, value in self.env.items() if os.environ.get(key) != value},
+            'stdout': None if self.save_stdout_to is None else self.save_stdout_to.use_name(),
+            'timeout': self.timeout,
+            'retries': self.retries,
+            'retry_backoff': self.retry_backoff,
+            'pass_run_metadata': False,
+        })
+        return step
+    
+    def _handle_output(self, stdout, stderr, output):
+        '''
+        save and log whole stdout and stderr of a finished command when stream_output is False, lines are logged by output, an OutputLimiter
+        '''
+        if self.save_stdout_to is not None:
+            with open(self.save_stdout_to.use_name(), 'w') as f:
+                f.write(stdout)
+        
+        if self.stdout_to_log:
+            for line in stdout.splitlines():
+                output(line)
+            
+        for line in stderr.splitlines():
+            output(line) #tools like afni use stderr print normal information
+        
+        output.close()
+    
+    async def _arun_action(self, run_metadata):
+        
+        if run_metadata.preview or run_metadata.broadcast_metadata or self.action.__name__  != '_run_shell_command':
+            await super()._arun_action(run_metadata)
+            return
+        
+        _run_command_list = self._render_command_list()
+        
+        logger = logging.getLogger(run_metadata.logger)
+        logger.info(f"start running action {self.action.__name__} {_run_command_list} of work {self.name} with command list")
+        
+        await self._arun_shell_command(_run_command_list, run_metadata)
+    
+    async def _arun_shell_command(self, command_list: list, run_metadata: RunMetaData):
+        '''
+        the same as _run_shell_command, but the command is run with asyncio.create_subprocess_exec and awaited
+        if the awaiting task is cancelled, the command and processes started by it are killed, a task waiting to retry is cancelled at once
+        '''
+        logger = logging.getLogger(run_metadata.logger)
+        
+        for attempt in range(self.retries + 1):
+            try:
+                await self._arun_command_attempt(command_list, run_metadata)
+                return
+            except Exception as e:
+                await retry_or_raise(e, attempt, self.retries, self.retry_backoff, lambda: self._remove_failed_outputs(run_metadata), asyncio.sleep, self.name, logger)
+    
+    async def _arun_command_attempt(self, command_list: list, run_metadata: RunMetaData):
+        
+        command = shlex.join(command_list)
+        logger = logging.getLogger(run_metadata.logger)
+        logger.debug("start running command %s inside _arun_shell_command", command)
+        
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *command_list,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                env=self.env,
+                start_new_session=True # so that processes started by the command can be killed together
+            )
+            
+            async def _communicate():
+                if self.stream_output:
+                    return await self._astream_process(process, OutputLimiter(logger, run_metadata.log_output_rate))
+                stdout, stderr = await process.communicate()
+                stdout, stderr = stdout.decode(errors = 'replace'), stderr.decode(errors = 'replace')
+                self._handle_output(stdout, stderr, OutputLimiter(logger, run_metadata.log_output_rate))
+                return stdout, stderr
+            
+            try:
+                stdout, stderr = await asyncio.wait_for(_communicate(), self.timeout)
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"command {command} of {self.name} is killed after running {self.timeout} s")
+            finally:
+                if process.returncode is None: #cancelled or timed out
+                    kill_process_group(process)
+                    await process.wait()
+            
+            # Check the return code
+            if process.returncode != 0:
+                raise subprocess.CalledProcessError(
+                    process.returncode, command, stdout, stderr)
+        
+        except TimeoutError as e:
+            logger.error(str(e))
+            raise
+        except subprocess.CalledProcessError as e:
+            # Handle command execution errors
+            import traceback
+            logger.error(f"Error executing command: {command}\nReturn code: {e.returncode}\nError output: {e.stderr}\n {traceback.format_exc()}")
+            raise Exception(
+                f"""
+                Error executing command: {command}
+                Return code: {e.returncode}
+                Error output: {e.stderr}
+                """
+            )
+        except OSError as e:
+            # Handle OS-level errors (e.g., command not found)
+            import traceback
+            logger.error(f"OS error when trying to execute {command}: {e} \n {traceback.format_exc()}")
+            raise Exception(f"OS error when trying to execute {command}: {e}")
+
+        except Exception as e:
+            # Handle all other exceptions
+            import traceback
+            logger.error(f"unexpected error executing command: {command}: {e} \n {traceback.format_exc()}")
+            raise Exception(f"unexpected error executing command: {command}: {e}")
+        
+        logger.debug("finish running command %s inside _arun_shell_command", command)
+    
+    async def _astream_process(self, process, output):
+        '''
+        the same as _stream_process for a process of asyncio.create_subprocess_exec, pipes are read in chunks so a very long line doesn't exceed the limit of StreamReader.readline
+        '''
+        from collections import deque
+        
+        stderr_tail = deque(maxlen = self.stderr_tail)
+        
+        async def _pump(reader, handle_line):
+            buffer = b''
+            while chunk := await reader.read(1 << 16):
+                buffer += chunk
+                *lines, buffer = buffer.split(b'\n')
+                for line in lines:
+                    handle_line(line.decode(errors = 'replace') + '\n')
+            if buffer:
+                handle_line(buffer.decode(errors = 'replace'))
+        
+        def _handle_stdout(line):
+            if stdout_file is not None:
+                stdout_file.write(line)
+            if self.stdout_to_log:
+                output(line)
+        
+        def _handle_stderr(line):
+            stderr_tail.append(line)
+            output(line) #tools like afni use stderr print normal information
+        
+        stdout_file = None if self.save_stdout_to is None else open(self.save_stdout_to.use_name(), 'w')
+        
+        try:
+            await asyncio.gather(_pump(process.stdout, _handle_stdout), _pump(process.stderr, _handle_stderr))
+            await process.wait()
+        finally:
+            if stdout_file is not None:
+                stdout_file.close()
+            output.close()
+        
+        return None, ''.join(stderr_tail)
+    
+    def _stream_process(self, process, output):
+        '''
+        pump stdout and stderr of a running process line by line in two threads until it exits, lines are logged by output, an OutputLimiter
+        return (None, last stderr_tail lines of stderr), stdout is not kept
+        '''
+        import threading
+        from collections import deque
+        
+        stderr_tail = deque(maxlen = self.stderr_tail)
+        
+        def _pump_stdout(stdout_file):
+            for line in process.stdout:
+                if stdout_file is not None:
+                    stdout_file.write(line)
+                if self.stdout_to_log:
+                    output(line)
+        
+        def _pump_stderr():
+            for line in process.stderr:
+                stderr_tail.append(line)
+                output(line) #tools like afni use stderr print normal information
+        
+        stdout_file = None if self.save_stdout_to is None else open(self.save_stdout_to.use_name(), 'w')
+        
+        try:
+            stderr_thread = threading.Thread(target = _pump_stderr, daemon = True)
+            stderr_thread.start()
+            _pump_stdout(stdout_file)
+            stderr_thread.join()
+            wait_process(process)
+        except BaseException:
+            kill_process_group(process)
+            raise
+        finally:
+            if stdout_file is not None:
+                stdout_file.close()
+            process.stdout.close()
+            process.stderr.close()
+            output.close()
+        
+        return None, ''.join(stderr_tail)
+   
+
 class Workflow(Work):
     '''
     Workflow is a container of a list of works
@@ -887,6 +1756,15 @@ class Workflow(Work):
         create a directed graph with components as nodes and works as edges
     work_directed_graph : nx.DiGraph
         create a directed graph with work as nodes and components as edges
+    work_dependencies : dict
+        map each work to the set of works which should finish before it, used when running with scheduler 'thread' or 'process'
+    
+    Methods
+    -------
+    plan : RunMetaData -> Plan
+        compile the workflow for a subject and session to a flat list of steps without running it
+    subworkflow : list[Component] -> Workflow
+        extract works needed to produce some components, pruning works which are up to date
     
         
     
@@ -895,7 +1773,7 @@ class Workflow(Work):
     def __init__(self, name, work_list = None, output_component_mannual = None, enable_auto_input = False, **kwargs):
         
         if work_list is None:
-            self.worklist = []
+            self.work_list = []
         else:
             if all(isinstance(work, Work) for work in work_list):
                 self.work_list = work_list
@@ -955,6 +1833,8 @@ class Workflow(Work):
         
         super().__init__(name, **kwargs)
         
+        self._work_predecessors_cache = None #(tuple of work_list, predecessors), see _work_predecessors
+        self._work_directed_graph = None #(predecessors it is built from, graph), see work_directed_graph
         self.input_components_set = self.get_input_components()
         self.output_components_set = self.get_output_components()
         
@@ -968,7 +1848,9 @@ class Workflow(Work):
         
         
     def add_work(self, work):
-        self.worklist.append(work)
+        self.work_list.append(work)
+        self._work_predecessors_cache = None
+        self._work_directed_graph = None
         self.input_components_set.update(work.input_components_set)
         self.output_components_set.update(work.output_components_set)
     
@@ -977,10 +1859,12 @@ class Workflow(Work):
         '''
         create a directed graph with components as nodes and works as edges        
         '''
+        import networkx as nx
+        
         G = nx.DiGraph()    
         G.add_nodes_from(self.all_components)
         
-        for work in self.worklist:
+        for work in self.work_list:
             G.add_edges_from(product(work.input_components_set, work.output_components_set))
         
         return G
@@ -990,8 +1874,9 @@ class Workflow(Work):
         draw a cp_directed_graph graph 
         '''
         import matplotlib.pyplot as plt
+        import networkx as nx
         
-        nx.draw(self.cp_directed_graph, with_labels=True, labels= {component: component.name for work in self.worklist for component in work.all_components}, node_color='lightblue', node_size=700, arrowstyle='-|>', arrowsize=20)
+        nx.draw(self.cp_directed_graph, with_labels=True, labels= {component: component.name for work in self.work_list for component in work.all_components}, node_color='lightblue', node_size=700, arrowstyle='-|>', arrowsize=20)
         plt.savefig(file_name)
     
     @property
@@ -1000,43 +1885,112 @@ class Workflow(Work):
         create a directed graph with work as nodes and components as edges
         components are contained in the components attribute of the edge
         if a work's input_component exist in multiple output_component_list of other works, if they are in the same branch, only keep the last one, if they are not in the same branch, conflict occur and raise error
+        
+        the graph is built from _work_predecessors and cached until work_list changes(add_work), it should not be modified
         '''
+        import networkx as nx
+        
+        predecessors = self._work_predecessors()
+        if self._work_directed_graph is not None and self._work_directed_graph[0] is predecessors:
+            return self._work_directed_graph[1]
+        
         directed_graph = nx.DiGraph()
-            
-        ancestor_test = return_ancestor_test(directed_graph)
-        from functools import cmp_to_key
+        directed_graph.add_nodes_from(predecessors)
+        for work, matched_works in predecessors.items():
+            for matched_work, components in matched_works.items():
+                directed_graph.add_edge(matched_work, work, components = components)
+        
+        self._work_directed_graph = (predecessors, directed_graph)
+        
+        return directed_graph
+    
+    def _work_predecessors(self) -> dict:
+        '''
+        map each work in work_list to {work whose output it reads: set of those components}, this is work_directed_graph in plain dicts, which is used to run the workflow without networkx
+        cached until work_list changes
+        '''
+        if self._work_predecessors_cache is not None and self._work_predecessors_cache[0] == tuple(self.work_list):
+            return self._work_predecessors_cache[1]
+        
+        predecessors = {}
+        
+        all_output_components = self.get_output_components()
+        
+        #works are added in order of work_list and edges only come from works before, so work_list is a topological order of the graph
+        _producers = {} #component -> works before the current one that output it, in order of work_list
+        _bit = {} #work -> 1 << index in work_list
+        _ancestors = {} #work -> bits of all its ancestors in the graph
                 
-        for work in self.worklist:
-            directed_graph.add_node(work)
+        for index, work in enumerate(self.work_list):
+            predecessors[work] = {}
+            _bit[work] = 1 << index
+            _ancestors[work] = 0
             
             for input_component in work.input_components_set:
                 
-                matched_works = set()
-                
-                for already_in_work in directed_graph.nodes:
-                    matched_works = [
-                        already_in_work
-                        for output_component in already_in_work.output_components_set
-                        if input_component == output_component
-                    ]
+                matched_works = [already_in_work for already_in_work in _producers.get(input_component, ()) if already_in_work is not work]
                                 
-                    if len(matched_works) == 0:
-                        raise ValueError(f"input component {input_component.simplified_bids_name()} of work {work.name} is not in any output components of any work")
-                    elif len(matched_works) == 1:
-                        matched_work = matched_works[0]
-                    elif len(matched_works) > 1: #test if they are in the same branch, if not, they are conflict, if yes,only keep the last one
-                        matched_works.sort(key = cmp_to_key(ancestor_test))
-                        print(f"input component {input_component.simplified_bids_name()} of work {work.name} is in output components of multiple works {[matched_work.name for matched_work in matched_works]} in same branch, only keep the last one {matched_works[-1].name}")
-                        matched_work = matched_works[-1]
-                        
-                if directed_graph.has_edge(matched_works, work):
-                    directed_graph[matched_work][work]['components'].add(input_component)
+                if len(matched_works) == 0:
+                    if input_component in all_output_components:
+                        raise ValueError(f"input component {input_component.simplified_bids_name()} of work {work.name} is only generated by works after it in work_list")
+                    continue #input of the whole workflow
+                elif len(matched_works) == 1:
+                    matched_work = matched_works[0]
+                else: #test if they are in the same branch, if not, they are conflict, if yes,only keep the last one
+                    for work1, work2 in zip(matched_works, matched_works[1:]):
+                        if not _ancestors[work2] & _bit[work1]:
+                            raise ValueError(f"work {work1.name} and work {work2.name} are not in the same branch, conflict")
+                    _logger.warning(f"input component {input_component.simplified_bids_name()} of work {work.name} is in output components of multiple works {[matched_work.name for matched_work in matched_works]} in same branch, only keep the last one {matched_works[-1].name}")
+                    matched_work = matched_works[-1]
+                
+                if matched_work in predecessors[work]:
+                    predecessors[work][matched_work].add(input_component)
                 else:
-                    directed_graph.add_edge(matched_work, work, components = {input_component})           
-                           
-
+                    predecessors[work][matched_work] = {input_component}
+                    _ancestors[work] |= _ancestors[matched_work] | _bit[matched_work]
+            
+            for output_component in work.output_components_set:
+                _producers.setdefault(output_component, []).append(work)
         
-        return directed_graph
+        self._work_predecessors_cache = (tuple(self.work_list), predecessors)
+        
+        return predecessors
+    
+    @property
+    def work_dependencies(self) -> dict:
+        '''
+        map each work in work_list to the set of works which should finish before it starts
+        besides edges of work_directed_graph (a work reads what another work writes), a work should also wait for
+            works before it that write or read a component it writes
+            works before it that read a component it reads with input_format, because input_format is set on the shared run_metadata of the component
+        '''
+        predecessors = self._work_predecessors()
+        dependencies = {work: set(predecessors[work]) for work in self.work_list}
+        
+        _last_writer = {}
+        _readers = {}
+        _format_readers = {}
+        
+        for work in self.work_list:
+            
+            for component in work.input_components_set:
+                if work.input_format is None:
+                    dependencies[work].update(_format_readers.get(component, []))
+                else:
+                    dependencies[work].update(_readers.get(component, []))
+                    _format_readers.setdefault(component, []).append(work)
+                _readers.setdefault(component, []).append(work)
+            
+            for component in work.output_components_set:
+                if component in _last_writer:
+                    dependencies[work].add(_last_writer[component])
+                dependencies[work].update(_readers.pop(component, []))
+                _format_readers.pop(component, None)
+                _last_writer[component] = work
+            
+            dependencies[work].discard(work)
+        
+        return dependencies
     
     def get_output_components(self):
         '''
@@ -1055,32 +2009,382 @@ class Workflow(Work):
         
                 
         
+    def subworkflow(self, targets: list, run_metadata = None):
+        '''
+        extract the works needed to produce target components to a new workflow with the same name and places, so files and manifests of its works are the same as in this workflow
+        
+        a work is needed if it outputs a target or a component read by a needed work, see _work_predecessors. a sub-workflow in work_list is kept or pruned as a whole
+        if run_metadata is given, needed works which are up to date on the disk are pruned with works only needed by them, a work is up to date if all its outputs exist and are not older than its inputs, and no work it reads from is rerun
+        a pruned work read by a kept work is replaced by a stand-in, which gives run_metadata and formats to its output components as the work would, but doesn't run
+        
+        Parameters
+        ----------
+        targets : list[Component]
+            components to produce, each should be an output of a work in work_list
+        run_metadata : RunMetaData
+            subject and session to test which works are up to date, None means no work is pruned
+        '''
+        producers = {}
+        for work in self.work_list: #the last work writing a component is its producer, as in work_directed_graph
+            for component in work.output_components_set:
+                producers[component] = work
+        
+        _not_produced = [component.simplified_bids_name() for component in targets if component not in producers]
+        if _not_produced:
+            raise ValueError(f"targets {_not_produced} are not produced by any work of {self.name}")
+        
+        predecessors = self._work_predecessors()
+        
+        needed = set()
+        _stack = [producers[component] for component in targets]
+        while _stack:
+            work = _stack.pop()
+            if work not in needed:
+                needed.add(work)
+                _stack.extend(predecessors[work])
+        
+        if run_metadata is None:
+            stale = needed
+        else:
+            _up_to_date = self._up_to_date_works(run_metadata, needed)
+            stale = set()
+            for work in self.work_list: #predecessors are before a work in work_list
+                if work in needed and (work not in _up_to_date or any(predecessor in stale for predecessor in predecessors[work])):
+                    stale.add(work)
+        
+        keep = set()
+        _stack = [producers[component] for component in targets if producers[component] in stale]
+        while _stack:
+            work = _stack.pop()
+            if work not in keep:
+                keep.add(work)
+                _stack.extend(predecessor for predecessor in predecessors[work] if predecessor in stale)
+        
+        _read = {predecessor for work in keep for predecessor in predecessors[work]}
+        work_list = [work if work in keep else _UpToDateWork(work) for work in self.work_list if work in keep or work in _read]
+        
+        logger = logging.getLogger(None if run_metadata is None else run_metadata.logger)
+        logger.info(f"subworkflow of {self.name} for {[component.simplified_bids_name() for component in targets]} runs {[work.name for work in self.work_list if work in keep]}, {len(needed) - len(keep)} needed works are up to date")
+        
+        return Workflow(self.name, work_list, derivatives_place = self.derivatives_place, data_place = self.data_place)
+    
+    def _up_to_date_works(self, run_metadata, works) -> set:
+        '''
+        works in works whose outputs all exist and are not older than their inputs, paths are resolved as Workflow.plan
+        '''
+        snapshot = FileSnapshot(run_metadata.fs_snapshot)
+        
+        for component in self.get_input_components():
+            component.run_metadata = run_metadata
+        
+        plan = Plan(run_metadata.rootdir, run_metadata.subject, run_metadata.session, self.name)
+        child_run_metadata = run_metadata.child(self.name, self.derivatives_place, self.data_place)
+        up_to_date = set()
+        
+        for work in self.work_list:
+            
+            start = len(plan)
+            work._plan(child_run_metadata, plan)
+            if work not in works:
+                continue
+            
+            outputs = {path for step in plan.steps[start:] for path in step['outputs']}
+            inputs = {path for step in plan.steps[start:] for path in step['inputs']} - outputs
+            
+            try:
+                oldest_output = min(snapshot.stat(path).st_mtime_ns for path in outputs)
+                newest_input = max((snapshot.stat(path).st_mtime_ns for path in inputs), default = 0)
+            except (FileNotFoundError, ValueError): #missing file, or no output
+                continue
+            
+            if oldest_output >= newest_input:
+                up_to_date.add(work)
+        
+        return up_to_date
+    
+    def _resume_states(self, run_metadata) -> dict:
+        '''
+        work_heap -> state of works of this workflow for a resumed run, read from the journal of the subject and session of run_metadata
+        'finish' : the work finished with the same identity(action or rendered command) and every work it reads from is skipped too, a finished sub-workflow is skipped as a whole. it is skipped
+        'start' or 'fail' : the work didn't finish, its partial outputs are removed before it is run
+        empty if run_metadata.resume is False
+        '''
+        if not run_metadata.resume:
+            return {}
+        
+        logger = logging.getLogger(run_metadata.logger)
+        states = RunJournal.shared(run_metadata.journal).states(run_metadata.rootdir, run_metadata.subject, run_metadata.session)
+        
+        #components are bound as in a serial run to render commands, nothing is read on the disk
+        for component in self.get_input_components():
+            component.run_metadata = run_metadata
+        identities = {}
+        _bound_journal_identity(self, run_metadata, identities)
+        
+        finished = set()
+        for work_heap, (state, identity) in states.items():
+            if state != 'finish':
+                continue
+            if identities.get(work_heap) != identity:
+                logger.info(f"{'.'.join(work_heap)} finished in journal {run_metadata.journal}, but its action changed since then, it is run again")
+                continue
+            finished.add(work_heap)
+        
+        resume = {work_heap: state for work_heap, (state, _) in states.items() if state != 'finish'}
+        for work_heap in _finished_work_heaps(self, finished, run_metadata._work_heap):
+            resume[work_heap] = 'finish'
+        
+        logger.info(f"resume {self.name} from journal {run_metadata.journal}, {sum(state == 'finish' for state in resume.values())} finished works or workflows are skipped")
+        return resume
+    
+    def plan(self, run_metadata) -> Plan:
+        '''
+        compile the workflow for the subject and session of run_metadata to a Plan, a flat list of steps with resolved paths, rendered commands, env and dependencies
+        nothing is read or written on the disk, a pipeline whose components, formats or commands are wrong raises here before any work runs
+        
+        input components of the workflow are given run_metadata, as run_batch does. components are bound as in a serial run, so the workflow should not be running
+        '''
+        for component in self.get_input_components():
+            component.run_metadata = run_metadata
+        
+        plan = Plan(run_metadata.rootdir, run_metadata.subject, run_metadata.session, self.name)
+        self._plan(run_metadata, plan)
+        
+        return plan
+    
+    def _plan(self, run_metadata, plan):
+        
+        run_metadata = run_metadata.child(self.name, self.derivatives_place, self.data_place)
+        
+        for work in self.work_list:
+            work._plan(run_metadata, plan)
+    
     def run(self, run_metadata):
         
-        #prevent original run_metadata from being changed
-        if run_metadata.intial:
-            run_metadata.iniiate = False
-            run_metadata = dc(run_metadata)
+        if not run_metadata._work_heap: #a new snapshot for each run of the outermost workflow
+            run_metadata = run_metadata.child(_snapshot = FileSnapshot(run_metadata.fs_snapshot), _resume = self._resume_states(run_metadata))
+        
+        if self._resumed(run_metadata):
+            return
+        
+        with WorkProfiler(self, run_metadata, kind = 'workflow') as profiler, self._journaled(run_metadata, profiler):
+            
+            run_metadata = run_metadata.child(self.name, self.derivatives_place, self.data_place)
+            logger = logging.getLogger(run_metadata.logger)
+            logger.info(f"run {self.name}, work_heap is {run_metadata._work_heap}")
+            logger.info(f"work_list is {[work.name for work in self.work_list]}")
+        
+        
+            if run_metadata.scheduler == 'serial' and run_metadata.on_failure == 'stop':
             
-        run_metadata._work_heap.append(self.name)
-        run_metadata._current_derivatives_place = run_metadata._current_derivatives_place + self.derivatives_place
-        run_metadata._current_data_place = run_metadata._current_data_place + self.data_place
+                for work in self.work_list:  
+                
+                    work.run(run_metadata)
+            elif run_metadata.scheduler == 'serial':
+                self._run_serial_continue(run_metadata)
+            else:
+                self._run_parallel(run_metadata)
+        
+            logger.info(f"finish running workflow {self.name}")  
+    
+    async def arun(self, run_metadata, semaphore: asyncio.Semaphore = None):
+        '''
+        run works of the workflow in an event loop, a work starts as soon as all works in its work_dependencies are finished
+        
+        semaphore
+            at most semaphore's value actions run at the same time, shared with sub-workflows, None means a new semaphore of run_metadata.max_workers(or cpu count)
+            to run many subjects in one event loop, give the same semaphore to arun of each subject's workflow, see arun_batch
+        
+        if a work raises, other works are cancelled and their running commands are killed, then the first exception is raised again
+        actions other than commands can't be stopped, they finish in the executor
+        if on_failure of run_metadata is 'continue', only works reading outputs of the failed work, directly or not, are skipped
+        '''
+        if not run_metadata._work_heap: #a new snapshot for each run of the outermost workflow
+            run_metadata = run_metadata.child(_snapshot = FileSnapshot(run_metadata.fs_snapshot), _resume = self._resume_states(run_metadata))
+        
+        if self._resumed(run_metadata):
+            return
+        
+        with WorkProfiler(self, run_metadata, kind = 'workflow') as profiler, self._journaled(run_metadata, profiler):
+            
+            run_metadata = run_metadata.child(self.name, self.derivatives_place, self.data_place)
+            logger = logging.getLogger(run_metadata.logger)
+            logger.info(f"arun {self.name}, work_heap is {run_metadata._work_heap}")
+        
+            if semaphore is None:
+                semaphore = asyncio.Semaphore(run_metadata.max_workers or os.cpu_count() or 1)
+        
+            tasks = {}
+            _continue = run_metadata.on_failure == 'continue'
+            predecessors = self._work_predecessors() if _continue else None
+        
+            async def _run_after(work, dependencies):
+                if not _continue:
+                    await asyncio.gather(*(tasks[dependency] for dependency in dependencies))
+                else:
+                    dependencies = list(dependencies)
+                    results = await asyncio.gather(*(tasks[dependency] for dependency in dependencies), return_exceptions = True)
+                    _failed = [dependency.name for dependency, result in zip(dependencies, results) if isinstance(result, BaseException) and dependency in predecessors[work]]
+                    if _failed:
+                        logger.warning(f"skip {work.name} because {_failed} it depends on failed")
+                        raise _DependencyFailed(work.name)
+                await work.arun(run_metadata, semaphore)
+        
+            for work, dependencies in self.work_dependencies.items(): #dependencies of a work are always before it in work_list
+                tasks[work] = asyncio.ensure_future(_run_after(work, dependencies))
+        
+            if not tasks:
+                return
+        
+            try:
+                done, pending = await asyncio.wait(tasks.values(), return_when = asyncio.ALL_COMPLETED if _continue else asyncio.FIRST_EXCEPTION)
+            except asyncio.CancelledError:
+                done, pending = set(), set(tasks.values())
+                raise
+            finally:
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions = True)
+        
+            errors = [(work, task.exception()) for work, task in tasks.items() if task in done and task.exception() is not None and not isinstance(task.exception(), _DependencyFailed)]
+            for work, error in errors:
+                logger.error(f"error when running {work.name} in workflow {self.name} with error {error}, {'works depending on it are skipped' if _continue else 'other works are cancelled'}")
+            if errors:
+                raise errors[0][1]
+        
+            logger.info(f"finish running workflow {self.name}")
+    
+    def _run_serial_continue(self, run_metadata):
+        '''
+        run works one by one in order of work_list, a work reading outputs of a failed or skipped work is skipped, see on_failure of RunMetaData
+        '''
         logger = logging.getLogger(run_metadata.logger)
-        logger.info(f"run {self.name}, work_heap is {run_metadata._work_heap}")
-        logger.info(f"work_list is {[work.name for work in self.work_list]}")
+        predecessors = self._work_predecessors()
+        failed = set()
+        error = None
         
+        for work in self.work_list:
+            
+            if failed.intersection(predecessors[work]):
+                logger.warning(f"skip {work.name} because {[predecessor.name for predecessor in predecessors[work] if predecessor in failed]} it depends on failed")
+                failed.add(work)
+                continue
+            
+            try:
+                work.run(run_metadata)
+            except Exception as e:
+                logger.error(f"error when running {work.name} in workflow {self.name} with error {e}, works depending on it are skipped")
+                failed.add(work)
+                error = error or e
         
-        for work in self.work_list:  
+        if error is not None:
+            raise error
+    
+    def _run_parallel(self, run_metadata):
+        '''
+        run works of the workflow in a thread or process pool, a work is submitted as soon as all works in its work_dependencies are finished and its resources are free
+        ready works are packed in order of work_list, a work which doesn't fit is passed over for smaller ones after it. a work larger than max_cpus or max_memory runs when nothing else is running
+        works inside a sub-workflow are run serially in the worker
+        
+        if a work raises, no more work will be submitted, works already running are waited and then the first exception is raised again, as a serial run stops at the failed work
+        if on_failure of run_metadata is 'continue', only works reading outputs of the failed work, directly or not, are not submitted
+        '''
+        from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+        
+        logger = logging.getLogger(run_metadata.logger)
+        waiting = {work: set(dependencies) for work, dependencies in self.work_dependencies.items()}
+        executor_class = ThreadPoolExecutor if run_metadata.scheduler == 'thread' else ProcessPoolExecutor
+        
+        running = {}
+        error = None
+        _continue = run_metadata.on_failure == 'continue'
+        predecessors = self._work_predecessors() if _continue else None
+        
+        max_cpus = run_metadata.max_cpus or os.cpu_count() or 1
+        max_memory = run_metadata.max_memory or _physical_memory()
+        used_cpus, used_memory = 0, 0
+        
+        with executor_class(max_workers = run_metadata.max_workers) as executor:
             
-            transfor_run_metadata = dc(run_metadata) 
-            work.run(transfor_run_metadata)
+            while waiting or running:
+                
+                if error is None or _continue:
+                    for work in [work for work in self.work_list if work in waiting and not waiting[work]]:
+                        cpus, memory = work.resources
+                        if running and (used_cpus + cpus > max_cpus or (max_memory is not None and used_memory + memory > max_memory)):
+                            continue
+                        
+                        if cpus > max_cpus or (max_memory is not None and memory > max_memory):
+                            logger.warning(f"{work.name} needs {cpus} cpus and {memory} MB memory, more than {max_cpus} cpus and {max_memory} MB memory of the machine, run it alone")
+                        
+                        del waiting[work]
+                        used_cpus, used_memory = used_cpus + cpus, used_memory + memory
+                        transfor_run_metadata = run_metadata.child(scheduler = 'serial')
+                        logger.debug("submit %s to %s pool", work.name, run_metadata.scheduler)
+                        running[executor.submit(_run_work, work, transfor_run_metadata)] = work
+                
+                if not running:
+                    break
+                
+                done, _ = wait(running, return_when = FIRST_COMPLETED)
+                
+                for future in done:
+                    work = running.pop(future)
+                    cpus, memory = work.resources
+                    used_cpus, used_memory = used_cpus - cpus, used_memory - memory
+                    try:
+                        output_run_metadata = future.result()
+                    except Exception as e:
+                        if error is None:
+                            error = e
+                        if not _continue:
+                            logger.error(f"error when running {work.name} in workflow {self.name} with error {e}, stop submitting works")
+                            continue
+                        
+                        logger.error(f"error when running {work.name} in workflow {self.name} with error {e}, works depending on it are skipped")
+                        _failed = [work]
+                        while _failed:
+                            failed_work = _failed.pop()
+                            for other in [other for other in waiting if failed_work in predecessors[other]]:
+                                logger.warning(f"skip {other.name} because {failed_work.name} it depends on failed")
+                                del waiting[other]
+                                _failed.append(other)
+                            for dependencies in waiting.values(): #works which only wait for failed_work to keep the order of writing can run
+                                dependencies.discard(failed_work)
+                        continue
+                    
+                    #works run in another process change their own copy of components
+                    for component, (component_run_metadata, component_format) in zip(_iter_output_components(work), output_run_metadata):
+                        if executor_class is ProcessPoolExecutor: #snapshot of the worker is a copy
+                            component_run_metadata = component_run_metadata.child(_snapshot = run_metadata._snapshot)
+                        component.run_metadata = component_run_metadata
+                        component._current_format = component_format
+                        run_metadata._snapshot.invalidate(component.use_name())
+                    
+                    for dependencies in waiting.values():
+                        dependencies.discard(work)
         
-        logger.info(f"finish running workflow {self.name}")  
+        if error is not None:
+            raise error
+        
+        if waiting:
+            raise ValueError(f"works {[work.name for work in waiting]} of {self.name} can't be scheduled, their dependencies form a cycle")
                 
     
     @property
     def all_components(self) -> set:
-        return {component for work in self.worklist for component in work.all_components}
+        return {component for work in self.work_list for component in work.all_components}
+    
+    @property
+    def resources(self) -> tuple:
+        '''
+        works of a sub-workflow run one by one in a worker, so it needs the largest cpus and memory of them if they are not declared for the workflow
+        '''
+        if not self.work_list:
+            return super().resources
+        
+        cpus, memory = zip(*(work.resources for work in self.work_list))
+        return (self.cpus or max(cpus), self.memory or max(memory))
     
     def update_output_components(func):
         '''
@@ -1104,7 +2408,155 @@ class Workflow(Work):
         
         
         
-def return_ancestor_test(graph: nx.DiGraph):
+def _physical_memory():
+    '''
+    physical memory of the machine in MB, None if it is unknown
+    '''
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024 * 1024)
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def _iter_output_components(work):
+    '''
+    yield output components of a work in a fixed order, recursing into workflows
+    the order is the same in every process, unlike iterating a set of components
+    '''
+    if isinstance(work, Workflow):
+        for sub_work in work.work_list:
+            yield from _iter_output_components(sub_work)
+    else:
+        yield from work.output_components_list
+
+
+def _run_work(work, run_metadata):
+    '''
+    run a work inside a worker of Workflow._run_parallel
+    return run_metadata and _current_format of the output components, so that they can be given back to the components in the main process
+    '''
+    work.run(run_metadata)
+    return [(component.run_metadata, component._current_format) for component in _iter_output_components(work)]
+
+
+def _bind_outputs(work, run_metadata):
+    '''
+    give run_metadata and formats to output components of a work as running it would, recursing into workflows, without running it or touching the disk
+    '''
+    if isinstance(work, Workflow):
+        run_metadata = run_metadata.child(work.name, work.derivatives_place, work.data_place)
+        for sub_work in work.work_list:
+            _bind_outputs(sub_work, run_metadata)
+    else:
+        work._bind_components(run_metadata)
+
+
+def _bound_journal_identity(work, run_metadata, identities) -> str:
+    '''
+    _journal_identity of work after binding its components to run_metadata as a serial run would, identities of work and works nested in it are added to identities by work_heap
+    a workflow's identity is a digest of identities of its works, so a workflow whose work changed is unfinished too
+    '''
+    if isinstance(work, _UpToDateWork):
+        return _bound_journal_identity(work.work, run_metadata, identities)
+    if isinstance(work, Workflow):
+        run_metadata = run_metadata.child(work.name, work.derivatives_place, work.data_place)
+        identity = _workflow_identity([(sub_work.name, _bound_journal_identity(sub_work, run_metadata, identities)) for sub_work in work.work_list])
+    else:
+        run_metadata = work._bind_components(run_metadata)
+        identity = work._journal_identity()
+    
+    identities[run_metadata._work_heap] = identity
+    return identity
+
+
+def _workflow_identity(identities) -> str:
+    '''
+    identity of a workflow from (name, identity) of its works in order
+    '''
+    return hashlib.sha256(json.dumps(identities).encode()).hexdigest()
+
+
+def _finished_work_heaps(work, finished, work_heap) -> set:
+    '''
+    work_heaps of work and works nested in it which a resumed run skips, given finished(work_heaps finished in the journal with the current identity)
+    a work is skipped if it finished and all works it reads from in its workflow are skipped, a finished workflow is skipped as a whole, otherwise its works are tested
+    '''
+    work_heap = work_heap + (work.name,)
+    if work_heap in finished:
+        return {work_heap}
+    if not isinstance(work, Workflow):
+        return set()
+    
+    predecessors = work._work_predecessors()
+    skipped = set()
+    skipped_works = set()
+    for sub_work in work.work_list: #predecessors are before a work in work_list
+        if not predecessors[sub_work].keys() <= skipped_works: #a work it reads from is rerun, so its outputs would be stale
+            continue
+        work_heaps = _finished_work_heaps(sub_work, finished, work_heap)
+        if work_heap + (sub_work.name,) in work_heaps:
+            skipped_works.add(sub_work)
+        skipped |= work_heaps
+    
+    return skipped
+
+
+def _file_signature(path, hash_file = False, previous = None, snapshot = None, memo = None) -> list:
+    '''
+    [size, mtime_ns, digest] of a file, digest is None if hash_file is False, see digest.py
+    digest of previous signature is reused if size and mtime are the same, otherwise it is looked up in memo(a DigestMemo, None means the shared memo in memory)
+    stat of the file is asked to snapshot if it is given
+    '''
+    stat = os.stat(path) if snapshot is None else snapshot.stat(path)
+    digest = None
+    
+    if hash_file:
+        if previous is not None and previous[:2] == [stat.st_size, stat.st_mtime_ns] and previous[2] is not None:
+            digest = previous[2]
+        else:
+            digest = (memo or DigestMemo.shared()).digest(path, stat)
+    
+    return [stat.st_size, stat.st_mtime_ns, digest]
+
+
+def _write_json(path, data):
+    '''
+    write a json file atomically, so a run interrupted when writing don't leave a broken file
+    '''
+    os.makedirs(op.dirname(path), exist_ok = True)
+    _temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(_temp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(_temp_path, path)
+
+
+def _topological_sort(dependencies: dict) -> list:
+    '''
+    sort keys of dependencies(key -> keys which should be before it) so that a key is after all of its dependencies, keys without dependencies keep their order
+    raise ValueError if there is a cycle
+    '''
+    remaining = {key: set(before) & dependencies.keys() for key, before in dependencies.items()}
+    after = {key: [] for key in dependencies}
+    for key, before in remaining.items():
+        for dependency in before:
+            after[dependency].append(key)
+    
+    order = [key for key, before in remaining.items() if not before]
+    for key in order: #order grows while it is iterated
+        for next_key in after[key]:
+            remaining[next_key].discard(key)
+            if not remaining[next_key]:
+                order.append(next_key)
+    
+    if len(order) != len(dependencies):
+        raise ValueError(f"dependencies have a cycle among {[getattr(key, 'name', key) for key in dependencies if key not in order]}")
+    
+    return order
+
+
+def return_ancestor_test(graph):
+    import networkx as nx
+    
     if not isinstance(graph, nx.DiGraph):
         raise ValueError("graph should be a DiGraph")
     
@@ -1118,6 +2570,32 @@ def return_ancestor_test(graph: nx.DiGraph):
     return _ancestor_test        
 
 
+class _DependencyFailed(Exception):
+    '''
+    raised by a work skipped by Workflow.arun because a work it depends on failed, see on_failure of RunMetaData
+    '''
+
+
+class _UpToDateWork(Work):
+    '''
+    stand-in of a work pruned by Workflow.subworkflow, running it only gives run_metadata and formats to output components of the work, so works reading them find the files
+    '''
+    def __init__(self, work):
+        
+        super().__init__(work.name, list(work.input_components_set), list(_iter_output_components(work)), derivatives_place = work.derivatives_place, data_place = work.data_place)
+        self.work = work
+    
+    def run(self, run_metadata):
+        logging.getLogger(run_metadata.logger).info(f"skip running {self.name}, its outputs are up to date")
+        _bind_outputs(self.work, run_metadata)
+    
+    async def arun(self, run_metadata, semaphore: asyncio.Semaphore = None):
+        self.run(run_metadata)
+    
+    def _plan(self, run_metadata, plan):
+        _bind_outputs(self.work, run_metadata)
+
+
 class AutoInput(object):
     def __init__(self, **kwargs) -> None:
         
@@ -0,0 +1,275 @@
+'''
+batch.py is a module to run a workflow on many subjects and sessions, each (subject, session) pair is run with its own RunMetaData in a worker of a process pool or a task of an event loop
+
+run_batch: fan a workflow out across subjects and sessions, return a summary of each run
+arun_batch: run a workflow for many subjects and sessions concurrently in one event loop
+write_plans: compile a workflow for many subjects and sessions and save the plans, each plan can be run by a job of a cluster array with python -m neuroworkflow.plan
+'''
+import os
+import os.path as op
+import logging
+import traceback
+import asyncio
+from copy import deepcopy as dc
+from itertools import product
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .base import RunMetaData
+from .plan import save_plan
+from .logs import start_logging, stop_logging
+
+
+def run_batch(workflow, rootdir: str, subjects: list, sessions: list = None, max_workers: int = None, logdir: str = None, logger: str = None, log_level = logging.INFO, log_per_work: bool = False, **kwargs) -> dict:
+    '''
+    run a workflow for every pair of subjects and sessions in a process pool
+
+    workflow and its actions are pickled to the workers, so actions should be defined at module level
+
+    Parameters
+    ----------
+    workflow : Workflow
+        workflow to run
+    rootdir : str
+        root directory of the run, see RunMetaData
+    subjects : list[str]
+        subject ids
+    sessions : list[str]
+        session ids, every subject is run with every session, None means subjects have no session
+    max_workers : int
+        max number of subjects running at the same time, None means the default of concurrent.futures
+    logdir : str
+        directory of per-subject log files, each run writes to sub-{subject}[_ses{session}].log, None means no log file
+        records are written by a listener thread of the run(see start_logging), the log of the last run is kept as .log.1 and a file is rotated when it reaches 64MB
+        warnings and errors are also given to handlers of the parent logger, works run by scheduler 'process' write sub-{subject}[_ses{session}].{pid}.log of their process
+    logger : str
+        name of the parent logger, logger of each run is {logger}.sub-{subject}[_ses{session}]
+    log_level : int
+        level of the logger of each run
+    log_per_work : bool
+        also write records of each work to sub-{subject}[_ses{session}]/{work_heap joined by '.'}.log in logdir
+    kwargs
+        other parameters of RunMetaData e.g. overwrite, skip_exist, preview, scheduler
+
+    Returns
+    -------
+    dict
+        map (subject, session) to a dict with keys
+        'status' : 'success', 'failure' or 'skip'(directory of the subject or session does not exist in rootdir)
+        'error' : traceback of the failure, None otherwise
+        'log_file' : path of the log file, None if logdir is None
+    '''
+    if not op.exists(rootdir):
+        raise ValueError(f"rootdir {rootdir} of batch run does not exist")
+
+    if sessions is None:
+        sessions = [None]
+
+    if logdir is not None:
+        os.makedirs(logdir, exist_ok = True)
+
+    _logger = logging.getLogger(logger)
+    summary = {}
+
+    with ProcessPoolExecutor(max_workers = max_workers) as executor:
+
+        futures = {
+            executor.submit(_run_subject, workflow, rootdir, subject, session, logdir, logger, log_level, log_per_work, kwargs): (subject, session)
+            for subject, session in product(subjects, sessions)
+        }
+
+        for future in as_completed(futures):
+            subject, session = futures[future]
+            try:
+                summary[(subject, session)] = future.result()
+            except Exception as e: #e.g. worker is killed or workflow can't be pickled
+                summary[(subject, session)] = {'status': 'failure', 'error': traceback.format_exc(), 'log_file': None}
+
+            _logger.info(f"sub-{subject} ses-{session} of {workflow.name} finished with status {summary[(subject, session)]['status']}")
+
+    _counts = {status: sum(result['status'] == status for result in summary.values()) for status in ('success', 'failure', 'skip')}
+    _logger.info(f"finish batch run of {workflow.name}, {_counts}")
+
+    return summary
+
+
+async def arun_batch(workflow, rootdir: str, subjects: list, sessions: list = None, max_concurrency: int = None, logdir: str = None, logger: str = None, log_level = logging.INFO, log_per_work: bool = False, **kwargs) -> dict:
+    '''
+    run a workflow for every pair of subjects and sessions concurrently in one event loop, see Workflow.arun
+
+    this suits workflows of CommandWork, whose works mostly wait for external commands. each run uses a deep copy of the workflow, because components store the RunMetaData of a run
+
+    Parameters
+    ----------
+    max_concurrency : int
+        max number of actions(commands) running at the same time across all subjects, None means cpu count
+    (others are the same as run_batch)
+
+    Returns
+    -------
+    dict
+        the same as run_batch
+    '''
+    if not op.exists(rootdir):
+        raise ValueError(f"rootdir {rootdir} of batch run does not exist")
+
+    if sessions is None:
+        sessions = [None]
+
+    if logdir is not None:
+        os.makedirs(logdir, exist_ok = True)
+
+    _logger = logging.getLogger(logger)
+    semaphore = asyncio.Semaphore(max_concurrency or os.cpu_count() or 1)
+    pairs = list(product(subjects, sessions))
+
+    results = await asyncio.gather(*(
+        _arun_subject(dc(workflow), rootdir, subject, session, logdir, logger, log_level, log_per_work, semaphore, kwargs)
+        for subject, session in pairs
+    ))
+    summary = dict(zip(pairs, results))
+
+    _counts = {status: sum(result['status'] == status for result in summary.values()) for status in ('success', 'failure', 'skip')}
+    _logger.info(f"finish batch run of {workflow.name}, {_counts}")
+
+    return summary
+
+
+def write_plans(workflow, rootdir: str, subjects: list, sessions: list = None, plandir: str = None, compress: bool = True, logger: str = None, **kwargs) -> dict:
+    '''
+    compile the workflow for every pair of subjects and sessions with Workflow.plan, validate and save the plans to plandir
+    a subject or session whose directory does not exist in rootdir is skipped as run_batch
+    
+    Parameters
+    ----------
+    plandir : str
+        directory of plans, each plan is saved to sub-{subject}[_ses{session}].json(.gz), None means {rootdir}/plans
+    compress : bool
+        gzip the plans
+    (others are the same as run_batch)
+    
+    Returns
+    -------
+    dict
+        map (subject, session) to path of the plan
+    '''
+    if not op.exists(rootdir):
+        raise ValueError(f"rootdir {rootdir} of batch run does not exist")
+    
+    if sessions is None:
+        sessions = [None]
+    
+    if plandir is None:
+        plandir = op.join(rootdir, 'plans')
+    os.makedirs(plandir, exist_ok = True)
+    
+    _logger = logging.getLogger(logger)
+    plan_files = {}
+    
+    for subject, session in product(subjects, sessions):
+        
+        run_metadata = _prepare_subject(workflow, rootdir, subject, session, logger, kwargs)
+        if run_metadata is None:
+            continue
+        
+        plan = workflow.plan(run_metadata)
+        plan.validate()
+        
+        plan_files[(subject, session)] = op.join(plandir, f"{_run_name(subject, session)}.json{'.gz' if compress else ''}")
+        save_plan(plan, plan_files[(subject, session)])
+    
+    _logger.info(f"write {len(plan_files)} plans of {workflow.name} to {plandir}")
+    
+    return plan_files
+
+
+def _run_name(subject, session):
+    if session is None:
+        return f'sub-{subject}'
+    else:
+        return f'sub-{subject}_ses{session}'
+
+
+def _open_subject_log(subject, session, logdir, logger, log_level, log_per_work):
+    '''
+    return name of the logger of a run, path of its log file and the QueueListener writing it
+    '''
+    run_name = _run_name(subject, session)
+    logger_name = run_name if logger is None else f'{logger}.{run_name}'
+
+    logging.getLogger(logger_name).setLevel(log_level)
+
+    listener = None
+    log_file = None
+    if logdir is not None:
+        log_file = op.join(logdir, f'{run_name}.log')
+        listener = start_logging(logger_name, log_file, op.join(logdir, run_name) if log_per_work else None, log_level)
+
+    return logger_name, log_file, listener
+
+
+def _close_subject_log(logger_name, listener):
+    if listener is not None:
+        stop_logging(logger_name, listener)
+
+
+def _prepare_subject(workflow, rootdir, subject, session, logger_name, kwargs):
+    '''
+    create RunMetaData of a run and give it to inputs of the workflow, return None if the run should be skipped
+    '''
+    run_metadata = RunMetaData(rootdir, subject, session, logger = logger_name, **kwargs)
+
+    if not op.exists(op.join(rootdir, run_metadata.session_place)):
+        logging.getLogger(logger_name).warning(f"skip {workflow.name} for {_run_name(subject, session)}, {op.join(rootdir, run_metadata.session_place)} does not exist")
+        return None
+
+    #inputs of the whole workflow are raw files of this subject
+    for component in workflow.get_input_components():
+        component.run_metadata = run_metadata
+
+    return run_metadata
+
+
+def _run_subject(workflow, rootdir, subject, session, logdir, logger, log_level, log_per_work, kwargs):
+    '''
+    run a workflow for one subject and session inside a worker of run_batch
+    '''
+    logger_name, log_file, listener = _open_subject_log(subject, session, logdir, logger, log_level, log_per_work)
+
+    try:
+        run_metadata = _prepare_subject(workflow, rootdir, subject, session, logger_name, kwargs)
+        if run_metadata is None:
+            return {'status': 'skip', 'error': None, 'log_file': log_file}
+
+        workflow.run(run_metadata)
+
+    except Exception as e:
+        logging.getLogger(logger_name).error(f"error when running {workflow.name} for {_run_name(subject, session)} with error {e} \n {traceback.format_exc()}")
+        return {'status': 'failure', 'error': traceback.format_exc(), 'log_file': log_file}
+
+    finally:
+        _close_subject_log(logger_name, listener)
+
+    return {'status': 'success', 'error': None, 'log_file': log_file}
+
+
+async def _arun_subject(workflow, rootdir, subject, session, logdir, logger, log_level, log_per_work, semaphore, kwargs):
+    '''
+    run a workflow for one subject and session in the event loop of arun_batch
+    '''
+    logger_name, log_file, listener = _open_subject_log(subject, session, logdir, logger, log_level, log_per_work)
+
+    try:
+        run_metadata = _prepare_subject(workflow, rootdir, subject, session, logger_name, kwargs)
+        if run_metadata is None:
+            return {'status': 'skip', 'error': None, 'log_file': log_file}
+
+        await workflow.arun(run_metadata, semaphore)
+
+    except Exception as e:
+        logging.getLogger(logger_name).error(f"error when running {workflow.name} for {_run_name(subject, session)} with error {e} \n {traceback.format_exc()}")
+        return {'status': 'failure', 'error': traceback.format_exc(), 'log_file': log_file}
+
+    finally:
+        _close_subject_log(logger_name, listener)
+
+    return {'status': 'success', 'error': None, 'log_file': log_file}
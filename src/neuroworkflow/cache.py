@@ -0,0 +1,156 @@
+'''
+cache.py is a module to keep outputs of deterministic works in a directory shared by subjects and reruns, so a work whose inputs and action were seen before restores its outputs instead of running, see RunMetaData.result_cache and cache of Work
+
+ResultCache: content addressed store of output files, keyed by a digest of inputs and action, bounded by size with least recently used eviction
+
+an entry is cache_dir/key[:2]/key/ with output files 0, 1, ... in order of output_components and entry.json describing them
+files of an entry are read only, outputs are restored as copies(a reflink when the file system supports it, otherwise a kernel copy), never as hardlinks, so a work rewriting its output in place never changes the entry
+a restored output gets the time of the restore as mtime, so it is newer than its inputs. recency of an entry for eviction is the mtime of its entry.json
+'''
+import os
+import os.path as op
+import json
+import time
+import shutil
+import logging
+import threading
+
+from .staging import stage_file, COPY_STRATEGIES
+
+
+_logger = logging.getLogger(__name__)
+_ENTRY_FILE = 'entry.json'
+
+
+class ResultCache(object):
+    '''
+    ResultCache is a class to store and restore output files of works by key
+
+    Parameters
+    ----------
+    cache_dir : str
+        directory of the cache, created if it does not exist
+    max_size : int
+        max total size(MB) of entries, entries least recently used are removed after an entry is stored. None means no limit
+
+    Methods
+    -------
+    get : (str, list) -> bool
+        restore output files of key to paths, return False if key is not in the cache
+    put : (str, list, dict) -> bool
+        store paths as outputs of key, return False if key was already stored
+    evict : int
+        remove entries least recently used until the cache is not larger than max_size, return the number of entries removed
+    '''
+
+    def __init__(self, cache_dir: str, max_size: int = None):
+
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(cache_dir, exist_ok = True)
+
+    def _entry_dir(self, key):
+        return op.join(self.cache_dir, key[:2], key)
+
+    def __contains__(self, key):
+        return op.exists(op.join(self._entry_dir(key), _ENTRY_FILE))
+
+    def get(self, key: str, paths: list) -> bool:
+
+        entry_dir = self._entry_dir(key)
+        try:
+            with open(op.join(entry_dir, _ENTRY_FILE), 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        if entry['count'] != len(paths):
+            _logger.warning(f"entry {key} of cache {self.cache_dir} has {entry['count']} outputs, but {len(paths)} are asked, it is not used")
+            return False
+
+        try:
+            for index, path in enumerate(paths):
+                #a hardlink would share the inode with the entry, a rerun of the work writing its output in place would change the entry for every subject
+                stage_file(op.join(entry_dir, str(index)), path, COPY_STRATEGIES)
+                os.utime(path) #the restored output is newer than its inputs, as if it was just written
+            os.utime(op.join(entry_dir, _ENTRY_FILE)) #mtime of entry.json is the last use
+        except FileNotFoundError: #evicted by another process while restoring
+            return False
+
+        return True
+
+    def put(self, key: str, paths: list, description: dict = None) -> bool:
+
+        entry_dir = self._entry_dir(key)
+        if key in self:
+            return False
+
+        #files are copied to a temporary directory which is renamed to the entry, so an entry is complete once it exists
+        os.makedirs(op.dirname(entry_dir), exist_ok = True)
+        temporary = f"{entry_dir}.tmp{os.getpid()}.{threading.get_ident()}"
+        try:
+            os.makedirs(temporary)
+            size = 0
+            for index, path in enumerate(paths):
+                stage_file(path, op.join(temporary, str(index)), COPY_STRATEGIES)
+                os.chmod(op.join(temporary, str(index)), 0o444)
+                size += os.path.getsize(path)
+
+            with open(op.join(temporary, _ENTRY_FILE), 'w') as f:
+                json.dump({'count': len(paths), 'size': size, 'time': time.time(), **(description or {})}, f)
+
+            try:
+                os.rename(temporary, entry_dir)
+            except OSError: #stored by another work or process at the same time
+                return False
+        finally:
+            if op.exists(temporary):
+                shutil.rmtree(temporary, ignore_errors = True)
+
+        if self.max_size is not None:
+            self.evict()
+        return True
+
+    def _entries(self) -> list:
+        '''
+        (mtime of entry.json, size, entry_dir) of all entries
+        '''
+        entries = []
+        for prefix in os.scandir(self.cache_dir):
+            if not prefix.is_dir():
+                continue
+            for entry in os.scandir(prefix.path):
+                if '.tmp' in entry.name:
+                    continue
+                try:
+                    with open(op.join(entry.path, _ENTRY_FILE), 'r') as f:
+                        size = json.load(f)['size']
+                    entries.append((os.stat(op.join(entry.path, _ENTRY_FILE)).st_mtime, size, entry.path))
+                except (OSError, ValueError, KeyError):
+                    continue
+        return entries
+
+    def evict(self) -> int:
+
+        if self.max_size is None:
+            return 0
+
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        limit = self.max_size * 1024 * 1024
+
+        removed = 0
+        for _, size, entry_dir in entries:
+            if total <= limit:
+                break
+            #entry.json is removed first, so the entry is a miss while its files are removed
+            try:
+                os.remove(op.join(entry_dir, _ENTRY_FILE))
+            except FileNotFoundError: #evicted by another process
+                continue
+            shutil.rmtree(entry_dir, ignore_errors = True)
+            total -= size
+            removed += 1
+            _logger.debug("evict %s from cache %s", entry_dir, self.cache_dir)
+
+        return removed
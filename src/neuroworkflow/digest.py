@@ -0,0 +1,171 @@
+'''
+digest.py is a module to compute digests of files behind components, so content based skipping(RunMetaData.incremental with hash_inputs) and the result cache(RunMetaData.result_cache) cost one stat for a file which is not changed since it was hashed
+
+file_digest: digest of a file, read in chunks of a memory map
+digest_files: digests of many files, files not in the memo are hashed in parallel
+DigestMemo: (path, size, mtime_ns, inode) -> digest, in memory of the process or in a SQLite file shared by runs and processes
+
+the hash is xxh3_128 if xxhash is installed, otherwise sha256 of hashlib, which openssl computes with sha instructions of most cpus. a digest is prefixed with the name of its hash, e.g. 'xxh3_128:...', so digests of different hashes never match
+'''
+import os
+import os.path as op
+import mmap
+import time
+import hashlib
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import xxhash
+except ImportError: #optional, sha256 is used instead
+    xxhash = None
+
+
+HASH_NAME = 'sha256' if xxhash is None else 'xxh3_128'
+CHUNK_SIZE = 1 << 24 #16MB, hashes release the GIL for each chunk, so threads hash different files at the same time
+
+_shared = {} #path of SQLite file(None for memory) -> DigestMemo, see DigestMemo.shared
+_lock = threading.Lock()
+
+
+def _new_hash():
+    return hashlib.sha256() if xxhash is None else xxhash.xxh3_128()
+
+
+def file_digest(path: str) -> str:
+    '''
+    digest of a file, the file is memory mapped and hashed in chunks of CHUNK_SIZE, so it is never copied to a python bytes
+    '''
+    digest = _new_hash()
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size: #an empty file can't be mapped
+            with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as mapped:
+                if hasattr(mapped, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+                    mapped.madvise(mmap.MADV_SEQUENTIAL)
+                with memoryview(mapped) as view:
+                    for start in range(0, len(view), CHUNK_SIZE):
+                        digest.update(view[start:start + CHUNK_SIZE])
+    return f"{HASH_NAME}:{digest.hexdigest()}"
+
+
+class DigestMemo(object):
+    '''
+    DigestMemo is a class to remember digests of files by (path, size, mtime_ns, inode), a file whose stat matches is not read again
+
+    Parameters
+    ----------
+    path : str
+        SQLite file keeping the memo between runs, it can be shared by processes and threads. None means the memo is kept in memory of this process
+
+    Methods
+    -------
+    digest : (str, os.stat_result) -> str
+        digest of a file from the memo, the file is hashed and remembered if it is not in the memo or changed
+    get : (str, os.stat_result) -> str
+        digest of a file from the memo, None if it is not in the memo or changed
+    set : (str, os.stat_result, str) -> None
+        remember the digest of a file
+    shared : str -> DigestMemo
+        the memo of path shared in this process, created at the first call
+    '''
+
+    def __init__(self, path: str = None):
+
+        self.path = path
+        self._memory = {} #path -> (size, mtime_ns, inode, digest)
+        self._local = threading.local() #a SQLite connection can only be used by the thread and process creating it
+
+        if path is not None:
+            os.makedirs(op.dirname(op.abspath(path)), exist_ok = True)
+            self._connection()
+
+    @classmethod
+    def shared(cls, path: str = None):
+        path = None if path is None else op.abspath(path)
+        with _lock:
+            if path not in _shared:
+                _shared[path] = cls(path)
+            return _shared[path]
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    def _connection(self):
+
+        if getattr(self._local, 'pid', None) != os.getpid(): #not created by this thread, or inherited by a forked process
+            connection = sqlite3.connect(self.path, timeout = 60, isolation_level = None)
+            connection.execute('PRAGMA journal_mode=WAL') #readers don't wait for a writer
+            connection.execute('CREATE TABLE IF NOT EXISTS digests (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, digest TEXT)')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    def get(self, path: str, stat: os.stat_result = None) -> str:
+
+        path = op.abspath(path)
+        stat = os.stat(path) if stat is None else stat
+        signature = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+        row = self._memory.get(path)
+        if row is None and self.path is not None:
+            row = self._connection().execute('SELECT size, mtime_ns, inode, digest FROM digests WHERE path = ?', (path,)).fetchone()
+
+        if row is None or tuple(row[:3]) != signature or not row[3].startswith(f"{HASH_NAME}:"):
+            return None
+
+        self._memory[path] = tuple(row)
+        return row[3]
+
+    def set(self, path: str, stat: os.stat_result, digest: str):
+
+        #a file changed again in the same tick of mtime after being hashed would look unchanged, so digests of files changed in the last 2 seconds are not remembered
+        if time.time_ns() - stat.st_mtime_ns < 2e9:
+            return
+
+        path = op.abspath(path)
+        row = (stat.st_size, stat.st_mtime_ns, stat.st_ino, digest)
+        self._memory[path] = row
+        if self.path is not None:
+            self._connection().execute('INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?, ?)', (path, *row))
+
+    def digest(self, path: str, stat: os.stat_result = None) -> str:
+
+        stat = os.stat(path) if stat is None else stat
+        digest = self.get(path, stat)
+        if digest is None:
+            digest = file_digest(path)
+            self.set(path, stat, digest)
+        return digest
+
+
+def digest_files(paths: list, memo: DigestMemo = None, max_workers: int = None, snapshot = None) -> list:
+    '''
+    digests of paths in order, files not in memo are hashed by a thread pool
+
+    memo
+        DigestMemo to look up and remember digests, None means the shared memo in memory of this process
+    max_workers
+        number of threads hashing files, None means the default of concurrent.futures
+    snapshot
+        FileSnapshot asked for stat of files, None means the file system
+    '''
+    memo = DigestMemo.shared() if memo is None else memo
+    stats = [os.stat(path) if snapshot is None else snapshot.stat(path) for path in paths]
+    digests = [memo.get(path, stat) for path, stat in zip(paths, stats)]
+
+    missing = [index for index, digest in enumerate(digests) if digest is None]
+    if len(missing) == 1:
+        digests[missing[0]] = file_digest(paths[missing[0]])
+    elif missing:
+        with ThreadPoolExecutor(max_workers = max_workers) as executor:
+            for index, digest in zip(missing, executor.map(file_digest, [paths[index] for index in missing])):
+                digests[index] = digest
+
+    for index in missing:
+        memo.set(paths[index], stats[index], digests[index])
+
+    return digests
@@ -0,0 +1,112 @@
+'''
+journal.py is a module to record which works of a run started and finished in an append-only file, so a run interrupted by a crash or a killed job is resumed from its unfinished works without testing outputs of the finished ones, see journal and resume of RunMetaData
+
+RunJournal: append-only json lines of (rootdir, subject, session, work_heap, event), each line is flushed to the disk before the work goes on
+
+a record is {"rootdir": ..., "subject": ..., "session": ..., "work_heap": [...], "event": ..., "identity": ..., "time": ..., "pid": ...}, event is
+    start : the work(or workflow) starts, its outputs may be partial until it finishes
+    finish : the work finished, was skipped or restored from the result cache, its outputs are complete
+    fail : the work raised
+the last record of a work decides its state, so a work started again after it finished is unfinished until it finishes again
+identity of a finish record is the action(or rendered command) of the work, or a digest of identities of works of a workflow, a finished work whose identity changed since then is unfinished, see Work._journal_identity
+records of runs of different rootdirs are kept apart, so cohorts sharing a journal never skip works of each other
+'''
+import os
+import os.path as op
+import json
+import time
+import threading
+
+
+_shared = {} #path -> RunJournal, see RunJournal.shared
+_lock = threading.Lock()
+
+EVENTS = ('start', 'finish', 'fail')
+
+
+class RunJournal(object):
+    '''
+    RunJournal is a class to append records of works to a journal file and read the last record of each work
+
+    the file can be shared by subjects run in processes of run_batch, each record is one os.write of a line to the file opened with O_APPEND followed by fsync, the file is closed after each record
+    a line broken by a crash when writing is ignored when reading
+
+    Parameters
+    ----------
+    path : str
+        journal file, created if it does not exist
+
+    Methods
+    -------
+    record : (str, str, str, tuple, str, str) -> None
+        append a record of event of a work of rootdir, subject and session, identity is only kept for finish
+    states : (str, str, str) -> dict
+        work_heap -> (last event, identity) of each work of rootdir, subject and session
+    shared : str -> RunJournal
+        the journal of path shared in this process, created at the first call
+    '''
+
+    def __init__(self, path: str):
+
+        self.path = op.abspath(path)
+        self._offset = 0 #records before it are read into _states
+        self._states = {} #(rootdir, subject, session) -> {work_heap: (event, identity)}
+        self._lock = threading.Lock()
+        os.makedirs(op.dirname(self.path), exist_ok = True)
+
+    @classmethod
+    def shared(cls, path: str):
+        path = op.abspath(path)
+        with _lock:
+            if path not in _shared:
+                _shared[path] = cls(path)
+            return _shared[path]
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    def record(self, rootdir: str, subject: str, session: str, work_heap: tuple, event: str, identity: str = None):
+
+        if event not in EVENTS:
+            raise ValueError(f"unknown event {event} of journal {self.path}, should be one of {EVENTS}")
+
+        line = json.dumps({'rootdir': op.abspath(rootdir), 'subject': subject, 'session': session, 'work_heap': list(work_heap), 'event': event, 'identity': identity if event == 'finish' else None, 'time': time.time(), 'pid': os.getpid()}) + '\n'
+
+        with self._lock:
+            fd = os.open(self.path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                size = os.fstat(fd).st_size
+                if size and os.pread(fd, 1, size - 1) != b'\n': #end the line broken by a crash, so it doesn't swallow this record
+                    os.write(fd, b'\n')
+                os.write(fd, line.encode())
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def _read(self):
+        '''
+        read records appended since the last read
+        '''
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(self._offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+
+        end = data.rfind(b'\n') + 1 #a line being written by another process is read next time
+        for line in data[:end].splitlines():
+            try:
+                record = json.loads(line)
+                self._states.setdefault((record['rootdir'], record['subject'], record['session']), {})[tuple(record['work_heap'])] = (record['event'], record['identity'])
+            except (ValueError, KeyError, TypeError): #broken by a crash when writing
+                continue
+        self._offset += end
+
+    def states(self, rootdir: str, subject: str, session: str = None) -> dict:
+        with self._lock:
+            self._read()
+            return dict(self._states.get((op.abspath(rootdir), subject, session), {}))
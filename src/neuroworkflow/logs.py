@@ -0,0 +1,258 @@
+'''
+logs.py is a module to take writing logs off the threads running works, records are put in a queue by the logger of a run and written to rotating files by one listener thread
+
+start_logging: route records of a logger through a queue to a rotating log file of the run, and a log file of each work if work_logdir is given
+stop_logging: write records left in the queue and close the files
+WorkFileHandler: handler writing each record to the rotating file of the work logging it
+OutputLimiter: log lines of the output of a command at most at a rate, lines over it are counted and their number is logged when the command exits
+current_work: context variable of the running work, set by WorkProfiler, so a record knows which work logs it
+'''
+import os
+import os.path as op
+import time
+import queue
+import logging
+import threading
+import contextvars
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+
+current_work = contextvars.ContextVar('current_work', default = None) #work_heap of the running work, see _work_heap of RunMetaData
+
+FORMAT = '%(asctime)s %(levelname)s %(message)s'
+
+
+class _WorkFilter(logging.Filter):
+    '''
+    add work_heap of the running work to a record when it is logged, before it leaves the thread and context of the work
+    '''
+    def filter(self, record):
+        if not hasattr(record, 'work_heap'):
+            record.work_heap = current_work.get()
+        return True
+
+
+class _QueueHandler(QueueHandler):
+    '''
+    QueueHandler whose records are handled directly in a forked process(scheduler 'process'), where nobody reads the copy of the queue
+    a forked process writes the log file to {log_file root}.{pid}{extension} of its own, so processes never roll over the same file, other handlers of the listener are used as they are
+    '''
+    def __init__(self, log_queue, handlers):
+        super().__init__(log_queue)
+        self._pid = os.getpid()
+        self._handlers = handlers
+        self._forked_pid = None
+        self._forked_handlers = None
+        self.addFilter(_WorkFilter())
+
+    def emit(self, record):
+        pid = os.getpid()
+        if pid == self._pid:
+            super().emit(record)
+            return
+        if pid != self._forked_pid:
+            self._forked_handlers = [_forked_handler(handler, pid) for handler in self._handlers]
+            self._forked_pid = pid
+        for handler in self._forked_handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+
+def _forked_handler(handler, pid):
+    '''
+    handler writing records of a forked process, a RotatingFileHandler is replaced by one of a file of the process, see _QueueHandler
+    '''
+    if not isinstance(handler, RotatingFileHandler):
+        return handler
+
+    root, extension = op.splitext(handler.baseFilename)
+    forked = RotatingFileHandler(f"{root}.{pid}{extension}", maxBytes = handler.maxBytes, backupCount = handler.backupCount)
+    forked.setLevel(handler.level)
+    forked.setFormatter(handler.formatter)
+    return forked
+
+
+class _ParentHandler(logging.Handler):
+    '''
+    handler giving records to handlers of the parent of a logger which doesn't propagate, e.g. errors of a run to the console or main.log of a batch
+    '''
+    def __init__(self, logger: str, level = logging.WARNING):
+        super().__init__(level)
+        self.logger = logger
+
+    def emit(self, record):
+        parent = logging.getLogger(self.logger).parent
+        if parent is not None:
+            parent.handle(record)
+
+
+class WorkFileHandler(logging.Handler):
+    '''
+    WorkFileHandler is a handler to write each record to {logdir}/{work_heap joined by '.'}.log, records logged outside any work are dropped
+    files are RotatingFileHandler opened when a work logs its first record
+
+    Parameters
+    ----------
+    logdir : str
+        directory of log files of works
+    max_bytes, backup_count : int
+        see RotatingFileHandler
+    '''
+
+    def __init__(self, logdir: str, max_bytes: int = 0, backup_count: int = 0):
+
+        super().__init__()
+        self.logdir = logdir
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._handlers = {} #work_heap -> RotatingFileHandler
+
+    def emit(self, record):
+
+        work_heap = getattr(record, 'work_heap', None)
+        if not work_heap:
+            return
+
+        handler = self._handlers.get(work_heap)
+        if handler is None:
+            os.makedirs(self.logdir, exist_ok = True)
+            handler = _rotating_file_handler(op.join(self.logdir, f"{'.'.join(work_heap)}.log"), self.max_bytes, self.backup_count)
+            handler.setFormatter(self.formatter)
+            self._handlers[work_heap] = handler
+        handler.emit(record)
+
+    def close(self):
+        for handler in self._handlers.values():
+            handler.close()
+        self._handlers = {}
+        super().close()
+
+
+def _rotating_file_handler(log_file, max_bytes, backup_count):
+    '''
+    RotatingFileHandler of log_file, the log of the last run is rolled over to log_file.1 instead of being appended to
+    '''
+    handler = RotatingFileHandler(log_file, maxBytes = max_bytes, backupCount = backup_count)
+    if handler.stream.tell() > 0:
+        if backup_count:
+            handler.doRollover()
+        else:
+            handler.stream.truncate(0)
+    return handler
+
+
+def start_logging(logger: str, log_file: str, work_logdir: str = None, level = logging.INFO, max_bytes: int = 64 * 1024 * 1024, backup_count: int = 1, formatter: logging.Formatter = None, forward_level = logging.WARNING) -> QueueListener:
+    '''
+    add a QueueHandler to logger, records are written to log_file(and log files of works) by a QueueListener thread, so threads running works only put records in a queue
+    records are not propagated to ancestors of logger until stop_logging, only records of forward_level and above are given to handlers of the parent logger by the listener
+    works run by scheduler 'process' write log_file.{pid} of their process instead, see _QueueHandler
+
+    Parameters
+    ----------
+    logger : str
+        name of the logger, see logger of RunMetaData
+    log_file : str
+        rotating log file of all records of logger
+    work_logdir : str
+        directory of a rotating log file of each work, see WorkFileHandler. None means no log file of works
+    level : int
+        level of the logger
+    max_bytes, backup_count : int
+        a log file is rolled over when it reaches max_bytes, backup_count old files are kept. 0 max_bytes means never. the log file of the last run is rolled over too if backup_count is not 0
+    formatter : logging.Formatter
+        formatter of log files, None means FORMAT
+    forward_level : int
+        level of records still given to the parent logger, e.g. warnings and errors to the console. None means none, nothing is forwarded if logger doesn't propagate
+
+    Returns
+    -------
+    QueueListener
+        give it to stop_logging when the run finishes
+    '''
+    formatter = formatter or logging.Formatter(FORMAT)
+    os.makedirs(op.dirname(op.abspath(log_file)), exist_ok = True)
+
+    _logger = logging.getLogger(logger)
+
+    handlers = [_rotating_file_handler(log_file, max_bytes, backup_count)]
+    if work_logdir is not None:
+        handlers.append(WorkFileHandler(work_logdir, max_bytes, backup_count))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    if forward_level is not None and _logger.propagate:
+        handlers.append(_ParentHandler(logger, forward_level))
+
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *handlers, respect_handler_level = True)
+    listener.queue_handler = _QueueHandler(log_queue, handlers)
+
+    _logger.setLevel(level)
+    _logger.addHandler(listener.queue_handler)
+    #handlers of ancestors would write every record on the thread logging it, e.g. a console handler of the batch
+    listener.propagate = _logger.propagate
+    _logger.propagate = False
+    listener.start()
+
+    return listener
+
+
+def stop_logging(logger: str, listener: QueueListener):
+    '''
+    remove the QueueHandler of start_logging from logger and restore its propagate, wait until the listener writes all records and close log files
+    '''
+    _logger = logging.getLogger(logger)
+    _logger.removeHandler(listener.queue_handler)
+    _logger.propagate = listener.propagate
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+
+
+class OutputLimiter(object):
+    '''
+    OutputLimiter is a callable to log lines of the output(stdout and stderr) of a command, tools like ants or freesurfer may print thousands of lines per second
+
+    lines are logged with lazy %-style formatting, nothing is done for a line if level is not enabled for logger
+    at most rate lines per second are logged, with bursts of rate lines, lines over it are counted and close logs their number
+
+    Parameters
+    ----------
+    logger : logging.Logger
+    rate : int
+        max lines per second, None means no limit, see log_output_rate of RunMetaData
+    level : int
+        level of the lines
+    '''
+
+    def __init__(self, logger: logging.Logger, rate: int = None, level = logging.DEBUG):
+
+        self.logger = logger
+        self.rate = rate
+        self.level = level
+        self.enabled = logger.isEnabledFor(level)
+        self._extra = {'work_heap': current_work.get()} #lines are pumped by threads which don't have the context of the work
+        self.suppressed = 0
+        self._tokens = rate
+        self._last = time.monotonic()
+        self._lock = threading.Lock() #stdout and stderr are pumped by two threads
+
+    def __call__(self, line: str):
+
+        if not self.enabled:
+            return
+
+        if self.rate is not None:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.rate, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens < 1:
+                    self.suppressed += 1
+                    return
+                self._tokens -= 1
+
+        self.logger.log(self.level, '%s', line.rstrip('\n'), extra = self._extra)
+
+    def close(self):
+        if self.suppressed:
+            self.logger.log(self.level, '%d lines of output are not logged, they are over %d lines per second', self.suppressed, self.rate, extra = self._extra)
@@ -0,0 +1,360 @@
+'''
+plan.py is a module to store a workflow compiled for one subject and session as a flat list of concrete steps, see Workflow.plan
+
+Plan: resolved input and output paths, rendered command, env and dependencies of every work of a run, which can be validated without touching the disk
+save_plan, load_plan: persist a plan as compact(optionally gzipped) json
+run_plan: run a plan step by step
+
+this module doesn't import base.py, so a plan can be loaded and run without importing networkx or building components, works and workflows
+
+python -m neuroworkflow.plan plan.json.gz run a saved plan, e.g. one job of a cluster array per subject
+'''
+import os
+import os.path as op
+import json
+import time
+import gzip
+import shlex
+import logging
+import importlib
+import subprocess
+import traceback
+
+from .retry import retry_or_raise, remove_output, kill_process_group
+
+
+class Plan(object):
+    '''
+    Plan is a class to store the steps of a run of a workflow in the order of a serial run
+
+    a step is a dict with keys
+        name : name of the work
+        work_heap : list, see _work_heap of RunMetaData
+        action : 'module:qualname' of the action, None for a command
+        argv : rendered command list of a CommandWork, None for an action
+        env : environment variables of the command which differ from os.environ, None means os.environ
+        stdout : path to save stdout of the command, None means not saved
+        timeout, retries, retry_backoff : see CommandWork, None for an action. plans saved before they were added run commands without timeout and retries
+        inputs, outputs : paths of input and output components in order of input_components and output_components
+        pass_run_metadata : whether the action takes run_metadata
+        exception_tolerance : see Work
+        cpus, memory : see Work
+        dependencies : indexes of steps which should finish before this step, a step reads a path after the last step writing it, and writes a path after steps reading or writing it before
+
+    Parameters
+    ----------
+    rootdir, subject, session : see RunMetaData
+    workflow : str
+        name of the workflow
+    steps : list[dict]
+        steps already compiled, e.g. read from a file
+
+    Attributes
+    ----------
+    inputs : list
+        paths read by steps which are not written by a step before, they should exist before the run
+
+    Methods
+    -------
+    add_step : dict -> int
+        append a step and resolve its dependencies, return its index
+    validate : None
+        raise ValueError with all problems found in the plan
+    to_dict : dict
+        plain dict of the plan
+    from_dict : dict -> Plan
+    '''
+
+    def __init__(self, rootdir: str, subject: str, session: str = None, workflow: str = None, steps: list = None):
+
+        self.rootdir = rootdir
+        self.subject = subject
+        self.session = session
+        self.workflow = workflow
+        self.steps = []
+        self._last_writer = {} #path -> index of the last step writing it
+        self._readers = {} #path -> indexes of steps reading it after its last writer
+
+        for step in steps or []:
+            self.steps.append(step)
+            self._track(len(self.steps) - 1, step)
+
+    def __len__(self):
+        return len(self.steps)
+
+    def _track(self, index, step):
+        for path in step['inputs']:
+            self._readers.setdefault(path, []).append(index)
+        for path in step['outputs']:
+            self._readers.pop(path, None)
+            self._last_writer[path] = index
+
+    def add_step(self, step: dict) -> int:
+
+        index = len(self.steps)
+        dependencies = set()
+
+        for path in step['inputs']:
+            if path in self._last_writer:
+                dependencies.add(self._last_writer[path])
+
+        for path in step['outputs']:
+            if path in self._last_writer:
+                dependencies.add(self._last_writer[path])
+            dependencies.update(self._readers.get(path, []))
+
+        dependencies.discard(index)
+        step['dependencies'] = sorted(dependencies)
+
+        self.steps.append(step)
+        self._track(index, step)
+
+        return index
+
+    @property
+    def inputs(self) -> list:
+        inputs = {} #dict keeps the order
+        written = set()
+        for step in self.steps:
+            inputs.update((path, None) for path in step['inputs'] if path not in written)
+            written.update(step['outputs'])
+        return list(inputs)
+
+    def validate(self, check_inputs: bool = False):
+        '''
+        test the plan without running it, all problems are raised together as a ValueError
+
+        check_inputs
+            also test whether inputs of the plan exist, this is the only check touching the disk
+        '''
+        problems = []
+        _outputs = {}
+        for index, step in enumerate(self.steps):
+            for path in step['outputs']:
+                _outputs.setdefault(path, []).append(index)
+
+        written = set()
+        for index, step in enumerate(self.steps):
+
+            if step['argv'] is None and step['action'] is None:
+                problems.append(f"step {index} {step['name']} has neither a command nor an action")
+            elif step['argv'] is not None:
+                if not step['argv']:
+                    problems.append(f"command of step {index} {step['name']} is empty")
+                elif not all(isinstance(item, str) for item in step['argv']):
+                    problems.append(f"command {step['argv']} of step {index} {step['name']} has items which are not strings")
+            elif '<' in step['action']:
+                problems.append(f"action {step['action']} of step {index} {step['name']} is a lambda or a local function, it can't be imported")
+            elif step['action'].startswith('__main__:'):
+                problems.append(f"action {step['action']} of step {index} {step['name']} is defined in the script which was run, it can't be imported by another process, define it in a module")
+
+            if not step['outputs']:
+                problems.append(f"step {index} {step['name']} has no output")
+
+            for path in step['inputs']:
+                if path not in written and any(later > index for later in _outputs.get(path, [])):
+                    problems.append(f"input {path} of step {index} {step['name']} is only written by steps after it")
+
+            if any(dependency >= index for dependency in step['dependencies']):
+                problems.append(f"step {index} {step['name']} depends on steps after it {step['dependencies']}")
+
+            if step['stdout'] is not None and step['stdout'] not in step['outputs']:
+                problems.append(f"stdout {step['stdout']} of step {index} {step['name']} is not in its outputs")
+
+            written.update(step['outputs'])
+
+        if check_inputs:
+            problems.extend(f"input {path} of the plan does not exist" for path in self.inputs if not op.exists(path))
+
+        if problems:
+            raise ValueError(f"{len(problems)} problems in plan of {self.workflow} for sub-{self.subject} ses-{self.session}:\n" + '\n'.join(problems))
+
+    def to_dict(self) -> dict:
+        return {
+            'rootdir': self.rootdir,
+            'subject': self.subject,
+            'session': self.session,
+            'workflow': self.workflow,
+            'steps': self.steps,
+        }
+
+    @classmethod
+    def from_dict(cls, dic: dict):
+        return cls(dic['rootdir'], dic['subject'], dic['session'], dic['workflow'], dic['steps'])
+
+
+def save_plan(plan: Plan, path: str):
+    '''
+    write a plan to a compact json file, it is gzipped if path ends with .gz
+    the file is written to a temporary file first, so a job never reads a half written plan
+    '''
+    data = json.dumps(plan.to_dict(), separators = (',', ':')).encode()
+    if path.endswith('.gz'):
+        data = gzip.compress(data)
+
+    temporary = f"{path}.tmp{os.getpid()}"
+    with open(temporary, 'wb') as f:
+        f.write(data)
+    os.replace(temporary, path)
+
+
+def load_plan(path: str) -> Plan:
+
+    with open(path, 'rb') as f:
+        data = f.read()
+    if path.endswith('.gz'):
+        data = gzip.decompress(data)
+
+    return Plan.from_dict(json.loads(data))
+
+
+def run_plan(plan: Plan, logger: str = None, overwrite: bool = False, skip_exist: bool = False, check_inputs: bool = True):
+    '''
+    run steps of a plan one by one in order, without building components, works and workflows
+    only actions taking run_metadata need base.py(and networkx), a RunMetaData is created for them
+
+    overwrite, skip_exist
+        the same as RunMetaData, for outputs of each step, they can't both be True
+    check_inputs
+        validate the plan and test whether its inputs exist before running any step
+    '''
+    if skip_exist and overwrite:
+        raise ValueError("skip_exist and overwrite can't both be True")
+
+    _logger = logging.getLogger(logger)
+
+    if isinstance(plan, str):
+        plan = load_plan(plan)
+
+    plan.validate(check_inputs = check_inputs)
+    _logger.info(f"run plan of {plan.workflow} for sub-{plan.subject} ses-{plan.session} with {len(plan)} steps")
+
+    run_metadata = None
+
+    for index, step in enumerate(plan.steps):
+
+        _existed = [path for path in step['outputs'] if op.exists(path)]
+
+        if skip_exist and len(_existed) == len(step['outputs']) and not set(step['outputs']).issubset(step['inputs']):
+            _logger.warning(f"skip step {index} {step['name']} because all outputs exist")
+            continue
+
+        for path in _existed:
+            if path not in step['inputs'] and (overwrite or skip_exist):
+                _logger.warning(f"remove pre-exist file {path} of step {index} {step['name']}")
+                remove_output(path)
+
+        for directory in {op.dirname(path) for path in step['outputs']}:
+            os.makedirs(directory, exist_ok = True)
+
+        _logger.info(f"run step {index} {step['name']}, work_heap is {step['work_heap']}")
+
+        try:
+            if step['argv'] is not None:
+                _run_command_step(step, _logger)
+
+            else:
+                action = _import_action(step['action'])
+                if step['pass_run_metadata']:
+                    if run_metadata is None:
+                        from .base import RunMetaData
+                        run_metadata = RunMetaData(plan.rootdir, plan.subject, plan.session, logger = logger)
+                    action(step['inputs'], step['outputs'], run_metadata)
+                else:
+                    action(step['inputs'], step['outputs'])
+
+        except Exception as e:
+            if not step['exception_tolerance']:
+                raise
+            _logger.error(f"error when running step {index} {step['name']} with error {e}, but exception_tolerance is True, so continue running \n {traceback.format_exc()}")
+
+    _logger.info(f"finish running plan of {plan.workflow}")
+
+
+def _import_action(reference: str):
+    '''
+    import an action from 'module:qualname'
+    '''
+    module_name, _, qualname = reference.partition(':')
+    action = importlib.import_module(module_name)
+    for attribute in qualname.split('.'):
+        action = getattr(action, attribute)
+    return action
+
+
+def _run_command_step(step: dict, logger):
+    '''
+    run the command of a step, it is run again at most retries times if it fails or times out, as CommandWork
+    '''
+    retries = step.get('retries') or 0
+
+    for attempt in range(retries + 1):
+        try:
+            _run_command_attempt(step, logger)
+            return
+        except Exception as e:
+            retry_or_raise(e, attempt, retries, step['retry_backoff'], lambda: _remove_outputs(step), time.sleep, f"step {step['name']}", logger)
+
+
+def _remove_outputs(step: dict):
+    '''
+    remove outputs of a step which are not its inputs, as Work._remove_failed_outputs
+    '''
+    for path in step['outputs']:
+        if path not in step['inputs'] and op.lexists(path):
+            remove_output(path)
+
+
+def _run_command_attempt(step: dict, logger):
+
+    command = shlex.join(step['argv'])
+    env = None if step['env'] is None else {**os.environ, **step['env']}
+    timeout = step.get('timeout')
+    logger.info(f"start running command {command} of step {step['name']}")
+
+    stdout_file = None if step['stdout'] is None else open(step['stdout'], 'w')
+    try:
+        #a new session, so the command and processes it starts are killed together
+        process = subprocess.Popen(step['argv'], stdout = stdout_file or subprocess.PIPE, stderr = subprocess.PIPE, text = True, env = env, start_new_session = True)
+        try:
+            stdout, stderr = process.communicate(timeout = timeout)
+        except subprocess.TimeoutExpired:
+            kill_process_group(process)
+            process.communicate()
+            raise TimeoutError(f"command {command} of step {step['name']} is killed after running {timeout} s")
+        except BaseException:
+            kill_process_group(process)
+            process.wait()
+            raise
+    finally:
+        if stdout_file is not None:
+            stdout_file.close()
+
+    for line in (stdout or '').splitlines():
+        logger.debug(line)
+    for line in stderr.splitlines():
+        logger.debug(line) #tools like afni use stderr print normal information
+
+    if process.returncode != 0:
+        raise Exception(
+            f"""
+            Error executing command: {command}
+            Return code: {process.returncode}
+            Error output: {stderr}
+            """
+        )
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description = 'run a plan written by save_plan, e.g. one job of a cluster array')
+    parser.add_argument('plan_file', type = str, help = 'path of the plan, .json or .json.gz')
+    exist = parser.add_mutually_exclusive_group()
+    exist.add_argument('--overwrite', action = 'store_true', help = 'remove outputs existing before each step')
+    exist.add_argument('--skip-exist', action = 'store_true', help = 'skip steps whose outputs all exist')
+    parser.add_argument('--log-level', type = str, default = 'INFO', help = 'level of the log printed to stderr')
+    args = parser.parse_args()
+
+    logging.basicConfig(level = args.log_level, format = '%(asctime)s %(levelname)s %(message)s')
+    run_plan(args.plan_file, overwrite = args.overwrite, skip_exist = args.skip_exist)
@@ -0,0 +1,115 @@
+'''
+preview.py is a module to generate the pseudo dataset of a workflow for many subjects at once, files of compiled plans are created in bulk instead of running every work with RunMetaData.preview
+
+plan_cohort: compile plans of a workflow for every pair of subjects and sessions, nothing is read or written on the disk
+preview_paths: all files of plans, raw inputs and outputs of every step
+preview_tree: nested dict of paths, a pseudo dataset in memory
+write_preview: create directories and placeholder(empty or sparse) files of paths
+'''
+import os
+import os.path as op
+from itertools import product
+from concurrent.futures import ThreadPoolExecutor
+
+from .base import RunMetaData
+
+
+def plan_cohort(workflow, rootdir: str, subjects: list, sessions: list = None, **kwargs) -> list:
+    '''
+    compile the workflow for every pair of subjects and sessions with Workflow.plan, directories of subjects and sessions don't need to exist
+
+    kwargs
+        other parameters of RunMetaData, e.g. name_type
+    '''
+    if sessions is None:
+        sessions = [None]
+
+    return [workflow.plan(RunMetaData(rootdir, subject, session, **kwargs)) for subject, session in product(subjects, sessions)]
+
+
+def preview_paths(plans: list, inputs: bool = True) -> list:
+    '''
+    paths of all files of plans without duplicates, in order of plans and steps
+
+    inputs
+        include inputs of plans, i.e. raw files which should be in the dataset before running
+    '''
+    paths = {} #dict keeps the order
+    for plan in plans:
+        if inputs:
+            paths.update((path, None) for path in plan.inputs)
+        for step in plan.steps:
+            paths.update((path, None) for path in step['outputs'])
+    return list(paths)
+
+
+def preview_tree(paths: list, rootdir: str = None) -> dict:
+    '''
+    nested dict of paths, a directory is a dict of its entries and a file is None
+    paths are made relative to rootdir if it is given
+    '''
+    tree = {}
+    for path in paths:
+        if rootdir is not None:
+            path = op.relpath(path, rootdir)
+        *directories, name = [part for part in path.split(os.sep) if part]
+        node = tree
+        for directory in directories:
+            node = node.setdefault(directory, {})
+        node.setdefault(name, None)
+    return tree
+
+
+def write_preview(paths: list, size: int = 0, overwrite: bool = False, max_workers: int = None) -> dict:
+    '''
+    create directories and placeholder files of paths, each directory is created once and each file is created with one open
+
+    Parameters
+    ----------
+    size : int
+        size of each file in bytes, files are sparse so they take no space on file systems supporting it, 0 means empty files
+    overwrite : bool
+        truncate files which exist, otherwise they are kept untouched
+    max_workers : int
+        number of threads creating files of different directories at the same time, None means one thread, which is usually enough on a local disk but slow on a network file system
+
+    Returns
+    -------
+    dict
+        numbers of 'directories'(of files, their parents are not counted) and 'files' created, and 'existed' files kept
+    '''
+    directories = {}
+    for path in paths:
+        directories.setdefault(op.dirname(path), []).append(path)
+
+    def _write_directory(directory):
+        counts = {'directories': 0, 'files': 0, 'existed': 0}
+        if not op.isdir(directory):
+            os.makedirs(directory, exist_ok = True)
+            counts['directories'] += 1
+
+        for path in directories[directory]:
+            try:
+                fd = os.open(path, os.O_WRONLY | os.O_CREAT | (os.O_TRUNC if overwrite else os.O_EXCL), 0o644)
+            except FileExistsError:
+                counts['existed'] += 1
+                continue
+            try:
+                if size:
+                    os.ftruncate(fd, size)
+            finally:
+                os.close(fd)
+            counts['files'] += 1
+        return counts
+
+    if max_workers is None or max_workers <= 1:
+        results = map(_write_directory, directories)
+    else:
+        with ThreadPoolExecutor(max_workers = max_workers) as executor:
+            results = list(executor.map(_write_directory, directories))
+
+    total = {'directories': 0, 'files': 0, 'existed': 0}
+    for counts in results:
+        for key, value in counts.items():
+            total[key] += value
+    return total
@@ -0,0 +1,416 @@
+'''
+profiling.py is a module to record how long each work runs and what resources it uses, records are appended to RunMetaData.trace_file as json lines
+
+WorkProfiler: record a run of a work or workflow
+wait_process: wait a subprocess.Popen with os.wait4, so that its exact resource usage is given to the running work's WorkProfiler
+summarize_trace: aggregate trace files of one or many runs, e.g. all subjects of a batch, to find the slowest works
+write_chrome_trace: convert records to a Chrome Trace Event Format file, which can be viewed in Perfetto or chrome://tracing
+critical_path: find the longest chain of works of a run in work_directed_graph, which bounds how fast the run can be
+
+python -m neuroworkflow.profiling trace.jsonl [trace.jsonl ...] print the summary of trace files
+    --chrome out.json write them as a chrome trace
+    --workflow module:attribute --subject s print the critical path of the subject's run
+'''
+import os
+import json
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+from .logs import current_work
+
+try:
+    import resource
+except ImportError: #not available on windows
+    resource = None
+
+
+current_profiler = contextvars.ContextVar('current_profiler', default = None)
+_write_lock = threading.Lock()
+
+
+def _children_rusage():
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_CHILDREN)
+
+
+class WorkProfiler(object):
+    '''
+    WorkProfiler is a context manager to record a run of a work or workflow to run_metadata.trace_file as a line of json, it does nothing if trace_file is None
+
+    a record has keys
+        kind : 'work' or 'workflow'
+        work : name of the work
+        work_heap : list, see _work_heap of RunMetaData
+        subject, session
+        status : 'success', 'skip', 'cache'(outputs restored from RunMetaData.result_cache) or 'failure'
+        start, end : time.time() when the run starts and ends
+        wall_time : seconds of the whole run
+        pre_run_time, action_time : seconds of _pre_run and the action, None if not reached
+        child_cpu_time : user and system cpu seconds of child processes(commands)
+        child_max_rss : max resident memory(KB) of child processes, None if unknown
+        output_bytes : total size of output files after the run, None for workflows
+        pid, thread : process and thread running the work
+
+    it also sets current_work of logs.py during the run, whether trace_file is given or not, so log records know the work logging them
+
+    resource usage of commands is exact when they are waited by wait_process(CommandWork with stream_output), otherwise it is the change of resource.getrusage(RUSAGE_CHILDREN) during the run, which also counts commands of other works running in other threads of the same process
+    '''
+
+    def __init__(self, work, run_metadata, kind: str = 'work'):
+
+        self.work = work
+        self.run_metadata = run_metadata
+        self.kind = kind
+        self.enabled = run_metadata.trace_file is not None
+        self.status = 'success'
+        self.record = None
+        self._child_rusages = []
+
+    def __enter__(self):
+
+        self._work_token = current_work.set((*self.run_metadata._work_heap, self.work.name))
+
+        if not self.enabled:
+            return self
+
+        self.record = {
+            'kind': self.kind,
+            'work': self.work.name,
+            'work_heap': list(self.run_metadata._work_heap) + [self.work.name],
+            'subject': self.run_metadata.subject,
+            'session': self.run_metadata.session,
+            'status': None,
+            'start': time.time(),
+            'end': None,
+            'wall_time': None,
+            'pre_run_time': None,
+            'action_time': None,
+            'child_cpu_time': None,
+            'child_max_rss': None,
+            'output_bytes': None,
+            'pid': os.getpid(),
+            'thread': threading.current_thread().name,
+        }
+        self._start = time.perf_counter()
+        self._children_start = _children_rusage()
+        self._token = current_profiler.set(self)
+
+        return self
+
+    @contextmanager
+    def phase(self, name):
+        '''
+        record seconds of a phase of the run as {name}_time
+        '''
+        if not self.enabled:
+            yield
+            return
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record[f'{name}_time'] = time.perf_counter() - start
+
+    def add_child_rusage(self, rusage):
+        self._child_rusages.append(rusage)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        current_work.reset(self._work_token)
+
+        if not self.enabled:
+            return False
+
+        current_profiler.reset(self._token)
+
+        self.record['status'] = 'failure' if exc_type is not None else self.status
+        self.record['end'] = time.time()
+        self.record['wall_time'] = time.perf_counter() - self._start
+
+        if self._child_rusages:
+            self.record['child_cpu_time'] = sum(rusage.ru_utime + rusage.ru_stime for rusage in self._child_rusages)
+            self.record['child_max_rss'] = max(rusage.ru_maxrss for rusage in self._child_rusages)
+        elif self._children_start is not None:
+            children_end = _children_rusage()
+            self.record['child_cpu_time'] = (children_end.ru_utime + children_end.ru_stime) - (self._children_start.ru_utime + self._children_start.ru_stime)
+
+        if self.kind == 'work':
+            self.record['output_bytes'] = self._output_bytes()
+
+        line = json.dumps(self.record) + '\n'
+        with _write_lock:
+            with open(self.run_metadata.trace_file, 'a') as f:
+                f.write(line)
+
+        if self.kind == 'workflow' and not self.run_metadata._work_heap and self.run_metadata.chrome_trace is not None:
+            records = [
+                record for record in read_trace(self.run_metadata.trace_file)
+                if record['work_heap'][0] == self.work.name and record['subject'] == self.record['subject'] and record['session'] == self.record['session'] and record['start'] >= self.record['start']
+            ]
+            write_chrome_trace(records, self.run_metadata.chrome_trace)
+
+        return False
+
+    def _output_bytes(self):
+        total = 0
+        for component in self.work.output_components_set:
+            try:
+                total += os.path.getsize(component.use_name())
+            except (OSError, AttributeError, ValueError, TypeError): #not created, or run_metadata is not setted because _pre_run failed
+                pass
+        return total
+
+
+def wait_process(process):
+    '''
+    wait a subprocess.Popen with os.wait4 and give its resource usage to the WorkProfiler of the running work
+    return the return code as Popen.wait
+    '''
+    profiler = current_profiler.get()
+
+    if profiler is None or not profiler.enabled or not hasattr(os, 'wait4'):
+        return process.wait()
+
+    try:
+        _, status, rusage = os.wait4(process.pid, 0)
+    except ChildProcessError: #already waited
+        return process.wait()
+
+    process.returncode = os.waitstatus_to_exitcode(status)
+    profiler.add_child_rusage(rusage)
+
+    return process.returncode
+
+
+def read_trace(trace_files) -> list:
+    '''
+    read records of one or many trace files
+    '''
+    if isinstance(trace_files, (str, os.PathLike)):
+        trace_files = [trace_files]
+
+    records = []
+    for trace_file in trace_files:
+        with open(trace_file, 'r') as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    return records
+
+
+def summarize_trace(trace_files, top: int = None) -> list:
+    '''
+    aggregate records of works in trace files by their work_heap, e.g. the same work of all subjects in a batch
+
+    return a list of dict sorted by total wall time, the slowest first, with keys
+        work : work_heap joined by '/'
+        count, failure, skip, cache : number of runs, failed runs, skipped runs and runs restored from result cache
+        total_wall_time, mean_wall_time, max_wall_time : seconds of runs which are not skipped
+        total_action_time, total_child_cpu_time : seconds
+        max_child_rss : KB
+        total_output_bytes
+    '''
+    summary = {}
+
+    for record in read_trace(trace_files):
+
+        if record['kind'] != 'work':
+            continue
+
+        row = summary.setdefault('/'.join(record['work_heap']), {
+            'work': '/'.join(record['work_heap']),
+            'count': 0,
+            'failure': 0,
+            'skip': 0,
+            'cache': 0,
+            'total_wall_time': 0.0,
+            'max_wall_time': 0.0,
+            'total_action_time': 0.0,
+            'total_child_cpu_time': 0.0,
+            'max_child_rss': None,
+            'total_output_bytes': 0,
+        })
+
+        row['count'] += 1
+        if record['status'] in ('failure', 'skip', 'cache'):
+            row[record['status']] += 1
+        if record['status'] == 'skip':
+            continue
+
+        row['total_wall_time'] += record['wall_time']
+        row['max_wall_time'] = max(row['max_wall_time'], record['wall_time'])
+        row['total_action_time'] += record['action_time'] or 0.0
+        row['total_child_cpu_time'] += record['child_cpu_time'] or 0.0
+        if record['child_max_rss'] is not None:
+            row['max_child_rss'] = max(row['max_child_rss'] or 0, record['child_max_rss'])
+        row['total_output_bytes'] += record['output_bytes'] or 0
+
+    for row in summary.values():
+        _runs = row['count'] - row['skip']
+        row['mean_wall_time'] = row['total_wall_time'] / _runs if _runs else 0.0
+
+    rows = sorted(summary.values(), key = lambda row: row['total_wall_time'], reverse = True)
+
+    return rows if top is None else rows[:top]
+
+
+def write_chrome_trace(records, output_file):
+    '''
+    write records(or trace files) in Chrome Trace Event Format
+
+    each run of a work or workflow is a span, a process track is a subject and session, a thread track is a worker(process and thread) running works
+    spans of works run by the same worker as their workflow are nested under it, skipped and failed runs are colored and marked with an instant event
+    '''
+    if isinstance(records, (str, os.PathLike)) or (records and not isinstance(records[0], dict)):
+        records = read_trace(records)
+
+    events = []
+    _pids = {}
+    _tids = {}
+
+    for record in sorted(records, key = lambda record: (record['start'], -record['wall_time'])):
+
+        subject = (record['subject'], record['session'])
+        if subject not in _pids:
+            _pids[subject] = len(_pids) + 1
+            name = f"sub-{record['subject']}" if record['session'] is None else f"sub-{record['subject']} ses-{record['session']}"
+            events.append({'name': 'process_name', 'ph': 'M', 'pid': _pids[subject], 'args': {'name': name}})
+        pid = _pids[subject]
+
+        worker = (pid, record['pid'], record['thread'])
+        if worker not in _tids:
+            _tids[worker] = len(_tids) + 1
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': _tids[worker], 'args': {'name': f"pid {record['pid']} {record['thread']}"}})
+        tid = _tids[worker]
+
+        span = {
+            'name': record['work'],
+            'cat': record['kind'],
+            'ph': 'X',
+            'ts': record['start'] * 1e6,
+            'dur': record['wall_time'] * 1e6,
+            'pid': pid,
+            'tid': tid,
+            'args': {key: record[key] for key in ('work_heap', 'status', 'pre_run_time', 'action_time', 'child_cpu_time', 'child_max_rss', 'output_bytes')},
+        }
+
+        if record['status'] != 'success':
+            span['cname'] = {'skip': 'grey', 'cache': 'good'}.get(record['status'], 'terrible')
+            events.append({'name': f"{record['status']} {record['work']}", 'ph': 'i', 's': 't', 'ts': record['end'] * 1e6, 'pid': pid, 'tid': tid})
+
+        events.append(span)
+
+    with open(output_file, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+def critical_path(workflow, records, subject = None, session = None) -> dict:
+    '''
+    find the longest chain of works of a run of workflow in its work_directed_graph, weighted by wall time of the works in records(or trace files)
+    only records of the subject and session are used, the last run of a work is used if it is run several times
+    works sharing a name have the same work_heap, the last records of the work_heap are given to them in order of work_list
+
+    return a dict with keys
+        path : names of works on the critical path in order
+        length : seconds of the critical path, the run can't be faster than this however many workers are used
+        wall_time : seconds of the last run of the workflow, None if it is not recorded
+        total_time : sum of wall time of all works, total_time / length is the max useful parallelism
+    '''
+    if isinstance(records, (str, os.PathLike)) or (records and not isinstance(records[0], dict)):
+        records = read_trace(records)
+
+    records = sorted(
+        (record for record in records if record['subject'] == subject and record['session'] == session and record['work_heap'][0] == workflow.name),
+        key = lambda record: record['start']
+    )
+
+    wall_time = None
+    wall_times = {} #work_heap -> wall times in order of start
+    for record in records:
+        if len(record['work_heap']) == 1:
+            wall_time = record['wall_time']
+        elif len(record['work_heap']) == 2:
+            wall_times.setdefault(tuple(record['work_heap']), []).append(record['wall_time'])
+
+    counts = {}
+    for work in workflow.work_list:
+        counts[work.name] = counts.get(work.name, 0) + 1
+    for work_heap in wall_times:
+        wall_times[work_heap] = wall_times[work_heap][-counts.get(work_heap[1], 1):]
+
+    durations = {} #work -> wall time
+    for work in workflow.work_list:
+        runs = wall_times.get((workflow.name, work.name))
+        durations[work] = runs.pop(0) if runs else 0.0
+
+    from .base import _topological_sort
+
+    predecessors = workflow._work_predecessors() #work_directed_graph in plain dicts, networkx is not needed
+    finish = {}
+    previous = {}
+
+    for work in _topological_sort(predecessors):
+        start = 0.0
+        for predecessor in predecessors[work]:
+            if finish[predecessor] > start:
+                start, previous[work] = finish[predecessor], predecessor
+        finish[work] = start + durations.get(work, 0.0)
+
+    if not finish:
+        return {'path': [], 'length': 0.0, 'wall_time': wall_time, 'total_time': 0.0}
+
+    work = max(finish, key = finish.get)
+    path = [work]
+    while path[-1] in previous:
+        path.append(previous[path[-1]])
+
+    return {
+        'path': [work.name for work in reversed(path)],
+        'length': finish[work],
+        'wall_time': wall_time,
+        'total_time': sum(durations.get(work, 0.0) for work in predecessors),
+    }
+
+
+def format_summary(rows) -> str:
+    '''
+    format rows of summarize_trace as a text table
+    '''
+    header = f"{'work':<50} {'count':>6} {'fail':>5} {'skip':>5} {'cache':>5} {'total(s)':>10} {'mean(s)':>9} {'max(s)':>9} {'cpu(s)':>9} {'rss(MB)':>8} {'output(MB)':>11}"
+    lines = [header, '-' * len(header)]
+
+    for row in rows:
+        rss = '' if row['max_child_rss'] is None else f"{row['max_child_rss'] / 1024:.0f}"
+        lines.append(f"{row['work'][-50:]:<50} {row['count']:>6} {row['failure']:>5} {row['skip']:>5} {row['cache']:>5} {row['total_wall_time']:>10.1f} {row['mean_wall_time']:>9.2f} {row['max_wall_time']:>9.2f} {row['total_child_cpu_time']:>9.1f} {rss:>8} {row['total_output_bytes'] / (1024 * 1024):>11.1f}")
+
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description = 'print the slowest works of trace files written with RunMetaData(trace_file = ...)')
+    parser.add_argument('trace_files', nargs = '+', type = str, help = 'trace files')
+    parser.add_argument('--top', '-n', type = int, default = 20, help = 'number of works to print')
+    parser.add_argument('--chrome', '-c', type = str, help = 'write trace files to this file in Chrome Trace Event Format')
+    parser.add_argument('--workflow', '-w', type = str, help = "print the critical path of this workflow, given as 'module:attribute'")
+    parser.add_argument('--subject', '-s', type = str, help = 'subject of the critical path')
+    parser.add_argument('--session', '-e', type = str, help = 'session of the critical path')
+    args = parser.parse_args()
+
+    print(format_summary(summarize_trace(args.trace_files, args.top)))
+
+    if args.chrome is not None:
+        write_chrome_trace(args.trace_files, args.chrome)
+        print(f"write chrome trace to {args.chrome}")
+
+    if args.workflow is not None:
+        import importlib
+        module_name, _, attribute = args.workflow.partition(':')
+        workflow = getattr(importlib.import_module(module_name), attribute)
+
+        result = critical_path(workflow, args.trace_files, args.subject, args.session)
+        print(f"critical path {' -> '.join(result['path'])}")
+        print(f"length {result['length']:.1f} s, wall time {result['wall_time']} s, total time of works {result['total_time']:.1f} s")
@@ -0,0 +1,48 @@
+'''
+retry.py is a module to run commands again when they fail or time out, shared by CommandWork and run_plan, it doesn't import base.py so that plan.py can use it
+
+retry_or_raise: called when an attempt of a command raised, raise if it was the last attempt, otherwise remove partial outputs and wait before the next attempt
+remove_output: remove an output file, link or directory
+kill_process_group: kill a command started in a new session and processes started by it
+'''
+import os
+import os.path as op
+import shutil
+import signal
+
+
+def retry_or_raise(error: Exception, attempt: int, retries: int, retry_backoff: float, remove_outputs, sleep, name: str, logger):
+    '''
+    handle the failure of attempt(starting from 0) of a command run at most retries + 1 times
+
+    the error is raised again if attempt is the last one, otherwise remove_outputs() removes outputs written by the failed attempt with remove_output, tools like afni refuse to overwrite them
+    then sleep(retry_backoff * 2 ** attempt) is returned, it is time.sleep in a thread and asyncio.sleep in an event loop, whose result is awaited by the caller
+    '''
+    if attempt >= retries:
+        raise error
+
+    delay = retry_backoff * 2 ** attempt
+    logger.warning(f"attempt {attempt + 1} of {retries + 1} of {name} failed with error {error}, retry in {delay} s")
+    remove_outputs()
+
+    return sleep(delay)
+
+
+def remove_output(path: str):
+    '''
+    remove a file or a symbolic link, or a directory with its content, e.g. the output directory of a tool
+    '''
+    if op.isdir(path) and not op.islink(path):
+        shutil.rmtree(path)
+    else:
+        os.remove(path)
+
+
+def kill_process_group(process):
+    '''
+    kill a command started in a new session and processes started by it, e.g. sleep of 'sh -c "sleep 10"' which keeps the pipes open
+    '''
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (AttributeError, ProcessLookupError, PermissionError):
+        process.kill()
@@ -0,0 +1,183 @@
+'''
+sidecars.py is a module to read json sidecars of a dataset once, so actions needing metadata such as SliceTiming look it up instead of parsing a file in every work
+
+SidecarIndex: index of all json sidecars under a root directory, parsed in parallel and keyed by path and by BIDS entities
+get_sidecar: metadata of the sidecar of an image, from a shared index if one covers it
+'''
+import os
+import os.path as op
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+DATATYPES = ('func', 'anat', 'fmap', 'dwi', 'perf', 'beh', 'eeg', 'meg', 'ieeg', 'pet')
+IMAGE_EXTENSIONS = ('.nii.gz', '.nii', '.json')
+
+_shared = {} #rootdir -> SidecarIndex, see SidecarIndex.shared
+_file_cache = {} #path -> ((mtime_ns, size), metadata) of sidecars not covered by a shared index
+_lock = threading.Lock()
+
+
+def parse_entities(path: str) -> dict:
+    '''
+    BIDS entities of a file name as a dict, with 'suffix', and 'datatype' if the parent directory is one of DATATYPES
+    e.g. sub-01/ses-1/func/sub-01_ses-1_task-rest_echo-2_bold.json -> {'sub': '01', 'ses': '1', 'task': 'rest', 'echo': '2', 'suffix': 'bold', 'datatype': 'func'}
+    '''
+    directory, name = op.split(path)
+    for extension in IMAGE_EXTENSIONS:
+        if name.endswith(extension):
+            name = name[:-len(extension)]
+            break
+
+    *entities, suffix = name.split('_')
+    dic = dict(entity.split('-', 1) for entity in entities if '-' in entity)
+    dic['suffix'] = suffix
+
+    if op.basename(directory) in DATATYPES:
+        dic['datatype'] = op.basename(directory)
+    return dic
+
+
+def sidecar_path(path: str) -> str:
+    '''
+    path of the json sidecar of an image
+    '''
+    for extension in IMAGE_EXTENSIONS:
+        if path.endswith(extension):
+            return path[:-len(extension)] + '.json'
+    return path + '.json'
+
+
+def _read_json(path):
+    with open(path, 'rb') as f:
+        return json.loads(f.read())
+
+
+class SidecarIndex(object):
+    '''
+    SidecarIndex is a class to store metadata of all json sidecars under rootdir, read with one walk of the tree and parsed by a thread pool
+
+    Parameters
+    ----------
+    rootdir : str
+        root directory of the dataset
+    max_workers : int
+        number of threads parsing sidecars, None means the default of concurrent.futures
+    cache_file : str
+        json file to keep the index between runs, only sidecars whose mtime or size changed are parsed again, None means no cache file
+
+    Methods
+    -------
+    scan : None
+        walk rootdir and parse new or changed sidecars, sidecars removed are dropped, called by __init__
+    get : str -> dict
+        metadata of the sidecar of an image(or the sidecar itself), raise KeyError if it is not in the index
+    find : kwargs -> list
+        (path, metadata) of sidecars whose entities match kwargs, e.g. find(sub = '01', task = 'rest', suffix = 'bold')
+    for_component : Component -> dict
+        metadata of the sidecar of a component when running
+    shared : str -> SidecarIndex
+        the index of rootdir shared in this process, created at the first call
+    '''
+
+    def __init__(self, rootdir: str, max_workers: int = None, cache_file: str = None):
+
+        self.rootdir = op.abspath(rootdir)
+        self.max_workers = max_workers
+        self.cache_file = cache_file
+        self._sidecars = {} #path -> ((mtime_ns, size), metadata)
+        self._by_entities = {} #frozenset of entity items -> list of paths
+
+        if cache_file is not None and op.exists(cache_file):
+            with open(cache_file, 'r') as f:
+                self._sidecars = {path: (tuple(signature), metadata) for path, (signature, metadata) in json.load(f).items()}
+
+        self.scan()
+
+    @classmethod
+    def shared(cls, rootdir: str, **kwargs):
+        rootdir = op.abspath(rootdir)
+        with _lock:
+            if rootdir not in _shared:
+                _shared[rootdir] = cls(rootdir, **kwargs)
+            return _shared[rootdir]
+
+    def __len__(self):
+        return len(self._sidecars)
+
+    def __contains__(self, path):
+        return sidecar_path(op.abspath(path)) in self._sidecars
+
+    def scan(self):
+
+        signatures = {}
+        cache_file = None if self.cache_file is None else op.abspath(self.cache_file)
+        for directory, directories, files in os.walk(self.rootdir):
+            directories[:] = [name for name in directories if not name.startswith('.')] #e.g. .git, .neuroworkflow
+            for name in files:
+                path = op.join(directory, name)
+                if name.endswith('.json') and not name.startswith('.') and path != cache_file:
+                    stat = os.stat(path)
+                    signatures[path] = (stat.st_mtime_ns, stat.st_size)
+
+        changed = [path for path, signature in signatures.items() if path not in self._sidecars or self._sidecars[path][0] != signature]
+
+        with ThreadPoolExecutor(max_workers = self.max_workers) as executor:
+            for path, metadata in zip(changed, executor.map(_read_json, changed)):
+                self._sidecars[path] = (signatures[path], metadata)
+
+        removed = self._sidecars.keys() - signatures.keys()
+        for path in removed:
+            del self._sidecars[path]
+
+        self._by_entities = {}
+        for path in self._sidecars:
+            self._by_entities.setdefault(frozenset(parse_entities(path).items()), []).append(path)
+
+        if self.cache_file is not None and (changed or removed):
+            os.makedirs(op.dirname(op.abspath(self.cache_file)), exist_ok = True)
+            temporary = f"{self.cache_file}.tmp{os.getpid()}"
+            with open(temporary, 'w') as f:
+                json.dump(self._sidecars, f)
+            os.replace(temporary, self.cache_file)
+
+    def get(self, path: str) -> dict:
+        return self._sidecars[sidecar_path(op.abspath(path))][1]
+
+    def find(self, **entities) -> list:
+
+        entities = {key: str(value) for key, value in entities.items() if value is not None}
+
+        #sidecars sharing the same entities are grouped, so this loops over distinct names of runs, not files
+        return [
+            (path, self._sidecars[path][1])
+            for key, paths in self._by_entities.items() if entities.items() <= dict(key).items()
+            for path in paths
+        ]
+
+    def for_component(self, component) -> dict:
+        '''
+        metadata of the sidecar of a component when running, i.e. of component.use_name()
+        '''
+        return self.get(component.use_name())
+
+
+def get_sidecar(path: str) -> dict:
+    '''
+    metadata of the json sidecar of an image(or the sidecar itself)
+    it is looked up in a shared SidecarIndex whose rootdir contains the path, otherwise the file is parsed and kept until its mtime or size changes
+    '''
+    path = sidecar_path(op.abspath(path))
+
+    for rootdir, index in list(_shared.items()):
+        if path.startswith(rootdir + os.sep) and path in index._sidecars:
+            return index._sidecars[path][1]
+
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    cached = _file_cache.get(path)
+    if cached is None or cached[0] != signature:
+        cached = (signature, _read_json(path))
+        _file_cache[path] = cached
+    return cached[1]
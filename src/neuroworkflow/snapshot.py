@@ -0,0 +1,166 @@
+'''
+snapshot.py is a module to answer whether files exist, their size and mtime from memory, so works of a run don't ask the file system (which may be a network file system) for every file
+
+FileSnapshot: in-memory snapshot of the directories used by a run, shared by all works of a Workflow.run
+'''
+import os
+import os.path as op
+import threading
+
+
+_unknown = None #entry of a file which exists but is not stated yet, or is changed by a work
+
+
+class FileSnapshot(object):
+    '''
+    FileSnapshot is a class to store the listing of directories used by a run, each directory is read with one os.scandir when it is first asked
+
+    Parameters
+    ----------
+    mode : str
+        None : no snapshot, ask the file system every time
+        'trust' : answer from the listing read at the first time, files created or removed by works of the run are updated in the snapshot
+        'validate' : as 'trust', but stat a directory before answering and read it again if its mtime changed, stat of a file is always asked to the file system
+
+    Methods
+    -------
+    exists : str -> bool
+        whether a file or directory exists
+    stat : str -> os.stat_result
+        stat of a file, raise FileNotFoundError if it does not exist
+    makedirs : iterable[str] -> list
+        create directories which don't exist, return the created ones
+    invalidate : str -> None
+        tell the snapshot a file may be created or changed, its existence is tested again and it will be stated when asked
+    discard : str -> None
+        tell the snapshot a file is removed
+    '''
+
+    def __init__(self, mode: str = None):
+
+        if mode not in (None, 'trust', 'validate'):
+            raise ValueError(f"unknown mode {mode} of FileSnapshot, should be one of None, 'trust' and 'validate'")
+
+        self.mode = mode
+        self._directories = {} #directory -> (mtime_ns, {name: os.stat_result or _unknown}), (None, None) if the directory does not exist
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _scan(self, directory):
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+            entries = {entry.name: _unknown for entry in os.scandir(directory)}
+        except (FileNotFoundError, NotADirectoryError):
+            return (None, None)
+        return (mtime, entries)
+
+    def _listing(self, directory):
+        '''
+        entries of a directory, None if it does not exist
+        '''
+        with self._lock:
+            listing = self._directories.get(directory)
+
+        if listing is not None and self.mode == 'validate':
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+            except (FileNotFoundError, NotADirectoryError):
+                mtime = None
+            if mtime != listing[0]:
+                listing = None
+
+        if listing is None:
+            listing = self._scan(directory)
+            with self._lock:
+                self._directories[directory] = listing
+
+        return listing[1]
+
+    def exists(self, path) -> bool:
+
+        if self.mode is None:
+            return op.exists(path)
+
+        directory, name = op.split(op.normpath(path))
+        entries = self._listing(directory)
+
+        return entries is not None and name in entries
+
+    def stat(self, path) -> os.stat_result:
+
+        if self.mode != 'trust':
+            return os.stat(path)
+
+        directory, name = op.split(op.normpath(path))
+        entries = self._listing(directory)
+
+        if entries is None or name not in entries:
+            raise FileNotFoundError(f"{path} does not exist in snapshot")
+
+        if entries[name] is _unknown:
+            entries[name] = os.stat(path)
+
+        return entries[name]
+
+    def makedirs(self, directories) -> list:
+
+        created = []
+
+        for directory in sorted(set(op.normpath(directory) for directory in directories)):
+
+            if self.exists(directory):
+                continue
+
+            os.makedirs(directory, exist_ok = True) #another work running at the same time may create it
+            created.append(directory)
+
+            if self.mode is not None:
+                with self._lock:
+                    self._directories[directory] = self._scan(directory)
+
+                #parents of the directory may be created too
+                parent, name = op.split(directory)
+                while name:
+                    self.invalidate(op.join(parent, name))
+                    if parent in self._directories and self._directories[parent][1] is not None:
+                        break
+                    parent, name = op.split(parent)
+
+        return created
+
+    def invalidate(self, path):
+
+        if self.mode is None:
+            return
+
+        directory, name = op.split(op.normpath(path))
+        exists = op.lexists(path) #the file may not be created, e.g. by a failed action
+
+        with self._lock:
+            listing = self._directories.get(directory)
+            if listing is None or listing[1] is None:
+                self._directories.pop(directory, None) #read it again when asked
+            elif exists:
+                listing[1][name] = _unknown
+            else:
+                listing[1].pop(name, None)
+
+    def discard(self, path):
+
+        if self.mode is None:
+            return
+
+        directory, name = op.split(op.normpath(path))
+
+        with self._lock:
+            listing = self._directories.get(directory)
+            if listing is not None and listing[1] is not None:
+                listing[1].pop(name, None)
@@ -0,0 +1,123 @@
+'''
+staging.py is a module to put files into the derivatives tree without rewriting their content when the file system allows, e.g. the copy of raw images many pipelines start with
+
+stage_file: make destination a copy of source with the first strategy which works, return the strategy used
+stage: action staging each input to the output at the same position, hardlinks are allowed
+stage_copy: the same as stage, but never a hardlink, so changing the output in place never changes the input
+
+strategies in order of preference
+    reflink : the new file shares blocks with source until one of them is changed(ioctl FICLONE, btrfs, xfs, ...)
+    hardlink : the new file is the same inode as source, a tool changing the output in place changes source too
+    copy_file_range : the kernel copies the data, which may be offloaded to the storage or a network file system server
+    sendfile : the kernel copies the data without passing it through python
+    copy : userspace copy with shutil
+'''
+import os
+import os.path as op
+import errno
+import shutil
+import logging
+
+try:
+    import fcntl
+except ImportError: #not available on windows
+    fcntl = None
+
+
+STAGE_STRATEGIES = ('reflink', 'hardlink', 'copy_file_range', 'sendfile', 'copy')
+COPY_STRATEGIES = ('reflink', 'copy_file_range', 'sendfile', 'copy')
+
+_logger = logging.getLogger(__name__)
+_FICLONE = 0x40049409 #from linux/fs.h
+_FALLBACK_ERRORS = {errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EINVAL, errno.ENOTTY, errno.ENOSYS, errno.EPERM, errno.EBADF, errno.EMLINK}
+
+
+def _reflink(source, destination):
+    if fcntl is None:
+        raise OSError(errno.ENOSYS, 'reflink is not supported')
+    with open(source, 'rb') as source_file, open(destination, 'wb') as destination_file:
+        fcntl.ioctl(destination_file.fileno(), _FICLONE, source_file.fileno())
+
+
+def _hardlink(source, destination):
+    os.link(source, destination)
+
+
+def _kernel_copy(copy_chunk):
+    def _copy(source, destination):
+        with open(source, 'rb') as source_file, open(destination, 'wb') as destination_file:
+            remaining = os.fstat(source_file.fileno()).st_size
+            while remaining > 0:
+                copied = copy_chunk(source_file.fileno(), destination_file.fileno(), min(remaining, 1 << 30))
+                if copied == 0: #source is shorter than its size, e.g. it is changing
+                    break
+                remaining -= copied
+    return _copy
+
+
+def _copy(source, destination):
+    shutil.copyfile(source, destination)
+
+
+_strategies = {
+    'reflink': _reflink,
+    'hardlink': _hardlink,
+    'copy_file_range': _kernel_copy(lambda source_fd, destination_fd, count: os.copy_file_range(source_fd, destination_fd, count)) if hasattr(os, 'copy_file_range') else None,
+    'sendfile': _kernel_copy(lambda source_fd, destination_fd, count: os.sendfile(destination_fd, source_fd, None, count)) if hasattr(os, 'sendfile') else None,
+    'copy': _copy,
+}
+
+
+def stage_file(source: str, destination: str, strategies: tuple = STAGE_STRATEGIES) -> str:
+    '''
+    make destination a copy of source, trying strategies in order, see the module's __doc__
+    an existing destination is replaced, return the name of the strategy used
+    '''
+    unknown = [strategy for strategy in strategies if strategy not in _strategies]
+    if unknown:
+        raise ValueError(f"unknown strategies {unknown} of stage_file, should be in {STAGE_STRATEGIES}")
+
+    if op.realpath(source) == op.realpath(destination): #a hardlink of source staged before is only replaced
+        raise ValueError(f"source and destination of stage_file are the same file {source}")
+
+    for strategy in strategies:
+
+        if _strategies[strategy] is None: #not available on this platform
+            continue
+
+        if op.lexists(destination):
+            os.remove(destination)
+
+        try:
+            _strategies[strategy](source, destination)
+            return strategy
+        except OSError as e:
+            if e.errno not in _FALLBACK_ERRORS or strategy == strategies[-1]:
+                raise
+
+    raise ValueError(f"no strategy of {strategies} is available to stage {source} to {destination}")
+
+
+def stage(input_files, output_files):
+    '''
+    action staging input_files[i] to output_files[i], see stage_file
+    a hardlink may be used, so the output should not be changed in place by later works, use stage_copy if it is
+    '''
+    _stage(input_files, output_files, STAGE_STRATEGIES)
+
+
+def stage_copy(input_files, output_files):
+    '''
+    action staging input_files[i] to output_files[i] without hardlinks, see stage_file
+    '''
+    _stage(input_files, output_files, COPY_STRATEGIES)
+
+
+def _stage(input_files, output_files, strategies):
+    #actions taking run_metadata get components in set order, so the strategy is logged to the logger of this module instead of the run's logger
+    if len(input_files) != len(output_files):
+        raise ValueError(f"stage needs the same number of inputs and outputs, but get inputs {input_files} and outputs {output_files}")
+
+    for source, destination in zip(input_files, output_files):
+        strategy = stage_file(source, destination, strategies)
+        _logger.info(f"stage {source} to {destination} with {strategy}")
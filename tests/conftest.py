@@ -0,0 +1,41 @@
+'''
+fixtures shared by tests, run them from the root of the repository with python -m pytest tests
+'''
+import os
+import json
+
+import pytest
+
+from src.neuroworkflow import Component
+
+
+SUBJECTS = ('01', '02', '03')
+
+
+@pytest.fixture
+def rootdir(tmp_path):
+    '''
+    a dataset with a raw bold image 'raw' of each subject in SUBJECTS
+    '''
+    for subject in SUBJECTS:
+        os.makedirs(tmp_path / f'sub-{subject}' / 'func')
+        (tmp_path / f'sub-{subject}' / 'func' / f'sub-{subject}_desc-raw_bold.nii').write_text('raw')
+    return str(tmp_path)
+
+
+@pytest.fixture
+def raw():
+    return Component(desc = 'raw', suffix = 'bold', datatype = 'func', extension = 'nii', use_extension = True)
+
+
+def derived(raw, desc):
+    return Component.init_from(raw, desc = desc)
+
+
+def raw_path(rootdir, subject):
+    return os.path.join(rootdir, f'sub-{subject}', 'func', f'sub-{subject}_desc-raw_bold.nii')
+
+
+def read_trace(trace_file, kind = 'work'):
+    with open(trace_file, 'r') as f:
+        return [record for record in map(json.loads, f) if record['kind'] == kind]
@@ -0,0 +1,68 @@
+import os
+import time
+import asyncio
+
+import pytest
+
+from src.neuroworkflow import RunMetaData, CommandWork, Workflow
+
+from conftest import derived
+
+
+#writes its start and end time to the output
+_SLOW_COPY = 'start=$(date +%s.%N); sleep 0.3; cat "$0" > "$1"; echo " $start $(date +%s.%N)" >> "$1"'
+
+
+def _span(component):
+    return tuple(map(float, open(component.use_name()).read().split()[1:]))
+
+
+def _overlap(first, second):
+    return _span(first)[0] < _span(second)[1] and _span(second)[0] < _span(first)[1]
+
+
+def _diamond(raw):
+    a, b, c, d = (derived(raw, desc) for desc in ('a', 'b', 'c', 'd'))
+    workflow = Workflow('wf', [
+        CommandWork('a', [raw], [a], ['cp', raw, a]),
+        CommandWork('b', [a], [b], ['sh', '-c', _SLOW_COPY, a, b]),
+        CommandWork('c', [a], [c], ['sh', '-c', _SLOW_COPY, a, c]),
+        CommandWork('d', [b, c], [d], ['sh', '-c', 'cat "$0" "$1" > "$2"', b, c, d]),
+        ])
+    return workflow, (a, b, c, d)
+
+
+def _arun(workflow, raw, rootdir, semaphore = None, **kwargs):
+    run_metadata = RunMetaData(rootdir, '01', **kwargs)
+    raw.run_metadata = run_metadata
+    asyncio.run(workflow.arun(run_metadata, semaphore))
+
+
+@pytest.mark.parametrize('max_workers, overlap', [(4, True), (1, False)])
+def test_commands_are_awaited_concurrently(rootdir, raw, max_workers, overlap):
+
+    workflow, (a, b, c, d) = _diamond(raw)
+    _arun(workflow, raw, rootdir, max_workers = max_workers)
+
+    assert open(d.use_name()).read().count('raw') == 2
+    assert _overlap(b, c) == overlap
+
+
+def test_failure_cancels_running_commands(rootdir, raw, tmp_path):
+
+    pid_file = str(tmp_path / 'sleep.pid')
+    failed, slow = derived(raw, 'failed'), derived(raw, 'slow')
+    workflow = Workflow('wf', [
+        CommandWork('slow', [raw], [slow], ['sh', '-c', f'echo $$ > {pid_file}; exec sleep 30']),
+        CommandWork('fail', [raw], [failed], ['sh', '-c', 'sleep 0.3; exit 1']),
+        ])
+
+    start = time.time()
+    with pytest.raises(Exception, match = 'Return code: 1'):
+        _arun(workflow, raw, rootdir, max_workers = 2)
+    assert time.time() - start < 10
+
+    with open(pid_file, 'r') as f:
+        pid = int(f.read())
+    with pytest.raises(ProcessLookupError):
+        os.kill(pid, 0)
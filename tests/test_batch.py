@@ -0,0 +1,56 @@
+import os
+import asyncio
+import argparse
+
+from src.neuroworkflow import Work, Workflow, CommandWork, run_batch, arun_batch
+
+from conftest import derived, raw_path
+from main import override_config
+
+
+def copy_unless_bad(input_files, output_files):
+    with open(input_files[0], 'r') as f:
+        content = f.read()
+    if content == 'bad':
+        raise RuntimeError('bad input')
+    with open(output_files[0], 'w') as f:
+        f.write(content)
+
+
+def test_run_batch(rootdir, raw, tmp_path):
+
+    with open(raw_path(rootdir, '02'), 'w') as f:
+        f.write('bad')
+    output = derived(raw, 'out')
+    workflow = Workflow('wf', [Work('copy', [raw], [output], action = copy_unless_bad)])
+    logdir = str(tmp_path / 'logs')
+
+    summary = run_batch(workflow, rootdir, ['01', '02', '04'], max_workers = 2, logdir = logdir)
+
+    assert {key: result['status'] for key, result in summary.items()} == {('01', None): 'success', ('02', None): 'failure', ('04', None): 'skip'}
+    assert 'bad input' in summary[('02', None)]['error']
+    assert 'bad input' in open(summary[('02', None)]['log_file']).read()
+    assert open(os.path.join(rootdir, 'sub-01', 'func', 'sub-01_desc-out_bold.nii')).read() == 'raw'
+    assert not os.path.exists(os.path.join(rootdir, 'sub-02', 'func', 'sub-02_desc-out_bold.nii'))
+
+
+def test_arun_batch(rootdir, raw, tmp_path):
+
+    output = derived(raw, 'out')
+    workflow = Workflow('wf', [CommandWork('copy', [raw], [output], ['cp', raw, output])])
+
+    summary = asyncio.run(arun_batch(workflow, rootdir, ['01', '02', '03'], max_concurrency = 2, logdir = str(tmp_path / 'logs')))
+
+    assert all(result['status'] == 'success' for result in summary.values())
+    for subject in ('01', '02', '03'):
+        assert open(os.path.join(rootdir, f'sub-{subject}', 'func', f'sub-{subject}_desc-out_bold.nii')).read() == 'raw'
+
+
+def test_command_line_overrides_config():
+
+    config = {'jobs': 8, 'logdir': 'logs', 'log_per_work': True, 'resume': True, 'workflow': 'pipeline:workflow'}
+    args = argparse.Namespace(workflow = None, subjectslist = ['01'], sessionslist = None, jobs = 0, logdir = 'other', log_per_work = False, journal = None, resume = False)
+    override_config(config, args)
+
+    #a flag which is not set doesn't turn off the config
+    assert config == {'jobs': 0, 'logdir': 'other', 'log_per_work': True, 'resume': True, 'workflow': 'pipeline:workflow', 'subjectslist': ['01']}
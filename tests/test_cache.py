@@ -0,0 +1,89 @@
+import os
+import glob
+
+from src.neuroworkflow import RunMetaData, Work, Workflow, ResultCache
+
+from conftest import derived, raw_path, read_trace
+
+
+def mark(input_files, output_files):
+    #writes the output in place, as tools rerunning over their own output do
+    with open(input_files[0], 'r') as f:
+        content = f.read()
+    with open(output_files[0], 'w') as f:
+        f.write(f'OUT:{content}')
+
+
+def _run(workflow, raw, rootdir, subject, cache_dir, trace_file, **kwargs):
+    run_metadata = RunMetaData(rootdir, subject, result_cache = cache_dir, trace_file = trace_file, **kwargs)
+    raw.run_metadata = run_metadata
+    workflow.run(run_metadata)
+    return read_trace(trace_file)[-1]['status']
+
+
+def test_put_get_and_evict(tmp_path):
+
+    source = tmp_path / 'source.nii'
+    source.write_bytes(b'x' * 1024 * 1024)
+    cache = ResultCache(str(tmp_path / 'cache'), max_size = 1.5)
+
+    assert cache.put('a' * 64, [str(source)])
+    assert not cache.put('a' * 64, [str(source)]) #already stored
+    assert 'a' * 64 in cache
+    assert not cache.get('b' * 64, [str(tmp_path / 'restored.nii')])
+
+    assert cache.get('a' * 64, [str(tmp_path / 'restored.nii')])
+    assert (tmp_path / 'restored.nii').read_bytes() == source.read_bytes()
+
+    cache.put('c' * 64, [str(source)]) #over max_size, the least recently used entry is evicted
+    assert 'a' * 64 not in cache and 'c' * 64 in cache
+
+
+def test_rerun_after_restore_does_not_change_entry(rootdir, raw, tmp_path):
+
+    cache_dir, trace_file = str(tmp_path / 'cache'), str(tmp_path / 'trace.jsonl')
+    output = derived(raw, 'out')
+    workflow = Workflow('wf', [Work('mark', [raw], [output], action = mark, cache = True)])
+
+    assert _run(workflow, raw, rootdir, '01', cache_dir, trace_file) == 'success'
+    assert _run(workflow, raw, rootdir, '02', cache_dir, trace_file) == 'cache'
+    assert os.access(output.use_name(), os.W_OK) #a copy of its own, not the read only entry
+
+    #input of 02 changes, the work misses the cache and rewrites its restored output
+    with open(raw_path(rootdir, '02'), 'w') as f:
+        f.write('changed')
+    assert _run(workflow, raw, rootdir, '02', cache_dir, trace_file) == 'success'
+
+    entries = {open(path).read() for path in glob.glob(os.path.join(cache_dir, '*', '*', '0'))}
+    assert entries == {'OUT:raw', 'OUT:changed'}
+
+    assert _run(workflow, raw, rootdir, '03', cache_dir, trace_file) == 'cache'
+    assert open(output.use_name()).read() == 'OUT:raw'
+
+
+def test_restored_output_is_newer_than_inputs(rootdir, raw, tmp_path):
+
+    cache_dir, trace_file = str(tmp_path / 'cache'), str(tmp_path / 'trace.jsonl')
+    output = derived(raw, 'out')
+    workflow = Workflow('wf', [Work('mark', [raw], [output], action = mark, cache = True)])
+
+    _run(workflow, raw, rootdir, '01', cache_dir, trace_file)
+    os.utime(raw_path(rootdir, '02')) #after the entry is stored
+    assert _run(workflow, raw, rootdir, '02', cache_dir, trace_file) == 'cache'
+
+    restored = os.stat(output.use_name())
+    (entry,) = glob.glob(os.path.join(cache_dir, '*', '*', '0'))
+    assert restored.st_ino != os.stat(entry).st_ino
+    assert restored.st_mtime_ns >= os.stat(raw_path(rootdir, '02')).st_mtime_ns
+
+    #subworkflow prunes works whose outputs are not older than their inputs
+    assert workflow.subworkflow([output], RunMetaData(rootdir, '02')).work_list == []
+
+
+def test_incremental_restores_are_stable(rootdir, raw, tmp_path):
+
+    cache_dir, trace_file = str(tmp_path / 'cache'), str(tmp_path / 'trace.jsonl')
+    workflow = Workflow('wf', [Work('mark', [raw], [derived(raw, 'out')], action = mark, cache = True)])
+
+    statuses = [_run(workflow, raw, rootdir, subject, cache_dir, trace_file, incremental = True) for subject in ('01', '02', '02', '03', '02')]
+    assert statuses == ['success', 'cache', 'skip', 'cache', 'skip']
@@ -0,0 +1,62 @@
+import asyncio
+import logging
+
+import pytest
+
+from src.neuroworkflow import RunMetaData, CommandWork, Workflow
+
+from conftest import derived
+
+
+#prints 200 lines to stdout and each tenth to stderr
+_VERBOSE = 'for i in $(seq 1 200); do echo "line $i"; if [ $((i % 10)) -eq 0 ]; then echo "progress $i" >&2; fi; done'
+
+
+def _run(workflow, raw, rootdir, use_arun = False, **kwargs):
+    run_metadata = RunMetaData(rootdir, '01', **kwargs)
+    raw.run_metadata = run_metadata
+    if use_arun:
+        asyncio.run(workflow.arun(run_metadata))
+    else:
+        workflow.run(run_metadata)
+
+
+@pytest.mark.parametrize('stream_output, use_arun', [(True, False), (False, False), (True, True)])
+def test_stdout_is_saved_and_logged(rootdir, raw, caplog, stream_output, use_arun):
+
+    output = derived(raw, 'stdout')
+    workflow = Workflow('wf', [CommandWork('verbose', [raw], [output], ['sh', '-c', _VERBOSE], save_stdout_to = output, stream_output = stream_output)])
+
+    with caplog.at_level(logging.DEBUG):
+        _run(workflow, raw, rootdir, use_arun)
+
+    assert open(output.use_name()).read().splitlines() == [f'line {i}' for i in range(1, 201)]
+    messages = [record.getMessage() for record in caplog.records]
+    assert 'line 200' in messages and 'progress 200' in messages
+
+
+def test_log_output_rate(rootdir, raw, caplog):
+
+    output = derived(raw, 'stdout')
+    workflow = Workflow('wf', [CommandWork('verbose', [raw], [output], ['sh', '-c', _VERBOSE], save_stdout_to = output)])
+
+    with caplog.at_level(logging.DEBUG):
+        _run(workflow, raw, rootdir, log_output_rate = 20)
+
+    #every line is saved, but only a burst of them is logged
+    assert len(open(output.use_name()).read().splitlines()) == 200
+    assert sum(record.getMessage().startswith(('line', 'progress')) for record in caplog.records) < 100
+    assert any('lines of output are not logged' in record.getMessage() for record in caplog.records)
+
+
+def test_failure_keeps_the_tail_of_stderr(rootdir, raw):
+
+    output = derived(raw, 'out')
+    workflow = Workflow('wf', [CommandWork('broken', [raw], [output], ['sh', '-c', f'{_VERBOSE}; echo fatal >&2; exit 2'], stderr_tail = 3)])
+
+    with pytest.raises(Exception) as error:
+        _run(workflow, raw, rootdir)
+
+    assert 'Return code: 2' in str(error.value)
+    assert 'fatal' in str(error.value) and 'progress 190' in str(error.value)
+    assert 'progress 170' not in str(error.value)
@@ -0,0 +1,128 @@
+import os
+import time
+import asyncio
+import logging
+
+import pytest
+
+from src.neuroworkflow import RunMetaData, CommandWork, Work, Workflow, Plan, run_plan
+
+from conftest import derived
+
+
+def fail(input_files, output_files):
+    raise RuntimeError('failed')
+
+
+def copy(input_files, output_files):
+    with open(input_files[0], 'r') as f:
+        content = f.read()
+    with open(output_files[0], 'w') as f:
+        f.write(content)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    return True
+
+
+def _run(workflow, raw, rootdir, **kwargs):
+    run_metadata = RunMetaData(rootdir, '01', **kwargs)
+    raw.run_metadata = run_metadata
+    workflow.run(run_metadata)
+
+
+#a command failing once, the failed attempt leaves an output directory
+_FLAKY = 'if [ -e "$1.failed" ]; then cp "$0" "$1"; else touch "$1.failed"; mkdir "$1"; exit 1; fi'
+
+
+@pytest.mark.parametrize('use_arun', [False, True])
+def test_timeout_kills_process_group(rootdir, raw, tmp_path, use_arun):
+
+    pid_file = str(tmp_path / 'sleep.pid')
+    output = derived(raw, 'out')
+    #the shell starts sleep in the background, it keeps the pipes open and is killed with the shell
+    workflow = Workflow('wf', [CommandWork('hang', [raw], [output], ['sh', '-c', f'sleep 30 & echo $! > {pid_file}; wait'], timeout = 0.5)])
+
+    start = time.time()
+    with pytest.raises(TimeoutError):
+        if use_arun:
+            run_metadata = RunMetaData(rootdir, '01')
+            raw.run_metadata = run_metadata
+            asyncio.run(workflow.arun(run_metadata))
+        else:
+            _run(workflow, raw, rootdir)
+    assert time.time() - start < 10
+
+    with open(pid_file, 'r') as f:
+        pid = int(f.read())
+    for _ in range(50): #reaped by init after the shell is killed
+        if not _alive(pid):
+            break
+        time.sleep(0.1)
+    assert not _alive(pid)
+
+
+@pytest.mark.parametrize('use_arun', [False, True])
+def test_retry_removes_output_directory(rootdir, raw, use_arun):
+
+    output = derived(raw, 'out')
+    workflow = Workflow('wf', [CommandWork('flaky', [raw], [output], ['sh', '-c', _FLAKY, raw, output], retries = 1, retry_backoff = 0)])
+
+    run_metadata = RunMetaData(rootdir, '01')
+    raw.run_metadata = run_metadata
+    if use_arun:
+        asyncio.run(workflow.arun(run_metadata))
+    else:
+        workflow.run(run_metadata)
+
+    assert open(output.use_name()).read() == 'raw'
+
+
+def test_retries_are_exhausted(rootdir, raw, caplog):
+
+    output = derived(raw, 'out')
+    workflow = Workflow('wf', [CommandWork('broken', [raw], [output], ['sh', '-c', 'exit 3'], retries = 2, retry_backoff = 0)])
+
+    with caplog.at_level(logging.WARNING), pytest.raises(Exception, match = 'Return code: 3'):
+        _run(workflow, raw, rootdir)
+    assert sum('retry in' in record.message for record in caplog.records) == 2
+
+
+def test_plan_retry_removes_output_directory(rootdir, raw):
+
+    output = derived(raw, 'out')
+    workflow = Workflow('wf', [CommandWork('flaky', [raw], [output], ['sh', '-c', _FLAKY, raw, output], retries = 1, retry_backoff = 0)])
+    run_metadata = RunMetaData(rootdir, '01')
+    raw.run_metadata = run_metadata
+
+    plan = workflow.plan(run_metadata)
+    assert (plan.steps[0]['retries'], plan.steps[0]['retry_backoff']) == (1, 0)
+
+    run_plan(Plan.from_dict(plan.to_dict()))
+    assert open(output.use_name()).read() == 'raw'
+
+
+@pytest.mark.parametrize('scheduler', ['serial', 'thread', 'arun'])
+def test_on_failure_continue_runs_independent_works(rootdir, raw, scheduler):
+
+    failed, after_failed, independent = derived(raw, 'failed'), derived(raw, 'afterfailed'), derived(raw, 'independent')
+    workflow = Workflow('wf', [
+        Work('fail', [raw], [failed], action = fail),
+        Work('after_fail', [failed], [after_failed], action = copy),
+        Work('independent', [raw], [independent], action = copy),
+        ])
+
+    run_metadata = RunMetaData(rootdir, '01', scheduler = 'serial' if scheduler == 'arun' else scheduler, on_failure = 'continue')
+    raw.run_metadata = run_metadata
+    with pytest.raises(RuntimeError, match = 'failed'): #the first error is raised when the independent works finish
+        if scheduler == 'arun':
+            asyncio.run(workflow.arun(run_metadata))
+        else:
+            workflow.run(run_metadata)
+
+    assert os.path.exists(independent.use_name())
+    assert not any('afterfailed' in name for name in os.listdir(os.path.dirname(independent.use_name()))) #after_fail was skipped, its output is never named
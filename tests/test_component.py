@@ -0,0 +1,86 @@
+import os
+from copy import deepcopy
+import pickle
+
+import pytest
+
+from src.neuroworkflow import Component, ComponentIdentity, RunMetaData, Work, Workflow
+
+from conftest import raw_path
+
+
+class Interned(Component):
+    intern = True
+
+
+def copy(input_files, output_files):
+    with open(input_files[0], 'r') as f:
+        content = f.read()
+    with open(output_files[0], 'w') as f:
+        f.write(content)
+
+
+def test_identity_is_the_value_of_a_component():
+
+    first = Component(desc = 'a', suffix = 'bold', datatype = 'func', echo = 1, data_place = ['place'])
+    second = Component(desc = 'a', suffix = 'bold', datatype = 'func', echo = '1', data_place = ('place',))
+    assert first is not second and first != second #identity of objects unless interned
+    assert first.identity == second.identity and hash(first.identity) == hash(second.identity)
+    assert first.identity != Component.init_from(first, desc = 'b').identity
+    assert first.identity != Interned(desc = 'a', suffix = 'bold', datatype = 'func', echo = 1, data_place = ['place']).identity
+    assert isinstance(first.identity, ComponentIdentity)
+
+
+def test_equal_components_are_interned():
+
+    raw = Interned(desc = 'raw', suffix = 'bold', datatype = 'func', extension = 'nii', use_extension = True)
+    derived = Interned.init_from(raw, desc = 'derived')
+    assert Interned.init_from(raw, desc = 'derived') is derived
+    assert Interned(desc = 'raw', suffix = 'bold', datatype = 'func', extension = 'nii', use_extension = True) is raw
+    assert len({raw, derived, Interned.init_from(raw, desc = 'raw')}) == 2
+
+    #outputs of separately built works are the same component
+    workflow = Workflow('wf', [
+        Work('first', [raw], [Interned.init_from(raw, desc = 'derived')], action = copy),
+        Work('second', [Interned.init_from(raw, desc = 'derived')], [Interned.init_from(raw, desc = 'other')], action = copy),
+        ])
+    assert workflow._work_predecessors()[workflow.work_list[1]] == {workflow.work_list[0]: {derived}}
+
+
+def test_interned_entities_are_frozen():
+
+    component = Interned(desc = 'frozen', suffix = 'bold', extension = 'nii', use_extension = True)
+    with pytest.raises(ValueError, match = "can't set desc"):
+        component.desc = 'changed'
+    with pytest.raises(ValueError, match = 'use_extension'):
+        Interned(desc = 'frozen', suffix = 'bold', extension = 'nii')
+    component.desc = 'frozen' #same value is fine
+
+
+def test_copies_are_not_interned():
+
+    component = Interned(desc = 'copied', suffix = 'bold')
+    for duplicate in (deepcopy(component), pickle.loads(pickle.dumps(component))):
+        assert duplicate is not component
+        assert duplicate.identity == component.identity
+        assert duplicate.simplified_bids_name() == component.simplified_bids_name()
+
+
+def test_names_are_cached_until_an_attribute_is_set(rootdir, monkeypatch):
+
+    component = Component(desc = 'raw', suffix = 'bold', datatype = 'func', extension = 'nii', use_extension = True, run_metadata = RunMetaData(rootdir, '01'))
+    assert component.use_name() == raw_path(rootdir, '01')
+
+    rendered = []
+    run_bids_name = Component.run_bids_name
+    monkeypatch.setattr(Component, 'run_bids_name', lambda self, *args: rendered.append(self) or run_bids_name(self, *args))
+    assert component.use_name() == raw_path(rootdir, '01')
+    assert component.name_for_run(full_path = False) == 'sub-01_desc-raw_bold.nii'
+    assert len(rendered) == 1 #only the name without path is new
+
+    component.desc = 'changed'
+    assert component.name_for_run(full_path = False) == 'sub-01_desc-changed_bold.nii'
+    component.run_metadata = RunMetaData(rootdir, '02')
+    assert component.name_for_run(full_path = False) == 'sub-02_desc-changed_bold.nii'
+    assert component.use_name() == os.path.join(rootdir, 'sub-02', 'func', 'sub-02_desc-changed_bold.nii')
+    assert len(rendered) == 4
@@ -0,0 +1,75 @@
+import os
+import time
+import pickle
+
+import pytest
+
+from src.neuroworkflow import DigestMemo, digest_files
+from src.neuroworkflow import digest
+
+
+def _old_file(path, content):
+    #files changed in the last 2 seconds are not remembered
+    path.write_bytes(content)
+    past = time.time() - 60
+    os.utime(path, (past, past))
+    return str(path)
+
+
+def _not_read(path):
+    raise AssertionError(f'{path} is read again')
+
+
+def test_file_digest_in_chunks(tmp_path, monkeypatch):
+
+    content = os.urandom(1000)
+    path = _old_file(tmp_path / 'image.nii', content)
+    whole = digest.file_digest(path)
+    assert whole.startswith(f'{digest.HASH_NAME}:')
+
+    monkeypatch.setattr(digest, 'CHUNK_SIZE', 7)
+    assert digest.file_digest(path) == whole
+    assert digest.file_digest(_old_file(tmp_path / 'empty.nii', b'')) != whole
+
+
+def test_memo_hashes_a_file_once(tmp_path, monkeypatch):
+
+    path = _old_file(tmp_path / 'image.nii', b'first')
+    memo = DigestMemo()
+    first = memo.digest(path)
+
+    monkeypatch.setattr(digest, 'file_digest', _not_read)
+    assert memo.digest(path) == first
+
+    #the same size, a new mtime
+    monkeypatch.undo()
+    (tmp_path / 'image.nii').write_bytes(b'other')
+    os.utime(path, (time.time() - 30, time.time() - 30))
+    assert memo.get(path) is None
+    assert memo.digest(path) != first
+
+
+def test_recently_changed_file_is_not_remembered(tmp_path):
+
+    path = tmp_path / 'image.nii'
+    path.write_bytes(b'fresh')
+    memo = DigestMemo()
+    memo.digest(str(path))
+    assert memo.get(str(path)) is None
+
+
+def test_sqlite_memo_is_shared_by_runs(tmp_path, monkeypatch):
+
+    paths = [_old_file(tmp_path / f'image{index}.nii', f'image {index}'.encode()) for index in range(4)]
+    memo_file = str(tmp_path / 'memo' / 'digests.sqlite')
+    digests = digest_files(paths, DigestMemo(memo_file), max_workers = 2)
+    assert digests == [digest.file_digest(path) for path in paths]
+    assert len(set(digests)) == 4
+
+    monkeypatch.setattr(digest, 'file_digest', _not_read)
+    assert digest_files(paths, DigestMemo(memo_file)) == digests
+    #a memo sent to a worker process opens the same file
+    assert digest_files(paths, pickle.loads(pickle.dumps(DigestMemo(memo_file)))) == digests
+
+    with pytest.raises(FileNotFoundError):
+        digest_files([str(tmp_path / 'missing.nii')], DigestMemo(memo_file))
@@ -0,0 +1,92 @@
+import logging
+
+import pytest
+
+from src.neuroworkflow import Work, Workflow
+
+from conftest import derived
+
+
+def copy(input_files, output_files):
+    with open(input_files[0], 'r') as f:
+        content = f.read()
+    for path in output_files:
+        with open(path, 'w') as f:
+            f.write(content)
+
+
+def test_edges_carry_components(raw):
+
+    a, b, c = derived(raw, 'a'), derived(raw, 'b'), derived(raw, 'c')
+    first, second, third = Work('first', [raw], [a, b], action = copy), Work('second', [a], [c], action = copy), Work('third', [a, b, c], [derived(raw, 'd')], action = copy)
+    predecessors = Workflow('wf', [first, second, third])._work_predecessors()
+
+    assert predecessors == {first: {}, second: {first: {a}}, third: {first: {a, b}, second: {c}}}
+
+
+def test_work_directed_graph(raw):
+
+    pytest.importorskip('networkx')
+    a, b = derived(raw, 'a'), derived(raw, 'b')
+    first, second = Work('first', [raw], [a, b], action = copy), Work('second', [a, b], [derived(raw, 'c')], action = copy)
+    workflow = Workflow('wf', [first, second])
+    graph = workflow.work_directed_graph
+
+    assert set(graph.nodes) == {first, second}
+    assert graph[first][second]['components'] == {a, b}
+    assert workflow.work_directed_graph is graph
+
+
+def test_predecessors_are_cached_until_add_work(raw):
+
+    a, b = derived(raw, 'a'), derived(raw, 'b')
+    first, second = Work('first', [raw], [a], action = copy), Work('second', [a], [b], action = copy)
+    workflow = Workflow('wf', [first])
+    predecessors = workflow._work_predecessors()
+    assert workflow._work_predecessors() is predecessors
+
+    workflow.add_work(second)
+    predecessors = workflow._work_predecessors()
+    assert predecessors[second] == {first: {a}}
+    assert workflow._work_predecessors() is predecessors
+
+
+def test_last_of_producers_in_a_chain_is_kept(raw, caplog):
+
+    a, b = derived(raw, 'a'), derived(raw, 'b')
+    first = Work('first', [raw], [a], action = copy)
+    again = Work('again', [a], [a, b], action = copy) #rewrites a after reading it
+    reader = Work('reader', [a], [derived(raw, 'c')], action = copy)
+
+    with caplog.at_level(logging.WARNING):
+        predecessors = Workflow('wf', [first, again, reader])._work_predecessors()
+    assert predecessors[again] == {first: {a}}
+    assert predecessors[reader] == {again: {a}}
+    assert 'only keep the last one again' in caplog.text
+
+
+def test_producers_in_different_branches_conflict(raw):
+
+    a = derived(raw, 'a')
+    first, other = Work('first', [raw], [a], action = copy), Work('other', [raw], [a], action = copy)
+    reader = Work('reader', [a], [derived(raw, 'c')], action = copy)
+
+    with pytest.raises(ValueError, match = 'not in the same branch'):
+        Workflow('wf', [first, other, reader])._work_predecessors()
+
+
+def test_input_produced_later_is_rejected(raw):
+
+    a = derived(raw, 'a')
+    with pytest.raises(ValueError, match = 'only generated by works after it'):
+        Workflow('wf', [Work('reader', [a], [derived(raw, 'c')], action = copy), Work('first', [raw], [a], action = copy)])._work_predecessors()
+
+
+def test_many_works_in_a_chain(raw):
+
+    components = [raw] + [derived(raw, f'step{index}') for index in range(500)]
+    works = [Work(f'step{index}', [components[index]], [components[index + 1]], action = copy) for index in range(500)]
+    predecessors = Workflow('wf', works)._work_predecessors()
+
+    assert predecessors[works[0]] == {}
+    assert all(predecessors[second] == {first: {component}} for first, second, component in zip(works, works[1:], components[1:]))
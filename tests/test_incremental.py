@@ -0,0 +1,89 @@
+import os
+import time
+
+import pytest
+
+from src.neuroworkflow import RunMetaData, Work, Workflow
+
+from conftest import derived, raw_path, read_trace
+
+
+def copy(input_files, output_files):
+    with open(input_files[0], 'r') as f:
+        content = f.read()
+    with open(output_files[0], 'w') as f:
+        f.write(content)
+
+
+def copy_upper(input_files, output_files):
+    with open(input_files[0], 'r') as f:
+        content = f.read()
+    with open(output_files[0], 'w') as f:
+        f.write(content.upper())
+
+
+def _touch(path):
+    later = time.time() + 10
+    os.utime(path, (later, later))
+
+
+@pytest.fixture
+def pipeline(raw):
+    first, second = derived(raw, 'first'), derived(raw, 'second')
+    workflow = Workflow('wf', [Work('first', [raw], [first], action = copy), Work('second', [first], [second], action = copy)])
+    return workflow, second
+
+
+def _statuses(workflow, raw, rootdir, trace_file, **kwargs):
+    run_metadata = RunMetaData(rootdir, '01', incremental = True, trace_file = trace_file, **kwargs)
+    raw.run_metadata = run_metadata
+    workflow.run(run_metadata)
+    return [record['status'] for record in read_trace(trace_file)[-len(workflow.work_list):]]
+
+
+def test_unchanged_works_are_skipped(rootdir, raw, tmp_path, pipeline):
+
+    workflow, second = pipeline
+    trace_file = str(tmp_path / 'trace.jsonl')
+    assert _statuses(workflow, raw, rootdir, trace_file) == ['success', 'success']
+    assert _statuses(workflow, raw, rootdir, trace_file) == ['skip', 'skip']
+
+    #a changed input reruns the work and works reading its outputs
+    with open(raw_path(rootdir, '01'), 'w') as f:
+        f.write('new')
+    assert _statuses(workflow, raw, rootdir, trace_file) == ['success', 'success']
+    assert open(second.use_name()).read() == 'new'
+
+    #a changed action reruns its work, works before it are skipped
+    workflow.work_list[1].action = copy_upper
+    assert _statuses(workflow, raw, rootdir, trace_file) == ['skip', 'success']
+    assert open(second.use_name()).read() == 'NEW'
+
+
+def test_changed_output_is_rebuilt(rootdir, raw, tmp_path, pipeline):
+
+    workflow, second = pipeline
+    trace_file = str(tmp_path / 'trace.jsonl')
+    _statuses(workflow, raw, rootdir, trace_file)
+
+    with open(second.use_name(), 'w') as f:
+        f.write('edited by hand')
+    assert _statuses(workflow, raw, rootdir, trace_file) == ['skip', 'success']
+    assert open(second.use_name()).read() == 'raw'
+
+
+@pytest.mark.parametrize('hash_inputs, statuses', [(False, ['success', 'success']), (True, ['skip', 'skip'])])
+def test_touched_input_with_hash_inputs(rootdir, raw, tmp_path, pipeline, hash_inputs, statuses):
+
+    workflow, _ = pipeline
+    trace_file = str(tmp_path / 'trace.jsonl')
+    _statuses(workflow, raw, rootdir, trace_file, hash_inputs = hash_inputs)
+
+    _touch(raw_path(rootdir, '01'))
+    assert _statuses(workflow, raw, rootdir, trace_file, hash_inputs = hash_inputs) == statuses
+
+
+def test_incremental_is_exclusive(rootdir):
+
+    with pytest.raises(ValueError):
+        RunMetaData(rootdir, '01', incremental = True, skip_exist = True)
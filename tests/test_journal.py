@@ -0,0 +1,135 @@
+import os
+
+import pytest
+
+from src.neuroworkflow import RunMetaData, Work, Workflow
+from src.neuroworkflow.journal import RunJournal
+
+from conftest import derived
+
+
+CALLS = []
+
+
+def copy(input_files, output_files):
+    CALLS.append(output_files[0])
+    with open(input_files[0], 'r') as f:
+        content = f.read()
+    with open(output_files[0], 'w') as f:
+        f.write(content)
+
+
+def copy_upper(input_files, output_files):
+    CALLS.append(output_files[0])
+    with open(input_files[0], 'r') as f:
+        content = f.read()
+    with open(output_files[0], 'w') as f:
+        f.write(content.upper())
+
+
+def copy_partial_then_fail(input_files, output_files):
+    CALLS.append(output_files[0])
+    with open(output_files[0], 'w') as f:
+        f.write('partial')
+    raise RuntimeError('killed')
+
+
+def copy_fresh(input_files, output_files):
+    #a partial output of the last run would be here if it was not removed
+    assert not os.path.exists(output_files[0])
+    copy(input_files, output_files)
+
+
+@pytest.fixture(autouse = True)
+def clear_calls():
+    CALLS.clear()
+
+
+def _run(workflow, raw, rootdir, journal, **kwargs):
+    run_metadata = RunMetaData(rootdir, '01', journal = journal, **kwargs)
+    raw.run_metadata = run_metadata
+    workflow.run(run_metadata)
+
+
+def _called(*components):
+    return [os.path.basename(path) for path in CALLS] == [os.path.basename(component.use_name()) for component in components]
+
+
+def test_torn_line_is_ignored(tmp_path):
+
+    path = str(tmp_path / 'journal.jsonl')
+    journal = RunJournal(path)
+    journal.record(str(tmp_path), '01', None, ('wf', 'a'), 'finish', 'identity')
+    with open(path, 'a') as f:
+        f.write('{"rootdir": "') #a crash when writing
+
+    journal.record(str(tmp_path), '01', None, ('wf', 'b'), 'start')
+    states = RunJournal(path).states(str(tmp_path), '01')
+    assert states == {('wf', 'a'): ('finish', 'identity'), ('wf', 'b'): ('start', None)}
+
+    with pytest.raises(ValueError):
+        journal.record(str(tmp_path), '01', None, ('wf', 'b'), 'done')
+
+
+def test_resume_reruns_unfinished_work(rootdir, raw, tmp_path):
+
+    journal = str(tmp_path / 'journal.jsonl')
+    first, second = derived(raw, 'first'), derived(raw, 'second')
+    failing = Work('second', [first], [second], action = copy_partial_then_fail)
+    workflow = Workflow('wf', [Work('first', [raw], [first], action = copy), failing])
+
+    with pytest.raises(RuntimeError):
+        _run(workflow, raw, rootdir, journal)
+    assert open(second.use_name()).read() == 'partial'
+
+    CALLS.clear()
+    failing.action = copy_fresh
+    _run(workflow, raw, rootdir, journal, resume = True)
+    assert _called(second)
+    assert open(second.use_name()).read() == 'raw'
+
+    CALLS.clear()
+    _run(workflow, raw, rootdir, journal, resume = True)
+    assert CALLS == []
+
+
+def test_resume_skips_finished_subworkflow(rootdir, raw, tmp_path):
+
+    journal = str(tmp_path / 'journal.jsonl')
+    first, second, third = derived(raw, 'first'), derived(raw, 'second'), derived(raw, 'third')
+    failing = Work('third', [raw], [third], action = copy_partial_then_fail)
+    inner = Workflow('inner', [Work('first', [raw], [first], action = copy), Work('second', [first], [second], action = copy)])
+    workflow = Workflow('wf', [inner, failing])
+
+    with pytest.raises(RuntimeError):
+        _run(workflow, raw, rootdir, journal)
+
+    CALLS.clear()
+    failing.action = copy_fresh
+    _run(workflow, raw, rootdir, journal, resume = True)
+    assert _called(third)
+
+
+def test_resume_reruns_work_of_other_rootdir_or_action(rootdir, raw, tmp_path):
+
+    journal = str(tmp_path / 'journal.jsonl')
+    first, second = derived(raw, 'first'), derived(raw, 'second')
+    upper = Work('second', [first], [second], action = copy)
+    workflow = Workflow('wf', [Work('first', [raw], [first], action = copy), upper])
+    _run(workflow, raw, rootdir, journal)
+
+    #another cohort sharing the journal
+    other = str(tmp_path / 'other')
+    os.makedirs(os.path.join(other, 'sub-01', 'func'))
+    with open(os.path.join(other, 'sub-01', 'func', 'sub-01_desc-raw_bold.nii'), 'w') as f:
+        f.write('other')
+    CALLS.clear()
+    _run(workflow, raw, other, journal, resume = True)
+    assert _called(first, second)
+
+    #the action of second changed since it finished, first is still skipped
+    CALLS.clear()
+    upper.action = copy_upper
+    _run(workflow, raw, rootdir, journal, resume = True, overwrite = True)
+    assert _called(second)
+    assert open(second.use_name()).read() == 'RAW'
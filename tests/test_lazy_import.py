@@ -0,0 +1,39 @@
+import os
+import sys
+import subprocess
+
+
+#runs a workflow with the graph layer unavailable, importing networkx or matplotlib fails
+_SCRIPT = '''
+import sys
+sys.modules['networkx'] = sys.modules['matplotlib'] = None
+from src.neuroworkflow import Component, RunMetaData, Work, Workflow
+
+def copy(input_files, output_files):
+    with open(input_files[0]) as f, open(output_files[0], 'w') as g:
+        g.write(f.read())
+
+raw = Component(desc = 'raw', suffix = 'bold', datatype = 'func', extension = 'nii', use_extension = True)
+first, second = Component.init_from(raw, desc = 'first'), Component.init_from(raw, desc = 'second')
+workflow = Workflow('wf', [Work('first', [raw], [first], action = copy), Work('second', [first], [second], action = copy)])
+for scheduler in ('serial', 'thread'):
+    run_metadata = RunMetaData(sys.argv[1], '01', scheduler = scheduler, overwrite = True)
+    raw.run_metadata = run_metadata
+    workflow.run(run_metadata)
+print(open(second.use_name()).read())
+'''
+
+
+def test_workflows_run_without_the_graph_layer(rootdir):
+
+    result = subprocess.run([sys.executable, '-c', _SCRIPT, rootdir], capture_output = True, text = True, cwd = os.path.dirname(os.path.dirname(__file__)))
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == 'raw'
+
+
+def test_package_import_does_not_load_networkx():
+
+    script = "import sys; import src.neuroworkflow; print(sorted(name for name in ('networkx', 'matplotlib') if name in sys.modules))"
+    result = subprocess.run([sys.executable, '-c', script], capture_output = True, text = True, cwd = os.path.dirname(os.path.dirname(__file__)))
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == '[]'
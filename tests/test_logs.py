@@ -0,0 +1,106 @@
+import os
+import glob
+import logging
+
+import pytest
+
+from src.neuroworkflow import RunMetaData, Work, Workflow, start_logging, stop_logging, OutputLimiter
+
+from conftest import derived
+
+
+def copy_and_log(input_files, output_files, run_metadata):
+    logging.getLogger(run_metadata.logger).warning(f'copy in {os.getpid()}')
+    with open(input_files[0], 'r') as f:
+        content = f.read()
+    with open(output_files[0], 'w') as f:
+        f.write(content)
+
+
+class _ListHandler(logging.Handler):
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+@pytest.fixture
+def parent():
+    logger = logging.getLogger('test_logs')
+    handler = _ListHandler()
+    logger.addHandler(handler)
+    yield handler
+    logger.removeHandler(handler)
+
+
+def test_warnings_are_forwarded_to_parent(tmp_path, parent):
+
+    log_file = str(tmp_path / 'run.log')
+    listener = start_logging('test_logs.run', log_file)
+    logger = logging.getLogger('test_logs.run')
+    logger.info('info of the run')
+    logger.error('error of the run')
+    stop_logging('test_logs.run', listener)
+
+    content = open(log_file).read()
+    assert 'info of the run' in content and 'error of the run' in content
+    assert [record.getMessage() for record in parent.records] == ['error of the run']
+    assert logger.propagate
+
+
+def test_log_per_work(rootdir, raw, tmp_path):
+
+    listener = start_logging('test_logs.work', str(tmp_path / 'run.log'), str(tmp_path / 'works'))
+    first, second = derived(raw, 'first'), derived(raw, 'second')
+    workflow = Workflow('wf', [Work('first', [raw], [first], action = copy_and_log), Work('second', [first], [second], action = copy_and_log)])
+    run_metadata = RunMetaData(rootdir, '01', logger = 'test_logs.work')
+    raw.run_metadata = run_metadata
+    try:
+        workflow.run(run_metadata)
+    finally:
+        stop_logging('test_logs.work', listener)
+
+    assert sorted(os.listdir(tmp_path / 'works')) == ['wf.first.log', 'wf.log', 'wf.second.log']
+    assert 'copy in' in open(tmp_path / 'works' / 'wf.first.log').read()
+
+
+def test_forked_workers_write_their_own_file(rootdir, raw, tmp_path, parent):
+
+    log_file = str(tmp_path / 'run.log')
+    listener = start_logging('test_logs.process', log_file)
+    outputs = [derived(raw, f'out{index}') for index in range(4)]
+    workflow = Workflow('wf', [Work(f'copy{index}', [raw], [output], action = copy_and_log) for index, output in enumerate(outputs)])
+    run_metadata = RunMetaData(rootdir, '01', logger = 'test_logs.process', scheduler = 'process', max_workers = 2)
+    raw.run_metadata = run_metadata
+    try:
+        workflow.run(run_metadata)
+    finally:
+        stop_logging('test_logs.process', listener)
+
+    assert 'copy in' not in open(log_file).read() #records of workers are only in their files
+    worker_files = glob.glob(str(tmp_path / 'run.*.log'))
+    assert worker_files and all(str(os.getpid()) not in path for path in worker_files)
+    worker_records = ''.join(open(path).read() for path in worker_files)
+    assert worker_records.count('copy in') == 4
+
+    #warnings of workers go to the parent logger of the worker, not of this process
+    assert all('copy in' not in record.getMessage() for record in parent.records)
+
+
+def test_output_limiter(caplog):
+
+    logger = logging.getLogger('test_logs.limiter')
+    with caplog.at_level(logging.DEBUG, 'test_logs.limiter'):
+        limiter = OutputLimiter(logger, rate = 10)
+        for index in range(100):
+            limiter(f'line {index}\n')
+        limiter.close()
+
+    messages = [record.getMessage() for record in caplog.records]
+    assert messages[0] == 'line 0'
+    assert len(messages) <= 12
+    assert messages[-1].endswith('lines of output are not logged, they are over 10 lines per second')
+    assert limiter.suppressed == 100 - (len(messages) - 1)
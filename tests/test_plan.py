@@ -0,0 +1,71 @@
+import os
+
+import pytest
+
+from src.neuroworkflow import RunMetaData, Work, Workflow, CommandWork, save_plan, load_plan, run_plan
+
+from conftest import derived
+
+
+def copy(input_files, output_files):
+    with open(input_files[0], 'r') as f:
+        content = f.read()
+    with open(output_files[0], 'w') as f:
+        f.write(content)
+
+
+def _plan(raw, rootdir):
+    first, second = derived(raw, 'first'), derived(raw, 'second')
+    workflow = Workflow('wf', [
+        Work('first', [raw], [first], action = copy),
+        CommandWork('second', [first], [second], ['cp', first, second]),
+        ])
+    run_metadata = RunMetaData(rootdir, '01')
+    return workflow.plan(run_metadata), second
+
+
+def test_plan_resolves_paths_and_dependencies(rootdir, raw, tmp_path):
+
+    plan, second = _plan(raw, rootdir)
+    assert [step['dependencies'] for step in plan.steps] == [[], [0]]
+    assert plan.steps[0]['action'] == 'test_plan:copy'
+    assert plan.steps[1]['argv'] == ['cp', plan.steps[0]['outputs'][0], second.use_name()]
+    assert plan.inputs == [raw.use_name()]
+    assert not os.path.exists(second.use_name()) #nothing is run
+
+    save_plan(plan, str(tmp_path / 'plan.json.gz'))
+    loaded = load_plan(str(tmp_path / 'plan.json.gz'))
+    assert loaded.steps == plan.steps
+
+    run_plan(loaded)
+    assert open(second.use_name()).read() == 'raw'
+
+
+def test_validate_rejects_actions_which_cannot_be_imported(rootdir, raw):
+
+    plan, _ = _plan(raw, rootdir)
+    plan.validate(check_inputs = True)
+
+    plan.steps[0]['action'] = '__main__:copy'
+    with pytest.raises(ValueError, match = 'defined in the script'):
+        plan.validate()
+
+    plan.steps[0]['action'] = 'test_plan:_plan.<locals>.copy'
+    with pytest.raises(ValueError, match = 'lambda or a local function'):
+        plan.validate()
+
+
+def test_run_plan_skip_exist(rootdir, raw):
+
+    plan, second = _plan(raw, rootdir)
+    with pytest.raises(ValueError, match = "can't both be True"):
+        run_plan(plan, overwrite = True, skip_exist = True)
+
+    run_plan(plan)
+    with open(second.use_name(), 'w') as f:
+        f.write('kept')
+    run_plan(plan, skip_exist = True)
+    assert open(second.use_name()).read() == 'kept'
+
+    run_plan(plan, overwrite = True)
+    assert open(second.use_name()).read() == 'raw'
@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+from src.neuroworkflow import Work, Workflow, plan_cohort, preview_paths, preview_tree, write_preview
+
+from conftest import derived
+
+
+def copy(input_files, output_files):
+    with open(input_files[0], 'r') as f:
+        content = f.read()
+    with open(output_files[0], 'w') as f:
+        f.write(content)
+
+
+@pytest.fixture
+def plans(raw, tmp_path):
+    first, second = derived(raw, 'first'), derived(raw, 'second')
+    workflow = Workflow('wf', [Work('first', [raw], [first], action = copy), Work('second', [first], [second], action = copy)])
+    #directories of subjects don't need to exist
+    os.makedirs(tmp_path / 'dataset')
+    return plan_cohort(workflow, str(tmp_path / 'dataset'), ['01', '02'], ['1', '2'])
+
+
+def test_preview_tree(plans, tmp_path):
+
+    assert len(plans) == 4
+    paths = preview_paths(plans)
+    assert len(paths) == 12 #a raw input and two outputs of each run
+    assert len(preview_paths(plans, inputs = False)) == 8
+
+    tree = preview_tree(paths, str(tmp_path / 'dataset'))
+    assert sorted(tree) == ['sub-01', 'sub-02']
+    assert sorted(tree['sub-01']) == ['ses1', 'ses2']
+    assert sorted(tree['sub-01']['ses1']['func']) == sorted(os.path.basename(path) for path in paths if '/sub-01/ses1/' in path)
+    assert len(tree['sub-01']['ses1']['func']) == 3
+    assert os.listdir(tmp_path / 'dataset') == [] #nothing is written
+
+
+@pytest.mark.parametrize('max_workers', [None, 4])
+def test_write_preview(plans, max_workers):
+
+    paths = preview_paths(plans)
+    assert write_preview(paths, size = 1 << 20, max_workers = max_workers) == {'directories': 4, 'files': 12, 'existed': 0}
+    assert all(os.path.getsize(path) == 1 << 20 for path in paths)
+    assert os.stat(paths[0]).st_blocks * 512 < 1 << 20 #sparse
+
+    with open(paths[0], 'w') as f:
+        f.write('kept')
+    assert write_preview(paths, max_workers = max_workers) == {'directories': 0, 'files': 0, 'existed': 12}
+    assert open(paths[0]).read() == 'kept'
+    assert write_preview(paths, overwrite = True)['files'] == 12
+    assert os.path.getsize(paths[0]) == 0
@@ -0,0 +1,100 @@
+import json
+
+import pytest
+
+from src.neuroworkflow import RunMetaData, Work, Workflow, CommandWork
+from src.neuroworkflow.profiling import critical_path, format_summary, summarize_trace, write_chrome_trace
+
+from conftest import derived, read_trace
+
+
+def copy(input_files, output_files):
+    with open(input_files[0], 'r') as f:
+        content = f.read()
+    with open(output_files[0], 'w') as f:
+        f.write(content)
+
+
+def _record(work_heap, start, wall_time):
+    return {'kind': 'work' if len(work_heap) > 1 else 'workflow', 'subject': '01', 'session': None, 'work_heap': list(work_heap), 'work': work_heap[-1], 'start': start, 'wall_time': wall_time}
+
+
+def test_critical_path_of_works_sharing_a_name(raw):
+
+    first, second, third = derived(raw, 'first'), derived(raw, 'second'), derived(raw, 'third')
+    workflow = Workflow('wf', [
+        Work('same', [raw], [first], action = copy),
+        Work('other', [first], [second], action = copy),
+        Work('same', [raw], [third], action = copy),
+        ])
+
+    records = [
+        _record(('wf',), 0.0, 6.0),
+        _record(('wf', 'same'), 0.0, 1.0),
+        _record(('wf', 'same'), 0.5, 5.0),
+        _record(('wf', 'other'), 1.0, 1.0),
+        ]
+    result = critical_path(workflow, records, '01')
+
+    assert result['path'] == ['same']
+    assert result['length'] == 5.0
+    assert result['total_time'] == 7.0
+    assert result['wall_time'] == 6.0
+
+
+def test_trace_of_a_run(rootdir, raw, tmp_path):
+
+    trace_file = str(tmp_path / 'trace.jsonl')
+    first, second = derived(raw, 'first'), derived(raw, 'second')
+    workflow = Workflow('wf', [Work('first', [raw], [first], action = copy), Work('second', [first], [second], action = copy)])
+    run_metadata = RunMetaData(rootdir, '01', trace_file = trace_file)
+    raw.run_metadata = run_metadata
+    workflow.run(run_metadata)
+
+    assert [record['work_heap'] for record in read_trace(trace_file)] == [['wf', 'first'], ['wf', 'second']]
+    assert all(record['status'] == 'success' and record['output_bytes'] == 3 for record in read_trace(trace_file))
+
+    rows = summarize_trace([trace_file])
+    assert sorted(row['work'] for row in rows) == ['wf/first', 'wf/second']
+
+    assert critical_path(workflow, trace_file, '01')['path'] == ['first', 'second']
+
+    write_chrome_trace(read_trace(trace_file), str(tmp_path / 'chrome.json'))
+    with open(tmp_path / 'chrome.json', 'r') as f:
+        events = json.load(f)['traceEvents']
+    assert {event['name'] for event in events if event.get('ph') == 'X'} >= {'first', 'second'}
+
+
+def fail(input_files, output_files):
+    raise RuntimeError('failed')
+
+
+def test_resources_of_commands_and_failures(rootdir, raw, tmp_path):
+
+    trace_file = str(tmp_path / 'trace.jsonl')
+    busy, broken = derived(raw, 'busy'), derived(raw, 'broken')
+    #a command busy on cpu for a while
+    burn = ['sh', '-c', 'i=0; while [ $i -lt 200000 ]; do i=$((i + 1)); done; cp "$0" "$1"', raw, busy]
+
+    for subject in ('01', '02'):
+        workflow = Workflow('wf', [CommandWork('busy', [raw], [busy], burn), Work('broken', [busy], [broken], action = fail)])
+        run_metadata = RunMetaData(rootdir, subject, trace_file = trace_file)
+        raw.run_metadata = run_metadata
+        with pytest.raises(RuntimeError):
+            workflow.run(run_metadata)
+
+    records = {(record['subject'], record['work']): record for record in read_trace(trace_file)}
+    assert len(records) == 4
+    busy_record = records[('01', 'busy')]
+    assert busy_record['status'] == 'success'
+    assert busy_record['child_cpu_time'] > 0 and busy_record['child_max_rss'] > 0
+    assert 0 < busy_record['pre_run_time'] < busy_record['wall_time'] and 0 < busy_record['action_time'] <= busy_record['wall_time']
+    assert busy_record['output_bytes'] == 3
+    assert records[('01', 'broken')]['status'] == 'failure'
+
+    rows = summarize_trace([trace_file])
+    assert [row['work'] for row in rows] == ['wf/busy', 'wf/broken'] #the slowest first
+    assert rows[0]['count'] == 2 and rows[0]['total_output_bytes'] == 6 and rows[0]['max_child_rss'] > 0
+    assert rows[1]['failure'] == 2
+    assert summarize_trace([trace_file], top = 1) == rows[:1]
+    assert 'wf/busy' in format_summary(rows)
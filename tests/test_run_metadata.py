@@ -0,0 +1,48 @@
+import os
+
+import pytest
+
+from src.neuroworkflow import RunMetaData, Work, Workflow
+
+from conftest import derived
+
+
+def copy(input_files, output_files):
+    with open(input_files[0], 'r') as f:
+        content = f.read()
+    with open(output_files[0], 'w') as f:
+        f.write(content)
+
+
+def test_child_is_a_view_of_its_parent(rootdir):
+
+    parent = RunMetaData(rootdir, '01', overwrite = True)
+    first = parent.child('wf', ['derivatives'], ['place'])
+    second = first.child('work', data_place = ['inner'], scheduler = 'thread')
+
+    assert second._work_heap == ('wf', 'work')
+    assert second._current_derivatives_place == ('derivatives',)
+    assert second._current_data_place == ('place', 'inner')
+    assert second.overwrite and second.scheduler == 'thread'
+    #parents are not changed
+    assert parent._work_heap == () and parent._current_data_place == ()
+    assert first._work_heap == ('wf',) and first.scheduler == 'serial'
+    with pytest.raises(AttributeError):
+        parent.unknown = 1
+
+
+def test_outputs_are_placed_by_nested_works(rootdir, raw):
+
+    inner, outer = derived(raw, 'inner'), derived(raw, 'outer')
+    workflow = Workflow('wf', [
+        Work('first', [raw], [inner], action = copy, derivatives_place = ['derivatives'], data_place = ['first']),
+        Workflow('nested', [Work('second', [inner], [outer], action = copy, data_place = ['second'])], derivatives_place = ['derivatives'], data_place = ['nested']),
+        ], data_place = ['wf'])
+
+    run_metadata = RunMetaData(rootdir, '01')
+    raw.run_metadata = run_metadata
+    workflow.run(run_metadata)
+
+    assert os.path.isfile(os.path.join(rootdir, 'derivatives', 'sub-01', 'func', 'wf', 'first', 'sub-01_desc-inner_bold.nii'))
+    assert os.path.isfile(os.path.join(rootdir, 'derivatives', 'sub-01', 'func', 'wf', 'nested', 'second', 'sub-01_desc-outer_bold.nii'))
+    assert run_metadata._work_heap == () and run_metadata._current_data_place == ()
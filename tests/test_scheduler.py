@@ -0,0 +1,118 @@
+import os
+import time
+
+import pytest
+
+from src.neuroworkflow import RunMetaData, Work, Workflow, CommandWork
+
+from conftest import derived
+
+
+def concat(input_files, output_files):
+    content = ''
+    for path in input_files:
+        with open(path, 'r') as f:
+            content += f.read()
+    with open(output_files[0], 'w') as f:
+        f.write(content)
+
+
+def slow_concat(input_files, output_files):
+    #records when it runs next to its output, so tests can tell which works overlapped
+    start = time.time()
+    time.sleep(0.3)
+    concat(input_files, output_files)
+    with open(f'{output_files[0]}.span', 'w') as f:
+        f.write(f'{start} {time.time()}')
+
+
+def fail(input_files, output_files):
+    raise RuntimeError('failed')
+
+
+def _span(component):
+    with open(f'{component.use_name()}.span', 'r') as f:
+        return tuple(map(float, f.read().split()))
+
+
+def _overlap(first, second):
+    return _span(first)[0] < _span(second)[1] and _span(second)[0] < _span(first)[1]
+
+
+def _diamond(raw, action = slow_concat):
+    a, b, c, d = (derived(raw, desc) for desc in ('a', 'b', 'c', 'd'))
+    workflow = Workflow('wf', [
+        Work('a', [raw], [a], action = concat),
+        Work('b', [a], [b], action = action),
+        Work('c', [a], [c], action = slow_concat),
+        Work('d', [b, c], [d], action = concat),
+        ])
+    return workflow, (a, b, c, d)
+
+
+def _run(workflow, raw, rootdir, **kwargs):
+    run_metadata = RunMetaData(rootdir, '01', **kwargs)
+    raw.run_metadata = run_metadata
+    workflow.run(run_metadata)
+
+
+@pytest.mark.parametrize('scheduler', ['thread', 'process'])
+def test_independent_works_run_at_the_same_time(rootdir, raw, scheduler):
+
+    workflow, (a, b, c, d) = _diamond(raw)
+    _run(workflow, raw, rootdir, scheduler = scheduler, max_workers = 4, max_cpus = 4)
+
+    assert open(d.use_name()).read() == 'rawraw'
+    assert _overlap(b, c)
+
+
+def test_serial_runs_works_one_by_one(rootdir, raw):
+
+    workflow, (a, b, c, d) = _diamond(raw)
+    _run(workflow, raw, rootdir)
+
+    assert open(d.use_name()).read() == 'rawraw'
+    assert not _overlap(b, c)
+
+
+@pytest.mark.parametrize('scheduler', ['thread', 'process'])
+def test_failure_stops_submitting_works(rootdir, raw, scheduler):
+
+    workflow, (a, b, c, d) = _diamond(raw, action = fail)
+    with pytest.raises(RuntimeError, match = 'failed'):
+        _run(workflow, raw, rootdir, scheduler = scheduler, max_workers = 4, max_cpus = 4)
+
+    assert os.path.exists(os.path.join(rootdir, 'sub-01', 'func', 'sub-01_desc-c_bold.nii')) #running works are waited
+    assert not os.path.exists(os.path.join(rootdir, 'sub-01', 'func', 'sub-01_desc-d_bold.nii'))
+
+
+@pytest.mark.parametrize('cpus, memory, overlap', [(2, None, False), (1, 600, False), (1, 400, True)])
+def test_works_are_packed_on_resources(rootdir, raw, cpus, memory, overlap):
+
+    workflow, (a, b, c, d) = _diamond(raw)
+    for work in workflow.work_list:
+        work.cpus, work.memory = cpus, memory
+    _run(workflow, raw, rootdir, scheduler = 'thread', max_workers = 4, max_cpus = 2, max_memory = 1000)
+
+    assert open(d.use_name()).read() == 'rawraw'
+    assert _overlap(b, c) == overlap
+
+
+def test_work_larger_than_machine_runs_alone(rootdir, raw, caplog):
+
+    workflow, (a, b, c, d) = _diamond(raw)
+    workflow.work_list[1].cpus = 8
+    _run(workflow, raw, rootdir, scheduler = 'thread', max_workers = 4, max_cpus = 2)
+
+    assert not _overlap(b, c)
+    assert any('run it alone' in record.message for record in caplog.records)
+    assert Workflow('outer', [workflow]).resources == (8, 0)
+
+
+def test_cpus_of_a_command_limit_its_threads(rootdir, raw):
+
+    output = derived(raw, 'threads')
+    workflow = Workflow('wf', [CommandWork('threads', [raw], [output], ['sh', '-c', 'echo $OMP_NUM_THREADS $MKL_NUM_THREADS'], save_stdout_to = output, cpus = 3, env = {'MKL_NUM_THREADS': '1'})])
+    _run(workflow, raw, rootdir)
+
+    assert open(output.use_name()).read().split() == ['3', '1']
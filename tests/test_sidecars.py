@@ -0,0 +1,79 @@
+import os
+import json
+
+import pytest
+
+from src.neuroworkflow import SidecarIndex, get_sidecar
+from src.neuroworkflow import sidecars
+from src.neuroworkflow.sidecars import parse_entities, sidecar_path
+
+
+def _write_sidecar(rootdir, subject, task, metadata):
+    path = os.path.join(rootdir, f'sub-{subject}', 'func', f'sub-{subject}_task-{task}_bold.json')
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    with open(path, 'w') as f:
+        json.dump(metadata, f)
+    return path
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    rootdir = str(tmp_path / 'dataset')
+    for subject in ('01', '02'):
+        for task in ('rest', 'nback'):
+            _write_sidecar(rootdir, subject, task, {'SliceTiming': [0, 1], 'TaskName': task, 'subject': subject})
+    os.makedirs(os.path.join(rootdir, '.neuroworkflow'))
+    with open(os.path.join(rootdir, '.neuroworkflow', 'manifest.json'), 'w') as f:
+        f.write('{}')
+    return rootdir
+
+
+def test_parse_entities():
+
+    assert parse_entities('sub-01/ses-1/func/sub-01_ses-1_task-rest_echo-2_bold.nii.gz') == {'sub': '01', 'ses': '1', 'task': 'rest', 'echo': '2', 'suffix': 'bold', 'datatype': 'func'}
+    assert sidecar_path('sub-01_bold.nii.gz') == 'sub-01_bold.json'
+    assert sidecar_path('sub-01_bold.json') == 'sub-01_bold.json'
+
+
+def test_index_get_and_find(dataset):
+
+    index = SidecarIndex(dataset, max_workers = 2)
+    assert len(index) == 4 #hidden directories are not indexed
+
+    image = os.path.join(dataset, 'sub-01', 'func', 'sub-01_task-rest_bold.nii.gz')
+    assert image in index
+    assert index.get(image)['TaskName'] == 'rest'
+    assert sorted(metadata['subject'] for _, metadata in index.find(task = 'rest', suffix = 'bold')) == ['01', '02']
+    assert index.find(sub = '03') == []
+    with pytest.raises(KeyError):
+        index.get(os.path.join(dataset, 'sub-03_bold.nii'))
+
+
+def test_cache_file_parses_only_changed_sidecars(dataset, tmp_path, monkeypatch):
+
+    cache_file = str(tmp_path / 'cache' / 'sidecars.json')
+    SidecarIndex(dataset, cache_file = cache_file)
+
+    changed = _write_sidecar(dataset, '01', 'rest', {'TaskName': 'changed'})
+    os.remove(os.path.join(dataset, 'sub-02', 'func', 'sub-02_task-nback_bold.json'))
+    parsed = []
+    read_json = sidecars._read_json
+    monkeypatch.setattr(sidecars, '_read_json', lambda path: parsed.append(path) or read_json(path))
+
+    index = SidecarIndex(dataset, cache_file = cache_file)
+    assert parsed == [changed]
+    assert len(index) == 3
+    assert index.get(changed)['TaskName'] == 'changed'
+
+
+def test_get_sidecar(dataset, monkeypatch):
+
+    path = _write_sidecar(dataset, '03', 'rest', {'TaskName': 'outside'}) #not in an index
+    assert get_sidecar(path.replace('.json', '.nii.gz'))['TaskName'] == 'outside'
+
+    monkeypatch.setattr(sidecars, '_shared', {})
+    index = SidecarIndex.shared(dataset)
+    assert SidecarIndex.shared(dataset) is index
+    monkeypatch.setattr(sidecars, '_read_json', lambda path: pytest.fail(f'{path} is parsed again'))
+    assert get_sidecar(path)['TaskName'] == 'outside'
+    assert get_sidecar(os.path.join(dataset, 'sub-02', 'func', 'sub-02_task-rest_bold.nii'))['subject'] == '02'
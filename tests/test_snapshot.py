@@ -0,0 +1,88 @@
+import os
+
+import pytest
+
+from src.neuroworkflow import RunMetaData, Work, Workflow
+from src.neuroworkflow.snapshot import FileSnapshot
+
+from conftest import derived
+
+
+def copy(input_files, output_files):
+    with open(input_files[0], 'r') as f:
+        content = f.read()
+    with open(output_files[0], 'w') as f:
+        f.write(content)
+
+
+def fail(input_files, output_files):
+    raise RuntimeError('failed')
+
+
+def test_trust_answers_from_the_first_listing(tmp_path):
+
+    (tmp_path / 'a.nii').write_text('a')
+    snapshot = FileSnapshot('trust')
+    assert snapshot.exists(str(tmp_path / 'a.nii'))
+    assert snapshot.stat(str(tmp_path / 'a.nii')).st_size == 1
+
+    #changed by another program, not seen
+    (tmp_path / 'b.nii').write_text('b')
+    assert not snapshot.exists(str(tmp_path / 'b.nii'))
+
+    #changed by a work, which tells the snapshot
+    snapshot.invalidate(str(tmp_path / 'b.nii'))
+    assert snapshot.exists(str(tmp_path / 'b.nii'))
+    os.remove(tmp_path / 'a.nii')
+    snapshot.discard(str(tmp_path / 'a.nii'))
+    assert not snapshot.exists(str(tmp_path / 'a.nii'))
+    with pytest.raises(FileNotFoundError):
+        snapshot.stat(str(tmp_path / 'a.nii'))
+
+
+def test_validate_reads_a_changed_directory_again(tmp_path):
+
+    snapshot = FileSnapshot('validate')
+    assert not snapshot.exists(str(tmp_path / 'a.nii'))
+    (tmp_path / 'a.nii').write_text('a')
+    os.utime(tmp_path, ns = (0, os.stat(tmp_path).st_mtime_ns + 10 ** 9)) #a coarse mtime may not change in the same tick
+    assert snapshot.exists(str(tmp_path / 'a.nii'))
+
+
+def test_invalidate_of_a_file_which_was_not_created(tmp_path):
+
+    snapshot = FileSnapshot('trust')
+    assert not snapshot.exists(str(tmp_path / 'a.nii'))
+    snapshot.invalidate(str(tmp_path / 'a.nii'))
+    assert not snapshot.exists(str(tmp_path / 'a.nii'))
+
+
+def test_makedirs(tmp_path):
+
+    snapshot = FileSnapshot('trust')
+    directory = str(tmp_path / 'sub-01' / 'func')
+    assert snapshot.makedirs([directory, directory]) == [directory]
+    assert snapshot.exists(directory) and snapshot.exists(str(tmp_path / 'sub-01'))
+    assert snapshot.makedirs([directory]) == []
+
+    with pytest.raises(ValueError):
+        FileSnapshot('always')
+
+
+@pytest.mark.parametrize('fs_snapshot', [None, 'trust', 'validate'])
+def test_run_with_snapshot(rootdir, raw, fs_snapshot):
+
+    first, second, third = derived(raw, 'first'), derived(raw, 'second'), derived(raw, 'third')
+    workflow = Workflow('wf', [
+        Work('first', [raw], [first], action = copy),
+        Work('second', [first], [second], action = copy),
+        Work('fail', [raw], [third], action = fail, exception_tolerance = True),
+        Work('third', [third], [derived(raw, 'fourth')], action = copy),
+        ])
+
+    run_metadata = RunMetaData(rootdir, '01', fs_snapshot = fs_snapshot)
+    raw.run_metadata = run_metadata
+    #an output of a failed action is not taken as existing by works after it
+    with pytest.raises(ValueError, match = 'does not exist'):
+        workflow.run(run_metadata)
+    assert open(second.use_name()).read() == 'raw'
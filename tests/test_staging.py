@@ -0,0 +1,68 @@
+import os
+
+import pytest
+
+from src.neuroworkflow import RunMetaData, Work, Workflow, stage, stage_copy, stage_file
+from src.neuroworkflow.staging import STAGE_STRATEGIES, COPY_STRATEGIES
+
+from conftest import derived, raw_path
+
+
+@pytest.mark.parametrize('strategy', [strategy for strategy in STAGE_STRATEGIES if strategy != 'reflink'])
+def test_stage_file_with_each_strategy(tmp_path, strategy):
+
+    source = tmp_path / 'source.nii'
+    source.write_bytes(os.urandom(3 * 1024 * 1024 + 7))
+    destination = tmp_path / 'destination.nii'
+    destination.write_text('stale')
+
+    assert stage_file(str(source), str(destination), (strategy,)) == strategy
+    assert destination.read_bytes() == source.read_bytes()
+    assert (os.stat(destination).st_ino == os.stat(source).st_ino) == (strategy == 'hardlink')
+
+
+def test_stage_file_falls_back(tmp_path):
+
+    source = tmp_path / 'source.nii'
+    source.write_text('raw')
+
+    #reflink is not supported by most file systems of tests, the next strategy is used then
+    strategy = stage_file(str(source), str(tmp_path / 'destination.nii'), COPY_STRATEGIES)
+    assert strategy in COPY_STRATEGIES
+    assert (tmp_path / 'destination.nii').read_text() == 'raw'
+
+
+def test_stage_file_rejects_bad_arguments(tmp_path):
+
+    source = tmp_path / 'source.nii'
+    source.write_text('raw')
+
+    with pytest.raises(ValueError, match = 'unknown strategies'):
+        stage_file(str(source), str(tmp_path / 'destination.nii'), ('rsync',))
+    with pytest.raises(ValueError, match = 'the same file'):
+        stage_file(str(source), str(source))
+    assert source.read_text() == 'raw'
+
+
+@pytest.mark.parametrize('action', [stage, stage_copy])
+def test_stage_actions_pair_inputs_and_outputs(rootdir, raw, action):
+
+    sbref = derived(raw, 'sbref')
+    with open(os.path.join(rootdir, 'sub-01', 'func', 'sub-01_desc-sbref_bold.nii'), 'w') as f:
+        f.write('sbref')
+    staged_raw, staged_sbref = derived(raw, 'stagedraw'), derived(raw, 'stagedsbref')
+    workflow = Workflow('wf', [Work('stage', [raw, sbref], [staged_raw, staged_sbref], action = action)])
+
+    run_metadata = RunMetaData(rootdir, '01')
+    raw.run_metadata = sbref.run_metadata = run_metadata
+    workflow.run(run_metadata)
+
+    assert open(staged_raw.use_name()).read() == 'raw'
+    assert open(staged_sbref.use_name()).read() == 'sbref'
+    if action is stage_copy: #changing the output in place never changes the raw file
+        with open(staged_raw.use_name(), 'w') as f:
+            f.write('changed')
+        assert open(raw_path(rootdir, '01')).read() == 'raw'
+
+    with pytest.raises(ValueError, match = 'same number'):
+        action([raw.use_name()], [])
@@ -0,0 +1,71 @@
+import os
+import time
+
+import pytest
+
+from src.neuroworkflow import RunMetaData, Work, Workflow
+
+from conftest import derived, raw_path
+
+
+def copy(input_files, output_files):
+    with open(input_files[0], 'r') as f:
+        content = f.read()
+    with open(output_files[0], 'w') as f:
+        f.write(content)
+
+
+@pytest.fixture
+def pipeline(raw):
+    '''
+    raw -> first -> second, raw -> other
+    '''
+    first, second, other = derived(raw, 'first'), derived(raw, 'second'), derived(raw, 'other')
+    workflow = Workflow('wf', [
+        Work('first', [raw], [first], action = copy),
+        Work('other', [raw], [other], action = copy),
+        Work('second', [first], [second], action = copy),
+        ])
+    return workflow, first, second, other
+
+
+def _run(workflow, raw, rootdir):
+    run_metadata = RunMetaData(rootdir, '01')
+    raw.run_metadata = run_metadata
+    workflow.run(run_metadata)
+
+
+def test_only_needed_works_are_extracted(raw, pipeline):
+
+    workflow, first, second, other = pipeline
+    assert [work.name for work in workflow.subworkflow([second]).work_list] == ['first', 'second']
+    assert [work.name for work in workflow.subworkflow([first, other]).work_list] == ['first', 'other']
+
+    with pytest.raises(ValueError, match = 'not produced'):
+        workflow.subworkflow([raw])
+
+
+def test_up_to_date_works_are_pruned(rootdir, raw, pipeline):
+
+    workflow, first, second, other = pipeline
+    _run(workflow, raw, rootdir)
+    assert workflow.subworkflow([second], RunMetaData(rootdir, '01')).work_list == []
+
+    #second is stale, first is up to date and stands in for its output
+    os.remove(second.use_name())
+    first_mtime = os.stat(first.use_name()).st_mtime_ns
+    subworkflow = workflow.subworkflow([second], RunMetaData(rootdir, '01'))
+    assert [work.name for work in subworkflow.work_list] == ['first', 'second']
+    _run(subworkflow, raw, rootdir)
+    assert open(second.use_name()).read() == 'raw'
+    assert os.stat(first.use_name()).st_mtime_ns == first_mtime
+
+    #a newer input makes the whole chain stale
+    later = time.time() + 10
+    with open(raw_path(rootdir, '01'), 'w') as f:
+        f.write('new')
+    os.utime(raw_path(rootdir, '01'), (later, later))
+    subworkflow = workflow.subworkflow([second], RunMetaData(rootdir, '01'))
+    _run(subworkflow, raw, rootdir)
+    assert open(second.use_name()).read() == 'new'
+    assert open(other.use_name()).read() == 'raw'